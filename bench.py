@@ -0,0 +1,366 @@
+"""Benchmarks de la interfaz sin ventana (driver SDL dummy)
+
+Uso: python bench.py [--output bench_results.json] [--sizes 10 100 1000 10000] [--quick]
+
+Mide el ajuste de líneas, el tiempo de render_chat, la carga de conversaciones (con la memoria de
+superficies) y la latencia envío→pantalla contra un endpoint de completions falso en localhost.
+Todo se ejecuta en un directorio temporal: no toca el historial ni las cachés reales.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from perfil import stats
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+os.environ.setdefault("VOICE_PROCESS", "0")
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+LENGTHS = {"short": 40, "medium": 400, "long": 4000, "very_long": 20000}  # Caracteres por mensaje
+WORDS = (
+    "el la de que y a en un ser se no haber por con su para como estar tener le lo todo pero más "
+    "hacer o poder decir este ir otro ese si me ya ver porque dar cuando él muy sin vez mucho saber "
+    "qué sobre mi alguno mismo yo también hasta año dos querer entre así primero desde grande eso "
+    "ni nos llegar pasar tiempo ella sí día uno bien poco deber entonces poner cosa tanto hombre "
+    "parecer nuestro tan donde ahora parte después vida quedar siempre creer hablar llevar dejar "
+    "configuración rendimiento optimización arquitectura internacionalización"
+).split()
+
+
+def synthetic_text(rng: random.Random, length: int) -> str:
+    words = []
+    size = 0
+    while size < length:
+        word = rng.choice(WORDS)
+        words.append(word)
+        size += len(word) + 1
+    return " ".join(words)[:length]
+
+
+def synthetic_conversation(count: int, length: int, seed: int = 0) -> list:
+    rng = random.Random(seed)
+    return [
+        {
+            'sender': "Tú" if i % 2 == 0 else "Asistente",
+            # Longitud variable alrededor del perfil, como en una conversación real
+            'content': synthetic_text(rng, max(1, int(length * rng.uniform(0.5, 1.5)))),
+            'timestamp': "12:00",
+        }
+        for i in range(count)
+    ]
+
+
+class FakeCompletionServer:
+    """Endpoint /v1/chat/completions compatible con OpenAI, con retardos configurables"""
+
+    def __init__(self, first_token_delay: float = 0.05, chunk_delay: float = 0.005, reply_words: int = 60):
+        self.first_token_delay = first_token_delay
+        self.chunk_delay = chunk_delay
+        self.reply_words = reply_words
+        self.requests = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # Keep-alive, como el proveedor real
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b"{}")
+                server.requests += 1
+                words = [f"palabra{i}" for i in range(server.reply_words)]
+                time.sleep(server.first_token_delay)
+                if not body.get("stream"):
+                    payload = json.dumps({
+                        "id": "bench", "object": "chat.completion", "created": 0, "model": body.get("model"),
+                        "choices": [{"index": 0, "finish_reason": "stop",
+                                     "message": {"role": "assistant", "content": " ".join(words)}}],
+                    }).encode('utf-8')
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(payload)))
+                    self.end_headers()
+                    self.wfile.write(payload)
+                    return
+
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                try:
+                    for i, word in enumerate(words):
+                        chunk = {
+                            "id": "bench", "object": "chat.completion.chunk", "created": 0, "model": body.get("model"),
+                            "choices": [{"index": 0, "finish_reason": None,
+                                         "delta": {"content": word if i == 0 else " " + word}}],
+                        }
+                        self.write_chunk(f"data: {json.dumps(chunk)}\n\n")
+                        if server.chunk_delay:
+                            time.sleep(server.chunk_delay)
+                    self.write_chunk("data: [DONE]\n\n")
+                    self.wfile.write(b"0\r\n\r\n")
+                except (BrokenPipeError, ConnectionResetError):
+                    self.close_connection = True  # El cliente canceló la petición
+
+            def write_chunk(self, text: str):
+                data = text.encode('utf-8')
+                self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b"\r\n")
+                self.wfile.flush()
+
+        class Server(ThreadingHTTPServer):
+            request_queue_size = 256  # Con la cola por defecto (5) las conexiones simultáneas esperan al reintento de SYN
+
+        self.httpd = Server(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}/v1"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class Benchmarks:
+    def __init__(self, grafica, ui):
+        self.grafica = grafica
+        self.ui = ui
+
+    def show(self, messages: list):
+        """Pone la conversación en pantalla sin pasar por el almacén"""
+        ui = self.ui
+        ui.start_session()
+        ui.menu_active = False
+        ui.showing_history = False
+        ui.chat_history = [self.grafica.ChatMessage.from_dict(msg) for msg in messages]
+        ui.text_wrapper.word_widths.clear()  # Ajuste en frío
+
+    def layout(self, messages: list) -> dict:
+        self.show(messages)
+        chars = sum(len(msg['content']) for msg in messages)
+        start = time.perf_counter()
+        self.ui.layout_messages()
+        elapsed = time.perf_counter() - start
+        lines = sum(len(msg.layout.lines) for msg in self.ui.chat_history)
+        return {
+            "seconds": elapsed,
+            "messages_per_s": len(messages) / elapsed if elapsed else None,
+            "chars_per_s": chars / elapsed if elapsed else None,
+            "lines": lines,
+        }
+
+    def render(self, frames: int) -> dict:
+        """Recorre la conversación de arriba abajo repintando el chat en cada fotograma"""
+        ui = self.ui
+        max_scroll = max(0, ui.chat_surface_height - ui.chat_view_height())
+        samples = []
+        peak_memory = 0
+        for frame in range(frames):
+            ui.scroll_offset = max_scroll * frame // max(1, frames - 1)
+            start = time.perf_counter()
+            ui.screen.fill(ui.theme.background)
+            ui.render_chat()
+            samples.append(time.perf_counter() - start)
+            peak_memory = max(peak_memory, ui.surface_memory())
+        return {"frame_time": stats(samples), "peak_surface_bytes": peak_memory}
+
+    def load(self, messages: list) -> dict:
+        ui = self.ui
+        store = ui.store
+        conversation_id = store.new_conversation()
+        for position, message in enumerate(messages):
+            store.append_message(conversation_id, position, message)
+        store.flush()
+
+        ui.text_wrapper.word_widths.clear()
+        start = time.perf_counter()
+        ui.load_conversation(conversation_id)
+        loaded = time.perf_counter() - start
+        ui.invalidate()
+        ui.render()
+        first_frame = time.perf_counter() - start
+        return {
+            "load_seconds": loaded,
+            "load_to_first_frame_seconds": first_frame,
+            "surface_bytes_after_load": ui.surface_memory(),
+        }
+
+    def typing(self, pasted: str, keystrokes: int) -> dict:
+        """Tiempo por pulsación (edición y repintado de la caja) con texto ya pegado en la entrada"""
+        import pygame
+        ui = self.ui
+        ui.reset_chat()
+        ui.menu_active = False
+        ui.input_active = True
+        ui.input_text = pasted
+        samples = []
+        for i in range(keystrokes):
+            event = pygame.event.Event(pygame.KEYDOWN, key=pygame.K_a, mod=0, unicode="a")
+            start = time.perf_counter()
+            ui.handle_keydown(event)
+            ui.render_input_area()
+            samples.append(time.perf_counter() - start)
+        ui.input_text = ""
+        return {"pasted_chars": len(pasted), "keystroke": stats(samples)}
+
+    def latency(self, rounds: int) -> dict:
+        """Tiempo desde send_message hasta el primer fragmento y la respuesta completa en pantalla"""
+        ui = self.ui
+        first_chunk, complete = [], []
+        for i in range(rounds):
+            ui.reset_chat()
+            ui.menu_active = False
+            ui.input_text = f"pregunta {i}"
+            start = time.perf_counter()
+            ui.send_message()
+            first = None
+            deadline = start + 30
+            while time.perf_counter() < deadline:
+                ui.handle_events()
+                if ui.full_redraw or ui.dirty_regions:
+                    ui.render()
+                if first is None and ui.pending_received:
+                    first = time.perf_counter() - start
+                if not ui.waiting_for_response:
+                    break
+                time.sleep(0.0005)
+            else:
+                raise RuntimeError("La respuesta no llegó a tiempo")
+            complete.append(time.perf_counter() - start)
+            first_chunk.append(first if first is not None else complete[-1])
+        return {"first_chunk": stats(first_chunk), "complete": stats(complete)}
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks de la interfaz sin ventana")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 10000])
+    parser.add_argument("--lengths", nargs="+", choices=list(LENGTHS), default=list(LENGTHS))
+    parser.add_argument("--max-chars", type=int, default=5_000_000,
+                        help="se omiten las combinaciones con más caracteres en total")
+    parser.add_argument("--frames", type=int, default=120)
+    parser.add_argument("--rounds", type=int, default=20, help="mensajes enviados para medir latencia")
+    parser.add_argument("--keystrokes", type=int, default=500, help="pulsaciones por caso de escritura")
+    parser.add_argument("--first-token-delay", type=float, default=0.05)
+    parser.add_argument("--chunk-delay", type=float, default=0.005)
+    parser.add_argument("--replay", help="usa respuestas grabadas (RECORD_FILE) en lugar del endpoint falso")
+    parser.add_argument("--replay-speed", type=float, default=1.0)
+    parser.add_argument("--quick", action="store_true", help="tamaños y repeticiones reducidos")
+    args = parser.parse_args()
+    if args.quick:
+        args.sizes = [size for size in args.sizes if size <= 1000]
+        args.frames = 30
+        args.rounds = 5
+        args.keystrokes = 100
+    output = os.path.abspath(args.output)
+    replay = os.path.abspath(args.replay) if args.replay else None
+
+    server = FakeCompletionServer(args.first_token_delay, args.chunk_delay).start()
+    workdir = tempfile.TemporaryDirectory(prefix="chatbot-bench-")
+    os.chdir(workdir.name)  # Bases de datos y cachés desechables
+
+    import grafica
+    from motor import ChatEngine
+    from peticiones import RequestWorker
+    from proveedores import OpenAIBackend, ReplayBackend
+    grafica.engine.close()
+    if replay:
+        backend = ReplayBackend(replay, speed=args.replay_speed)
+    else:
+        backend = OpenAIBackend(server.base_url, "bench")
+    grafica.engine = ChatEngine(RequestWorker(backend), cache_responses=False)
+    grafica.voice_control.active = False
+
+    ui = grafica.ChatUI()
+    bench = Benchmarks(grafica, ui)
+    results = {"layout": [], "render_chat": [], "load_conversation": [], "typing": [], "latency": None}
+
+    for length_name in args.lengths:
+        for size in args.sizes:
+            if size * LENGTHS[length_name] > args.max_chars:
+                print(f"omitido {size} x {length_name}")
+                continue
+            messages = synthetic_conversation(size, LENGTHS[length_name])
+            case = {"messages": size, "length": length_name}
+            layout = bench.layout(messages)
+            results["layout"].append({**case, **layout})
+            render = bench.render(args.frames)
+            results["render_chat"].append({**case, **render})
+            load = bench.load(messages)
+            load["peak_surface_bytes"] = bench.render(args.frames)["peak_surface_bytes"]
+            results["load_conversation"].append({**case, **load})
+            print(f"{size:>6} x {length_name:<9} ajuste {layout['seconds'] * 1000:8.1f} ms  "
+                  f"render p95 {render['frame_time']['p95'] * 1000:6.2f} ms  "
+                  f"carga {load['load_seconds'] * 1000:8.1f} ms")
+
+    # Texto pegado: vacío, 100 KB en una sola línea y 100 KB en líneas cortas
+    for pasted in ("", "palabra " * 12800, "línea de un registro pegado\n" * 3700):
+        typing = bench.typing(pasted, args.keystrokes)
+        results["typing"].append(typing)
+        print(f"escritura con {typing['pasted_chars']:>6} caracteres pegados  "
+              f"p50 {typing['keystroke']['p50'] * 1000:.2f} ms  p95 {typing['keystroke']['p95'] * 1000:.2f} ms")
+
+    results["latency"] = bench.latency(args.rounds)
+    if replay:
+        results["latency"]["replay"] = {"file": replay, "speed": args.replay_speed}
+    else:
+        results["latency"]["server"] = {
+            "first_token_delay": args.first_token_delay,
+            "chunk_delay": args.chunk_delay,
+            "chunks": server.reply_words,
+        }
+    latency = results["latency"]
+    print(f"latencia primer fragmento p50 {latency['first_chunk']['p50'] * 1000:.1f} ms, "
+          f"completa p50 {latency['complete']['p50'] * 1000:.1f} ms")
+
+    import pygame
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "pygame": pygame.version.ver,
+            "platform": platform.platform(),
+            "args": vars(args),
+        },
+        "results": results,
+    }
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"Resultados en {output}")
+
+    ui.store.close()
+    grafica.engine.close()
+    server.close()
+    pygame.quit()
+    os.chdir(REPO_DIR)
+    workdir.cleanup()
+
+
+if __name__ == "__main__":
+    main()
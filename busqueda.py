@@ -0,0 +1,109 @@
+import re
+import sqlite3
+from typing import List, Optional, Tuple
+
+from historial import ConversationStore
+
+# Índice invertido FTS5 sobre messages; los triggers lo mantienen al día en la misma transacción
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+    content,
+    content='messages',
+    content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+    INSERT INTO messages_fts (messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE ON messages BEGIN
+    INSERT INTO messages_fts (messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+    INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content);
+END;
+"""
+
+HIGHLIGHT_START = "\x01"
+HIGHLIGHT_END = "\x02"
+
+
+def build_match(query: str) -> Optional[str]:
+    """Convierte la consulta del usuario en una expresión MATCH de FTS5
+
+    Las palabras sueltas se buscan por prefijo y el texto entre comillas como frase.
+    """
+    terms = []
+    for phrase, word in re.findall(r'"([^"]+)"|(\S+)', query):
+        if phrase:
+            terms.append('"' + phrase.replace('"', '') + '"')
+        else:
+            word = re.sub(r'[^\w]', '', word)
+            if word:
+                terms.append('"' + word + '"*')
+    return " ".join(terms) or None
+
+
+def highlight_segments(snippet: str) -> List[Tuple[str, bool]]:
+    """Divide un fragmento en trozos (texto, resaltado)"""
+    segments = []
+    highlighted = False
+    for part in re.split(f"([{HIGHLIGHT_START}{HIGHLIGHT_END}])", snippet):
+        if part == HIGHLIGHT_START:
+            highlighted = True
+        elif part == HIGHLIGHT_END:
+            highlighted = False
+        elif part:
+            segments.append((part, highlighted))
+    return segments
+
+
+class SearchIndex:
+    """Búsqueda de texto completo sobre todos los mensajes guardados"""
+
+    def __init__(self, store: ConversationStore):
+        self.store = store
+        self.available = True
+        connection = store.reader
+        try:
+            exists = connection.execute(
+                "SELECT 1 FROM sqlite_master WHERE name = 'messages_fts'"
+            ).fetchone()
+            with connection:
+                connection.executescript(FTS_SCHEMA)
+                if not exists:
+                    # Solo la primera vez: indexa los mensajes que ya estaban guardados
+                    connection.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+        except sqlite3.OperationalError as e:
+            print(f"Búsqueda no disponible: {e}")
+            self.available = False
+
+    def search(self, query: str, limit: int = 20) -> List[dict]:
+        """Mensajes que coinciden, ordenados por relevancia (bm25)"""
+        match = build_match(query)
+        if not self.available or match is None:
+            return []
+        # Sin esperar al escritor: lo que sigue en cola (como mucho un lote) aparece en la próxima búsqueda
+        try:
+            rows = self.store.reader.execute(
+                "SELECT m.conversation_id, m.position, m.sender, c.timestamp, "
+                f"snippet(messages_fts, 0, '{HIGHLIGHT_START}', '{HIGHLIGHT_END}', '…', 10) "
+                "FROM messages_fts "
+                "JOIN messages m ON m.id = messages_fts.rowid "
+                "JOIN conversations c ON c.id = m.conversation_id "
+                "WHERE messages_fts MATCH ? ORDER BY rank LIMIT ?",
+                (match, limit)
+            ).fetchall()
+        except sqlite3.OperationalError as e:
+            print(f"Error en la búsqueda: {e}")
+            return []
+        return [
+            {
+                'conversation_id': row[0],
+                'position': row[1],
+                'sender': row[2],
+                'timestamp': row[3],
+                'snippet': highlight_segments(row[4]),
+            }
+            for row in rows
+        ]
@@ -0,0 +1,117 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional
+
+
+def normalize(text: str) -> str:
+    return " ".join(text.split()).casefold()
+
+
+class ResponseCache:
+    """Caché de respuestas en memoria (LRU acotada) con una segunda capa en disco"""
+
+    def __init__(self, path: Optional[str] = 'response_cache.db', max_entries: int = 500,
+                 max_bytes: int = 5 * 1024 * 1024, max_disk_entries: int = 5000,
+                 ttl: float = 7 * 24 * 3600):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_disk_entries = max_disk_entries
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.memory: "OrderedDict[str, tuple]" = OrderedDict()  # clave -> (respuesta, creada)
+        self.memory_bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self.disk = None
+        if path:
+            # Se usa desde los hilos de petición, siempre bajo self.lock
+            self.disk = sqlite3.connect(path, check_same_thread=False)
+            with self.disk:
+                self.disk.execute(
+                    "CREATE TABLE IF NOT EXISTS responses ("
+                    "key TEXT PRIMARY KEY, response TEXT NOT NULL, "
+                    "created REAL NOT NULL, last_used REAL NOT NULL)"
+                )
+
+    @staticmethod
+    def key(model: str, messages: List[dict], temperature: float) -> str:
+        """Hash del modelo, la temperatura y los mensajes normalizados (incluye el prompt de sistema)"""
+        payload = {
+            "model": model,
+            "temperature": round(temperature, 2),
+            "messages": [[m["role"], normalize(m["content"])] for m in messages],
+        }
+        return hashlib.sha256(json.dumps(payload, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None:
+                if now - entry[1] <= self.ttl:
+                    self.memory.move_to_end(key)
+                    self.hits += 1
+                    return entry[0]
+                self._forget(key)
+
+            if self.disk is not None:
+                row = self.disk.execute(
+                    "SELECT response, created FROM responses WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and now - row[1] <= self.ttl:
+                    with self.disk:
+                        self.disk.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+                    self._remember(key, row[0], row[1])
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return row[0]
+
+            self.misses += 1
+            return None
+
+    def put(self, key: str, response: str):
+        now = time.time()
+        with self.lock:
+            self._remember(key, response, now)
+            if self.disk is not None:
+                with self.disk:
+                    self.disk.execute(
+                        "INSERT OR REPLACE INTO responses (key, response, created, last_used) VALUES (?, ?, ?, ?)",
+                        (key, response, now, now)
+                    )
+                    self.disk.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+                    self.disk.execute(
+                        "DELETE FROM responses WHERE key IN ("
+                        "SELECT key FROM responses ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                        (self.max_disk_entries,)
+                    )
+
+    def _remember(self, key: str, response: str, created: float):
+        if key in self.memory:
+            self._forget(key)
+        self.memory[key] = (response, created)
+        self.memory_bytes += len(response.encode('utf-8'))
+        while self.memory and (len(self.memory) > self.max_entries or self.memory_bytes > self.max_bytes):
+            self._forget(next(iter(self.memory)))
+
+    def _forget(self, key: str):
+        response, _ = self.memory.pop(key)
+        self.memory_bytes -= len(response.encode('utf-8'))
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self.memory),
+                "bytes": self.memory_bytes,
+            }
@@ -0,0 +1,86 @@
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+
+class AudioCache:
+    """Audio sintetizado en disco, con expulsión LRU cuando se supera el tamaño máximo
+
+    No es seguro entre hilos: lo usa solo el hilo que maneja el motor de voz.
+    """
+
+    def __init__(self, directory: str = 'voice_cache', max_bytes: int = 50 * 1024 * 1024):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.files: "OrderedDict[str, int]" = OrderedDict()  # clave -> bytes, del menos al más reciente
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+        # El orden LRU se conserva entre ejecuciones a través de la fecha de modificación
+        for path in sorted(self.directory.glob('*.wav'), key=lambda p: p.stat().st_mtime):
+            size = path.stat().st_size
+            if size == 0:
+                path.unlink()
+                continue
+            self.files[path.stem] = size
+            self.total_bytes += size
+        self.evict()
+
+    @staticmethod
+    def key(text: str, voice: Optional[str], rate, volume) -> str:
+        payload = json.dumps([text, voice, rate, round(float(volume), 2)], ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def path(self, key: str) -> Path:
+        return self.directory / f"{key}.wav"
+
+    def get(self, key: str) -> Optional[Path]:
+        if key not in self.files:
+            self.misses += 1
+            return None
+        path = self.path(key)
+        if not path.exists():  # Borrado desde fuera
+            self.total_bytes -= self.files.pop(key)
+            self.misses += 1
+            return None
+        self.files.move_to_end(key)
+        os.utime(path)
+        self.hits += 1
+        return path
+
+    def add(self, key: str) -> bool:
+        """Registra el archivo ya escrito en path(key); False si está vacío o no existe"""
+        path = self.path(key)
+        if not path.exists() or path.stat().st_size == 0:
+            return False
+        if key in self.files:
+            self.total_bytes -= self.files.pop(key)
+        self.files[key] = path.stat().st_size
+        self.total_bytes += self.files[key]
+        self.evict()
+        return True
+
+    def evict(self):
+        # Se conserva siempre el último archivo, aunque por sí solo supere el límite
+        while self.total_bytes > self.max_bytes and len(self.files) > 1:
+            key, size = self.files.popitem(last=False)
+            self.total_bytes -= size
+            try:
+                self.path(key).unlink()
+            except OSError:
+                pass
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self.files),
+            "bytes": self.total_bytes,
+        }
@@ -0,0 +1,298 @@
+"""Prueba de carga del servidor del asistente (servidor_chat.py)
+
+Uso: python carga.py [--sessions 200] [--concurrency 50] [--messages 3] [--mode sse|ws|json]
+                     [--url http://host:puerto] [--output carga.json]
+
+Sin --url arranca en un hilo un servidor local cuyo worker llama al endpoint de completions falso de
+bench.py, en un directorio temporal. Cada cliente virtual abre una sesión, envía --messages mensajes
+(esperando cada respuesta) y la cierra. Se miden sesiones/s, peticiones/s y latencias.
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import struct
+import tempfile
+import threading
+import time
+from typing import AsyncIterator, Callable, Optional, Tuple
+from urllib.parse import urlsplit
+
+from bench import FakeCompletionServer
+from perfil import stats
+
+
+class HTTPClient:
+    """Conexión HTTP/1.1 keep-alive mínima: JSON con Content-Length y eventos SSE por trozos"""
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+
+    async def send(self, method: str, path: str, payload: Optional[dict] = None, headers: str = ""):
+        body = json.dumps(payload).encode('utf-8') if payload is not None else b""
+        self.writer.write((
+            f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n{headers}\r\n"
+        ).encode('latin-1') + body)
+        await self.writer.drain()
+
+    async def read_head(self) -> Tuple[int, dict]:
+        status = int((await self.reader.readline()).split()[1])
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b""):
+                return status, headers
+            name, _, value = line.decode('latin-1').partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+    async def request(self, method: str, path: str, payload: Optional[dict] = None) -> Tuple[int, dict]:
+        await self.send(method, path, payload)
+        status, headers = await self.read_head()
+        body = await self.reader.readexactly(int(headers.get("content-length", 0)))
+        return status, json.loads(body or b"{}")
+
+    async def events(self, path: str, payload: dict) -> AsyncIterator[dict]:
+        """Eventos SSE de la respuesta; un error HTTP llega como {"error": ..., "status": ...}"""
+        await self.send("POST", path, payload)
+        status, headers = await self.read_head()
+        if status != 200:
+            body = await self.reader.readexactly(int(headers.get("content-length", 0)))
+            yield {**json.loads(body or b"{}"), "status": status}
+            return
+        buffer = b""
+        while True:
+            size = int((await self.reader.readline()).strip(), 16)
+            data = await self.reader.readexactly(size + 2)
+            if size == 0:
+                return
+            buffer += data[:-2]
+            while b"\n\n" in buffer:
+                event, buffer = buffer.split(b"\n\n", 1)
+                if event.startswith(b"data: "):
+                    yield json.loads(event[6:])
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+class WSClient(HTTPClient):
+    async def open(self, path: str = "/ws") -> dict:
+        key = base64.b64encode(os.urandom(16)).decode('ascii')
+        await self.send("GET", path, headers=(
+            f"Upgrade: websocket\r\nConnection: Upgrade\r\nSec-WebSocket-Key: {key}\r\n"
+            "Sec-WebSocket-Version: 13\r\n"
+        ))
+        status, _ = await self.read_head()
+        if status != 101:
+            raise RuntimeError(f"Handshake WebSocket rechazado ({status})")
+        return await self.receive()
+
+    async def send_json(self, payload: dict):
+        data = json.dumps(payload).encode('utf-8')
+        mask = os.urandom(4)
+        masked = bytes(b ^ mask[i % 4] for i, b in enumerate(data))
+        if len(data) < 126:
+            header = struct.pack("!BB", 0x81, 0x80 | len(data))
+        else:
+            header = struct.pack("!BBH", 0x81, 0x80 | 126, len(data))
+        self.writer.write(header + mask + masked)
+        await self.writer.drain()
+
+    async def receive(self) -> dict:
+        header = await self.reader.readexactly(2)
+        length = header[1] & 0x7F
+        if length == 126:
+            length = struct.unpack("!H", await self.reader.readexactly(2))[0]
+        elif length == 127:
+            length = struct.unpack("!Q", await self.reader.readexactly(8))[0]
+        return json.loads(await self.reader.readexactly(length))
+
+
+class LoadTest:
+    def __init__(self, host: str, port: int, mode: str, messages: int):
+        self.host = host
+        self.port = port
+        self.mode = mode
+        self.messages = messages
+        self.first_chunk = []
+        self.complete = []
+        self.session_times = []
+        self.errors = 0
+        self.requests = 0
+
+    async def client(self, index: int):
+        start = time.perf_counter()
+        try:
+            if self.mode == "ws":
+                await self.ws_session(index)
+            else:
+                await self.http_session(index)
+            self.session_times.append(time.perf_counter() - start)
+        except (OSError, asyncio.IncompleteReadError, RuntimeError, ValueError) as e:
+            self.errors += 1
+            print(f"cliente {index}: {e}")
+
+    async def http_session(self, index: int):
+        http = HTTPClient(self.host, self.port)
+        await http.connect()
+        try:
+            status, data = await http.request("POST", "/sessions")
+            if status != 201:
+                raise RuntimeError(data.get("error", status))
+            path = f"/sessions/{data['session']}/messages"
+            for turn in range(self.messages):
+                payload = {"content": f"pregunta {turn} del cliente {index}", "stream": self.mode == "sse"}
+                start = time.perf_counter()
+                if self.mode == "sse":
+                    first = None
+                    async for event in http.events(path, payload):
+                        if "error" in event:
+                            raise RuntimeError(event["error"])
+                        if first is None:
+                            first = time.perf_counter() - start
+                    self.first_chunk.append(first)
+                else:
+                    status, data = await http.request("POST", path, payload)
+                    if status != 200:
+                        raise RuntimeError(data.get("error", status))
+                self.complete.append(time.perf_counter() - start)
+                self.requests += 1
+            await http.request("DELETE", path.rsplit("/", 1)[0])
+        finally:
+            http.close()
+
+    async def ws_session(self, index: int):
+        ws = WSClient(self.host, self.port)
+        await ws.connect()
+        try:
+            await ws.open()
+            for turn in range(self.messages):
+                start = time.perf_counter()
+                first = None
+                await ws.send_json({"content": f"pregunta {turn} del cliente {index}"})
+                while True:
+                    event = await ws.receive()
+                    if "error" in event:
+                        raise RuntimeError(event["error"])
+                    if first is None:
+                        first = time.perf_counter() - start
+                    if event.get("done"):
+                        break
+                self.first_chunk.append(first)
+                self.complete.append(time.perf_counter() - start)
+                self.requests += 1
+        finally:
+            ws.close()
+
+    async def run(self, sessions: int, concurrency: int) -> dict:
+        limit = asyncio.Semaphore(concurrency)
+
+        async def limited(index: int):
+            async with limit:
+                await self.client(index)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(limited(i) for i in range(sessions)))
+        elapsed = time.perf_counter() - start
+        return {
+            "seconds": elapsed,
+            "sessions": len(self.session_times),
+            "requests": self.requests,
+            "errors": self.errors,
+            "sessions_per_second": len(self.session_times) / elapsed,
+            "requests_per_second": self.requests / elapsed,
+            "first_chunk": stats(self.first_chunk),
+            "complete": stats(self.complete),
+            "session": stats(self.session_times),
+        }
+
+
+def start_local_server(args) -> Tuple[str, int, Callable[[], None]]:
+    """Servidor del asistente contra el endpoint falso, en su propio hilo y bucle"""
+    from historial import ConversationStore
+    from motor import ChatEngine
+    from peticiones import RequestWorker
+    from proveedores import OpenAIBackend
+    from servidor_chat import ChatServer
+
+    fake = FakeCompletionServer(args.first_token_delay, args.chunk_delay).start()
+    workdir = tempfile.TemporaryDirectory(prefix="chatbot-carga-")
+    store = ConversationStore(os.path.join(workdir.name, "chat_history.db"),
+                              os.path.join(workdir.name, "chat_history.json"))
+    backend = OpenAIBackend(fake.base_url, "carga", max_connections=args.max_concurrent)
+    engine = ChatEngine(RequestWorker(backend, max_concurrent=args.max_concurrent), store=store,
+                        cache_responses=False)
+    server = ChatServer(engine, "127.0.0.1", 0)
+    loop = asyncio.new_event_loop()
+    started = threading.Event()
+
+    def run():
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(server.start())
+        started.set()
+        loop.run_forever()
+
+    threading.Thread(target=run, daemon=True).start()
+    started.wait()
+
+    def cleanup():
+        asyncio.run_coroutine_threadsafe(server.close(), loop).result(timeout=5)
+        loop.call_soon_threadsafe(loop.stop)
+        engine.close()
+        store.close()
+        fake.close()
+        workdir.cleanup()
+
+    return "127.0.0.1", server.port, cleanup
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de carga del servidor del asistente")
+    parser.add_argument("--url", help="servidor ya arrancado; sin esto se arranca uno local")
+    parser.add_argument("--mode", choices=["sse", "ws", "json"], default="sse")
+    parser.add_argument("--sessions", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50, help="clientes a la vez")
+    parser.add_argument("--messages", type=int, default=3, help="mensajes por sesión")
+    parser.add_argument("--max-concurrent", type=int, default=64, help="peticiones simultáneas del worker local")
+    parser.add_argument("--first-token-delay", type=float, default=0.05)
+    parser.add_argument("--chunk-delay", type=float, default=0.005)
+    parser.add_argument("--output", help="guarda los resultados en JSON")
+    args = parser.parse_args()
+
+    cleanup = None
+    if args.url:
+        url = urlsplit(args.url)
+        host, port = url.hostname, url.port or 80
+    else:
+        host, port, cleanup = start_local_server(args)
+
+    try:
+        results = asyncio.run(LoadTest(host, port, args.mode, args.messages).run(args.sessions, args.concurrency))
+    finally:
+        if cleanup is not None:
+            cleanup()
+
+    print(f"{results['sessions']} sesiones, {results['requests']} peticiones, {results['errors']} errores "
+          f"en {results['seconds']:.2f} s")
+    print(f"{results['sessions_per_second']:.1f} sesiones/s, {results['requests_per_second']:.1f} peticiones/s")
+    if results["first_chunk"]["n"]:
+        print(f"primer fragmento p50 {results['first_chunk']['p50'] * 1000:.1f} ms, "
+              f"p95 {results['first_chunk']['p95'] * 1000:.1f} ms")
+    print(f"respuesta completa p50 {results['complete']['p50'] * 1000:.1f} ms, "
+          f"p95 {results['complete']['p95'] * 1000:.1f} ms")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+import threading
+from typing import Callable, Dict, List, Optional
+
+try:
+    import tiktoken
+except ImportError:  # Sin tiktoken se estima ~4 caracteres por token
+    tiktoken = None
+
+MESSAGE_OVERHEAD = 4  # Tokens que añade el formato de chat a cada mensaje
+
+
+class TokenCounter:
+    """Cuenta tokens con caché por contenido de mensaje"""
+
+    max_cached = 10000
+
+    def __init__(self, model: str = "gpt-4o"):
+        self.model = model
+        self.encoding = None
+        self.encoding_loaded = False  # La codificación se carga al contar por primera vez
+        self.cache: Dict[str, int] = {}
+
+    def load_encoding(self):
+        self.encoding_loaded = True
+        if tiktoken is not None:
+            try:
+                self.encoding = tiktoken.encoding_for_model(self.model)
+            except KeyError:
+                self.encoding = tiktoken.get_encoding("o200k_base")
+
+    def count(self, text: str, cache: bool = True) -> int:
+        """Tokens del texto; cache=False para textos que no se repiten (respuestas enteras)"""
+        tokens = self.cache.get(text) if cache else None
+        if tokens is None:
+            if not self.encoding_loaded:
+                self.load_encoding()
+            if self.encoding is not None:
+                tokens = len(self.encoding.encode(text))
+            else:
+                tokens = len(text) // 4 + 1
+            if not cache:
+                return tokens
+            if len(self.cache) >= self.max_cached:
+                self.cache.clear()
+            self.cache[text] = tokens
+        return tokens
+
+    def count_message(self, message: dict) -> int:
+        return self.count(message["content"]) + MESSAGE_OVERHEAD
+
+
+class ContextBuilder:
+    """Arma la petición con los turnos recientes que caben en el presupuesto de tokens
+
+    Los turnos más antiguos se sustituyen por un resumen que se renueva en segundo plano.
+    """
+
+    min_turns_to_summarize = 2  # Se resume por intercambios completos, no turno a turno
+
+    def __init__(self, system_prompt: str, token_budget: int = 3000, reply_tokens: int = 256,
+                 summarizer: Optional[Callable[[str, List[dict]], str]] = None,
+                 counter: Optional[TokenCounter] = None):
+        self.system_prompt = system_prompt
+        self.token_budget = token_budget
+        self.reply_tokens = reply_tokens
+        self.summarizer = summarizer
+        self.counter = counter or TokenCounter()
+        self.lock = threading.Lock()
+        self.summary = ""
+        self.summarized_upto = 0  # Los turnos anteriores a este índice están en el resumen
+        self.summarizing = False
+        self.generation = 0
+
+    def reset(self):
+        with self.lock:
+            self.summary = ""
+            self.summarized_upto = 0
+            self.summarizing = False
+            self.generation += 1
+
+    def build(self, turns: List[dict]) -> List[dict]:
+        """Devuelve los mensajes a enviar; `turns` es la lista role/content de la conversación"""
+        # Resumen y punto de corte se leen juntos: el hilo de resumen los cambia a la vez
+        with self.lock:
+            summary, summarized_upto = self.summary, min(self.summarized_upto, max(len(turns) - 1, 0))
+        head = [{"role": "system", "content": self.system_prompt}]
+        if summary:
+            head.append({"role": "system", "content": f"Resumen de la conversación anterior: {summary}"})
+
+        available = self.token_budget - self.reply_tokens - sum(self.counter.count_message(m) for m in head)
+        # Lo anterior a summarized_upto ya va en el resumen: no se repite
+        first_kept = len(turns)
+        while first_kept > summarized_upto:
+            tokens = self.counter.count_message(turns[first_kept - 1])
+            # El último turno se envía siempre, aunque no quepa
+            if tokens > available and first_kept < len(turns):
+                break
+            available -= tokens
+            first_kept -= 1
+
+        if first_kept - summarized_upto >= self.min_turns_to_summarize:
+            self.schedule_summary(turns, first_kept)
+        return head + turns[first_kept:]
+
+    def schedule_summary(self, turns: List[dict], upto: int):
+        """Resume en segundo plano los turnos que han salido del presupuesto"""
+        with self.lock:
+            if self.summarizer is None or self.summarizing or upto <= self.summarized_upto:
+                return
+            self.summarizing = True
+            previous = self.summary
+            pending = turns[self.summarized_upto:upto]
+            generation = self.generation
+
+        def summary_thread():
+            summary = None
+            try:
+                summary = self.summarizer(previous, pending)
+            except Exception as e:
+                print(f"Error resumiendo la conversación: {e}")
+            with self.lock:
+                if generation != self.generation:
+                    return
+                self.summarizing = False
+                if summary:
+                    self.summary = summary
+                    self.summarized_upto = upto
+
+        threading.Thread(target=summary_thread, daemon=True).start()
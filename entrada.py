@@ -0,0 +1,324 @@
+from typing import List, Optional, Tuple
+
+import pygame
+
+Position = Tuple[int, int]  # (fila, columna)
+
+
+class TextBuffer:
+    """Texto de la caja de entrada como gap buffer de dos niveles
+
+    Las líneas anteriores al cursor están en `above` y las posteriores, invertidas, en `below`; la
+    línea del cursor se parte en `left` y `right` (invertida), de caracteres. Escribir, borrar y
+    mover el cursor son operaciones en la cima de una pila, así que cuestan lo mismo con 100 KB
+    pegados que con el cuadro vacío; solo text() recorre todo el texto.
+    """
+
+    def __init__(self, text: str = ""):
+        self.above: List[str] = []
+        self.below: List[str] = []
+        self.left: List[str] = []
+        self.right: List[str] = []
+        self.length = 0  # Caracteres, incluidos los saltos de línea
+        self.anchor: Optional[Position] = None  # Otro extremo de la selección
+        self.preferred_column: Optional[int] = None  # Columna a conservar al subir y bajar
+        # Desplazamiento de la vista; lo ajusta InputView
+        self.top_row = 0
+        self.scroll_column = 0
+        if text:
+            self.insert(text)
+
+    def __len__(self):
+        return self.length
+
+    @property
+    def row(self) -> int:
+        return len(self.above)
+
+    @property
+    def column(self) -> int:
+        return len(self.left)
+
+    @property
+    def cursor(self) -> Position:
+        return len(self.above), len(self.left)
+
+    def line_count(self) -> int:
+        return len(self.above) + 1 + len(self.below)
+
+    def line_length(self, row: int) -> int:
+        if row == self.row:
+            return len(self.left) + len(self.right)
+        return len(self.line(row))
+
+    def line(self, row: int) -> str:
+        if row < self.row:
+            return self.above[row]
+        if row == self.row:
+            return "".join(self.left) + "".join(reversed(self.right))
+        return self.below[self.row - row]
+
+    def segment(self, row: int, start: int, end: int) -> str:
+        """Caracteres [start, end) de una línea sin reconstruir la del cursor entera"""
+        if row != self.row:
+            return self.line(row)[start:end]
+        column = len(self.left)
+        text = "".join(self.left[start:min(end, column)])
+        if end > column:
+            size = len(self.right)
+            tail = self.right[max(0, size - (end - column)):max(0, size - max(0, start - column))]
+            text += "".join(reversed(tail))
+        return text
+
+    def text(self) -> str:
+        return "\n".join(self.above + [self.line(self.row)] + self.below[::-1])
+
+    def set_text(self, text: str):
+        self.above, self.below, self.left, self.right = [], [], [], []
+        self.length = 0
+        self.anchor = None
+        self.preferred_column = None
+        self.top_row = self.scroll_column = 0
+        self.insert(text)
+
+    # --- Edición ---
+
+    def insert(self, text: str):
+        """Escribe en el cursor, sustituyendo la selección si la hay"""
+        self.delete_selection()
+        pieces = text.split("\n")
+        self.left.extend(pieces[0])
+        for piece in pieces[1:]:
+            self.above.append("".join(self.left))
+            self.left = list(piece)
+        self.length += len(text)
+        self.preferred_column = None
+
+    def backspace(self):
+        if self.delete_selection():
+            return
+        if self.left:
+            self.left.pop()
+        elif self.above:
+            self.left = list(self.above.pop())
+        else:
+            return
+        self.length -= 1
+        self.preferred_column = None
+
+    def delete(self):
+        if self.delete_selection():
+            return
+        if self.right:
+            self.right.pop()
+        elif self.below:
+            self.right[:0] = reversed(self.below.pop())
+        else:
+            return
+        self.length -= 1
+        self.preferred_column = None
+
+    # --- Cursor ---
+
+    def move_to(self, row: int, column: int, select: bool = False):
+        """Mueve el cursor; con select extiende la selección en lugar de quitarla"""
+        if select:
+            if self.anchor is None:
+                self.anchor = self.cursor
+        else:
+            self.anchor = None
+        row = max(0, min(row, self.line_count() - 1))
+        if row != self.row:
+            self.right.extend(reversed(self.left))  # Línea entera en right, invertida
+            self.left = []
+            while self.row > row:
+                self.below.append("".join(reversed(self.right)))
+                self.right = list(reversed(self.above.pop()))
+            while self.row < row:
+                self.above.append("".join(reversed(self.right)))
+                self.right = list(reversed(self.below.pop()))
+        column = max(0, min(column, len(self.left) + len(self.right)))
+        while len(self.left) > column:
+            self.right.append(self.left.pop())
+        while len(self.left) < column:
+            self.left.append(self.right.pop())
+
+    def move(self, key: int, select: bool = False):
+        """Flechas, Inicio y Fin; arriba y abajo recuerdan la columna de partida"""
+        row, column = self.cursor
+        if key in (pygame.K_UP, pygame.K_DOWN):
+            if self.preferred_column is None:
+                self.preferred_column = column
+            target = row - 1 if key == pygame.K_UP else row + 1
+            if 0 <= target < self.line_count():
+                self.move_to(target, self.preferred_column, select)
+            else:
+                self.move_to(row, 0 if key == pygame.K_UP else self.line_length(row), select)
+            return
+        self.preferred_column = None
+        selection = None if select else self.selection()
+        if key == pygame.K_LEFT:
+            if selection is not None:
+                self.move_to(*selection[0])
+            elif column > 0:
+                self.move_to(row, column - 1, select)
+            elif row > 0:
+                self.move_to(row - 1, self.line_length(row - 1), select)
+            else:
+                self.move_to(row, column, select)
+        elif key == pygame.K_RIGHT:
+            if selection is not None:
+                self.move_to(*selection[1])
+            elif column < self.line_length(row):
+                self.move_to(row, column + 1, select)
+            elif row < self.line_count() - 1:
+                self.move_to(row + 1, 0, select)
+            else:
+                self.move_to(row, column, select)
+        elif key == pygame.K_HOME:
+            self.move_to(row, 0, select)
+        elif key == pygame.K_END:
+            self.move_to(row, self.line_length(row), select)
+
+    # --- Selección ---
+
+    def select_all(self):
+        self.move_to(0, 0)
+        last = self.line_count() - 1
+        self.move_to(last, self.line_length(last), select=True)
+
+    def selection(self) -> Optional[Tuple[Position, Position]]:
+        """Extremos (inicio, fin) de la selección, o None si está vacía"""
+        if self.anchor is None or self.anchor == self.cursor:
+            return None
+        return min(self.anchor, self.cursor), max(self.anchor, self.cursor)
+
+    def selected_text(self) -> str:
+        selection = self.selection()
+        if selection is None:
+            return ""
+        (start_row, start_column), (end_row, end_column) = selection
+        if start_row == end_row:
+            return self.segment(start_row, start_column, end_column)
+        lines = [self.line(start_row)[start_column:]]
+        lines.extend(self.line(row) for row in range(start_row + 1, end_row))
+        lines.append(self.line(end_row)[:end_column])
+        return "\n".join(lines)
+
+    def delete_selection(self) -> bool:
+        """Borra la selección de una vez (sin ir carácter a carácter); False si no había"""
+        selection = self.selection()
+        self.anchor = None
+        if selection is None:
+            return False
+        (start_row, start_column), (end_row, end_column) = selection
+        self.move_to(start_row, start_column)
+        if start_row == end_row:
+            removed = end_column - start_column
+            del self.right[len(self.right) - removed:]
+        else:
+            removed = len(self.right) + 1
+            middle = end_row - start_row - 1
+            if middle:
+                removed += sum(len(line) + 1 for line in self.below[-middle:])
+                del self.below[-middle:]
+            removed += end_column
+            self.right = list(reversed(self.below.pop()[end_column:]))
+        self.length -= removed
+        self.preferred_column = None
+        return True
+
+
+class InputView:
+    """Parte visible de un TextBuffer: filas alrededor del cursor y columnas desde scroll_column
+
+    Solo se mide y se dibuja lo que cabe en la caja, nunca la línea entera.
+    """
+
+    def __init__(self, font: pygame.font.Font, max_rows: int):
+        self.font = font
+        self.max_rows = max_rows
+        self.line_height = font.get_linesize()
+        # Ningún carácter es más estrecho que esto: acota cuántos caben en una fila
+        self.min_char_width = max(1, min(font.size(char)[0] for char in "il.,'|!"))
+
+    def rows(self, buffer: TextBuffer) -> int:
+        return min(buffer.line_count(), self.max_rows)
+
+    def visible_columns(self, width: int) -> int:
+        return width // self.min_char_width + 1
+
+    def scroll_to_cursor(self, buffer: TextBuffer, width: int):
+        """Ajusta top_row y scroll_column para que el cursor quede dentro de la caja"""
+        row, column = buffer.cursor
+        rows = self.rows(buffer)
+        buffer.top_row = max(0, min(buffer.top_row, buffer.line_count() - rows))
+        if row < buffer.top_row:
+            buffer.top_row = row
+        elif row >= buffer.top_row + rows:
+            buffer.top_row = row - rows + 1
+
+        margin = min(8, column)  # Al volver hacia atrás se deja ver algo de contexto
+        if column < buffer.scroll_column:
+            buffer.scroll_column = column - margin
+        buffer.scroll_column = max(buffer.scroll_column, column - self.visible_columns(width))
+        while buffer.scroll_column < column and self.font.size(buffer.segment(row, buffer.scroll_column, column))[0] > width:
+            buffer.scroll_column += max(1, (column - buffer.scroll_column) // 4)
+
+    def lines(self, buffer: TextBuffer, width: int) -> List[Tuple[int, str]]:
+        """(fila, texto visible) de cada fila que se ve"""
+        start = buffer.scroll_column
+        end = start + self.visible_columns(width)
+        return [(row, buffer.segment(row, start, end))
+                for row in range(buffer.top_row, buffer.top_row + self.rows(buffer))]
+
+    def x_of(self, buffer: TextBuffer, row: int, column: int, width: int) -> int:
+        """Posición horizontal de una columna relativa al borde izquierdo del texto (hasta width)"""
+        if column <= buffer.scroll_column:
+            return 0
+        column = min(column, buffer.scroll_column + self.visible_columns(width))
+        return min(self.font.size(buffer.segment(row, buffer.scroll_column, column))[0], width)
+
+    def position_at(self, buffer: TextBuffer, x: int, y: int, width: int) -> Position:
+        """Fila y columna bajo un punto relativo a la esquina del texto"""
+        row = min(buffer.top_row + max(0, y) // self.line_height, buffer.line_count() - 1)
+        text = buffer.segment(row, buffer.scroll_column, buffer.scroll_column + self.visible_columns(width))
+        offset = 0
+        for column, char in enumerate(text):
+            char_width = self.font.size(char)[0]
+            if offset + char_width // 2 >= x:
+                return row, buffer.scroll_column + column
+            offset += char_width
+        return row, buffer.scroll_column + len(text)
+
+
+class Clipboard:
+    """Portapapeles del sistema (pygame.scrap) con uno interno si el sistema no está disponible"""
+
+    def __init__(self):
+        self.local = ""
+
+    def get(self) -> str:
+        try:
+            if not pygame.scrap.get_init():
+                pygame.scrap.init()
+            data = pygame.scrap.get("text/plain;charset=utf-8") or pygame.scrap.get(pygame.SCRAP_TEXT)
+        except pygame.error:
+            data = None
+        if not data:
+            return self.local
+        return data.decode("utf-8", errors="replace").rstrip("\x00")
+
+    def put(self, text: str):
+        self.local = text
+        try:
+            if not pygame.scrap.get_init():
+                pygame.scrap.init()
+            pygame.scrap.put(pygame.SCRAP_TEXT, text.encode("utf-8"))
+        except pygame.error:
+            pass  # Queda el portapapeles interno
+
+
+def clean_paste(text: str) -> str:
+    """Normaliza saltos de línea y tabuladores del texto pegado"""
+    return text.replace("\r\n", "\n").replace("\r", "\n").replace("\t", "    ").replace("\x00", "")
@@ -0,0 +1,297 @@
+import re
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from maquetacion import TextWrapper
+
+# Estilos en línea; se combinan (negrita y cursiva a la vez)
+BOLD = 1
+ITALIC = 2
+CODE = 4
+
+Run = Tuple[str, int]  # (texto, estilo)
+
+FENCE = re.compile(r"^\s*(```|~~~)")
+HEADING = re.compile(r"^(#{1,6})\s+(.*)$")
+ITEM = re.compile(r"^(\s*)([-*+]|\d{1,9}[.)])\s+(.*)$")
+INLINE = re.compile(
+    r"`([^`]+)`"
+    r"|\*\*\*(?=\S)(.+?)(?<=\S)\*\*\*"
+    r"|\*\*(?=\S)(.+?)(?<=\S)\*\*|__(?=\S)(.+?)(?<=\S)__"
+    r"|\*(?=\S)(.+?)(?<=\S)\*|(?<!\w)_(?=\S)(.+?)(?<=\S)_(?!\w)"
+)
+INLINE_MARKS = ("`", "*", "_")
+
+
+class Block(NamedTuple):
+    """Una línea del texto ya clasificada"""
+    kind: str  # "paragraph", "heading", "item", "code", "fence" o "blank"
+    text: str
+    level: int = 0  # Sangría de los elementos de lista
+    marker: str = ""
+
+
+class Line(NamedTuple):
+    """Una línea en pantalla: trozos con estilo a partir de x"""
+    runs: Tuple[Run, ...]
+    x: int
+    width: int  # Ancho ocupado desde x
+    kind: str = "text"  # "code": bloque de código, con fondo propio y recortado en vez de ajustado
+
+
+def parse_inline(text: str, style: int = 0) -> List[Run]:
+    """Trozos de negrita, cursiva y `código`; las marcas sin cerrar se quedan como texto"""
+    if not any(mark in text for mark in INLINE_MARKS):
+        return [(text, style)]
+    runs = []
+    position = 0
+    for match in INLINE.finditer(text):
+        if match.start() > position:
+            runs.append((text[position:match.start()], style))
+        code, bold_italic, bold, bold_alt, italic, italic_alt = match.groups()
+        if code is not None:
+            runs.append((code, style | CODE))
+        elif bold_italic is not None:
+            runs.extend(parse_inline(bold_italic, style | BOLD | ITALIC))
+        elif bold is not None or bold_alt is not None:
+            runs.extend(parse_inline(bold or bold_alt, style | BOLD))
+        else:
+            runs.extend(parse_inline(italic or italic_alt, style | ITALIC))
+        position = match.end()
+    if position < len(text):
+        runs.append((text[position:], style))
+    return runs
+
+
+class Document:
+    """Bloques Markdown de un texto, una línea cada uno
+
+    Las líneas completas no cambian al llegar más texto, así que durante el streaming feed() solo
+    analiza lo nuevo; la línea aún incompleta se re-analiza en cada fragmento (tail).
+    """
+
+    def __init__(self, text: str = ""):
+        self.blocks: List[Block] = []  # Líneas completas
+        self.pending = ""  # Última línea, sin salto todavía
+        self.fence: Optional[str] = None  # Marca del bloque de código abierto
+        self.tail_layout: Optional[tuple] = None  # Maquetación de la línea incompleta (la rellena Formatter)
+        if text:
+            self.feed(text)
+
+    def feed(self, text: str):
+        if "\n" not in text:
+            self.pending += text  # Lo habitual en streaming: la línea sigue creciendo
+            return
+        lines = (self.pending + text).split("\n")
+        self.pending = lines.pop()
+        if lines:
+            self.tail_layout = None
+        for line in lines:
+            self.blocks.append(self.parse_line(line))
+
+    def close(self):
+        """Da por completa la última línea (mensaje terminado)"""
+        if self.pending:
+            self.blocks.append(self.parse_line(self.pending))
+            self.pending = ""
+        self.tail_layout = None
+
+    def tail(self) -> Optional[Block]:
+        """Bloque provisional de la línea incompleta"""
+        if not self.pending:
+            return None
+        return self.parse_line(self.pending, commit=False)
+
+    def parse_line(self, line: str, commit: bool = True) -> Block:
+        fence = FENCE.match(line)
+        if self.fence is not None:
+            if fence and fence.group(1) == self.fence and not line[fence.end():].strip():
+                if commit:
+                    self.fence = None
+                return Block("fence", "")
+            return Block("code", line)
+        if fence:
+            if commit:
+                self.fence = fence.group(1)
+            return Block("fence", line[fence.end():].strip())  # Lenguaje, si lo hay
+        if not line.strip():
+            return Block("blank", "")
+        heading = HEADING.match(line)
+        if heading:
+            return Block("heading", heading.group(2), len(heading.group(1)))
+        item = ITEM.match(line)
+        if item:
+            marker = item.group(2)
+            level = len(item.group(1).expandtabs(4)) // 2
+            return Block("item", item.group(3), level, "•" if marker in "-*+" else marker)
+        return Block("paragraph", line)
+
+
+class Formatter:
+    """Maqueta bloques en líneas de un ancho dado
+
+    Todas las líneas miden lo mismo de alto (el de la fuente normal), así que la altura de un
+    mensaje sigue siendo número de líneas por alto de línea. El código no se ajusta: se recorta.
+    """
+
+    indent = 20  # Píxeles por nivel de lista
+
+    def __init__(self, fonts: Dict[int, object], code_font, wrapper: Optional[TextWrapper] = None):
+        self.wrappers: Dict[int, TextWrapper] = {style: TextWrapper(font) for style, font in fonts.items()}
+        if wrapper is not None:
+            self.wrappers[0] = wrapper  # Comparte la caché de anchos con el ajuste de texto plano
+        self.code_wrapper = TextWrapper(code_font)
+        self.code_font = code_font
+        self.code_char_width = max(1, min(code_font.size(char)[0] for char in "il.,'|!"))
+
+    def font(self, style: int):
+        if style & CODE:
+            return self.code_font
+        return self.wrappers[style & (BOLD | ITALIC)].font
+
+    def wrapper(self, style: int) -> TextWrapper:
+        if style & CODE:
+            return self.code_wrapper
+        return self.wrappers[style & (BOLD | ITALIC)]
+
+    def layout_document(self, document: Document, width: int) -> Tuple[List[Line], int]:
+        """Líneas del documento y cuántas son de bloques completos (las que ya no cambian)"""
+        lines = self.layout(document.blocks, width)
+        stable = len(lines)
+        lines.extend(self.layout_tail(document, width))
+        return lines, stable
+
+    def layout_tail(self, document: Document, width: int) -> List[Line]:
+        """Líneas de la línea incompleta; un párrafo que crece se re-ajusta desde su último renglón"""
+        tail = document.tail()
+        if tail is None:
+            return []
+        previous = document.blocks[-1].kind if document.blocks else None
+        if tail.kind != "paragraph":
+            return self.layout([tail], width, previous)
+
+        runs = parse_inline(tail.text)
+        lines: List[Line] = []
+        checkpoints: List[Optional[Tuple[int, int]]] = []
+        start = (0, 0)
+        cached = document.tail_layout
+        if cached is not None and cached[0] == width and self.extends(cached[1], runs):
+            # El ajuste es voraz: lo anterior al último renglón que empieza en una palabra no cambia
+            _, _, old_lines, old_checkpoints = cached
+            for index in range(len(old_checkpoints) - 1, -1, -1):
+                if old_checkpoints[index] is not None:
+                    lines = old_lines[:index]
+                    checkpoints = old_checkpoints[:index]
+                    start = old_checkpoints[index]
+                    break
+        self.wrap(runs, width, 0, lines, checkpoints, start)
+        document.tail_layout = (width, runs, lines, checkpoints)
+        return list(lines)
+
+    @staticmethod
+    def extends(old: List[Run], new: List[Run]) -> bool:
+        """Si new es old con más texto al final (mismos trozos y estilos)"""
+        if not old or len(new) < len(old) or new[:len(old) - 1] != old[:len(old) - 1]:
+            return False
+        last_text, last_style = old[-1]
+        text, style = new[len(old) - 1]
+        return style == last_style and text.startswith(last_text)
+
+    def layout(self, blocks: List[Block], width: int, previous: Optional[str] = None) -> List[Line]:
+        lines: List[Line] = []
+        for block in blocks:
+            kind = block.kind
+            if kind == "code":
+                lines.append(self.code_line(block.text, width))
+            elif kind == "blank":
+                # Un solo hueco entre párrafos, y ninguno al principio
+                if previous not in (None, "blank"):
+                    lines.append(Line((), 0, 0))
+            elif kind == "heading":
+                lines.extend(self.wrap(parse_inline(block.text, BOLD), width))
+            elif kind == "item":
+                x = block.level * self.indent
+                marker = block.marker + " "
+                marker_width = self.wrappers[0].font.size(marker)[0]
+                item_lines = self.wrap(parse_inline(block.text), width - x - marker_width, x + marker_width)
+                if item_lines:
+                    first = item_lines[0]
+                    item_lines[0] = Line(((marker, 0),) + first.runs, x, first.width + marker_width)
+                else:
+                    item_lines = [Line(((marker, 0),), x, marker_width)]
+                lines.extend(item_lines)
+            elif kind == "paragraph":
+                lines.extend(self.wrap(parse_inline(block.text), width))
+            previous = kind
+        return lines
+
+    def code_line(self, text: str, width: int) -> Line:
+        # Solo se mide lo que puede caber: una línea minificada de 10 KB no cuesta más que una corta
+        text = text.expandtabs(4)[:width // self.code_char_width + 1]
+        return Line(((text, CODE),), 0, min(self.code_font.size(text)[0], width), "code")
+
+    def wrap(self, runs: List[Run], width: int, x: int = 0, lines: Optional[List[Line]] = None,
+             checkpoints: Optional[list] = None, start: Tuple[int, int] = (0, 0)) -> List[Line]:
+        """Ajuste voraz por palabras sobre trozos con estilo; las palabras demasiado largas se parten
+
+        checkpoints recibe, por renglón, el (trozo, carácter) donde empieza su primera palabra, o None
+        si empieza a mitad de una palabra partida; start permite seguir desde uno de ellos.
+        """
+        if lines is None:
+            if len(runs) == 1 and runs[0][1] == 0 and checkpoints is None:
+                # Texto plano, lo más habitual: el ajuste de maquetacion.py, sin trozos que mezclar
+                return [Line(((text, 0),), x, line_width)
+                        for text, line_width in self.wrappers[0].wrap_measured(runs[0][0], width)]
+            lines = []
+        if checkpoints is None:
+            checkpoints = []
+        current: List[List] = []  # [texto, estilo] del renglón en curso
+        current_width = 0
+        line_start: Optional[Tuple[int, int]] = start
+        space = False  # Hay un espacio pendiente antes de la próxima palabra
+        space_width = 0  # Ancho del espacio tras el último trozo del renglón
+
+        for run_index in range(start[0], len(runs)):
+            text, style = runs[run_index]
+            wrapper = self.wrapper(style)
+            offset = start[1] if run_index == start[0] else 0  # Solo se parte lo que falta por ajustar
+            position = offset
+            for index, word in enumerate(text[offset:].split(" ")):
+                if index:
+                    space = True
+                    position += 1
+                word_start = position
+                position += len(word)
+                # Las palabras vacías (espacios dobles) cuentan, como en TextWrapper.wrap
+                word_width = wrapper.word_width(word)
+                gap = space_width if space and current else 0
+                if current and current_width + gap + word_width > width:
+                    lines.append(Line(tuple((t, s) for t, s in current), x, current_width))
+                    checkpoints.append(line_start)
+                    current, current_width, gap = [], 0, 0
+                if not current:
+                    line_start = (run_index, word_start)
+                while word_width > width and len(word) > 1:
+                    cut = wrapper.break_index(word, width)
+                    lines.append(Line(((word[:cut], style),), x, wrapper.word_width(word[:cut])))
+                    checkpoints.append(line_start)
+                    line_start = None
+                    word = word[cut:]
+                    word_width = wrapper.word_width(word)
+                if gap:
+                    # El espacio va con el trozo que no es código, para que el fondo del código no lo cubra
+                    if current[-1][1] & CODE and not style & CODE:
+                        word = " " + word
+                    else:
+                        current[-1][0] += " "
+                if current and current[-1][1] == style:
+                    current[-1][0] += word
+                else:
+                    current.append([word, style])
+                current_width += gap + word_width
+                space_width = wrapper.space_width
+                space = False
+
+        if current:
+            lines.append(Line(tuple((t, s) for t, s in current), x, current_width))
+            checkpoints.append(line_start)
+        return lines
@@ -1,29 +1,59 @@
-import pygame
+from perfil import FrameProfiler, FrameLog, startup  # Lo primero: el informe de arranque mide desde aquí
 import sys
+
+
+def serve_without_ui(argv: list):
+    """--serve: el mismo arranque que servidor_chat.py (su worker y sus opciones), sin ventana ni voz"""
+    import servidor_chat
+    servidor_chat.main([arg for arg in argv if arg != "--serve"])
+
+
+if __name__ == "__main__" and "--serve" in sys.argv[1:]:
+    # Antes de seguir importando: veu arranca el motor de voz y este módulo crea el worker de la ventana
+    serve_without_ui(sys.argv[1:])
+    sys.exit()
+
+import pygame
 from typing import List, Tuple, Dict, Optional
 import time
 from dataclasses import dataclass
+import argparse
 import threading
-import openai
 import os
-import json
-from pathlib import Path
+import weakref
+from collections import OrderedDict
 from veu import voice_control  # Importamos el control de voz
+from maquetacion import TextWrapper, HeightIndex
+from texto import TextRenderer, FontLoader
+from entrada import TextBuffer, InputView, Clipboard, clean_paste
+from formato import Document, Formatter, Line, BOLD, ITALIC, CODE
+from historial import ConversationStore
+from busqueda import SearchIndex
+from cache import ResponseCache
+from peticiones import RequestWorker, ERROR_MESSAGES
+from motor import ChatEngine, ChatSession, create_backend, start_metrics, welcome_message, stream_responses
+from metricas import observe_frame
+startup.mark("módulos importados")
 
-# Configuración del chatbot
-base_url = "https://api.aimlapi.com/v1"
-api_key = os.getenv("API_KEY", "fa0e452867df46829a6434883a5b5d11")
-system_prompt = "Eres un asistente inteligente. Responde de manera clara y útil a cualquier pregunta."
+profile_file = os.getenv("PROFILE_FILE")  # Si se define, se escribe una línea JSON por fotograma
 
-# Configura el cliente OpenAI
-client = openai.OpenAI(
-    base_url=base_url,
-    api_key=api_key,
-)
+# Caché de respuestas (memoria + disco)
+response_cache = ResponseCache()
+
+# Hilo asyncio único para las peticiones de la interfaz; el cliente se crea dentro del hilo
+engine = ChatEngine(RequestWorker(create_backend(), cache=response_cache))
+
+# Frases que se repiten: se sintetizan a disco en segundo plano para que suenen sin espera
+voice_control.warm(["Voz activada", welcome_message, *ERROR_MESSAGES.values()])
 
-# Configuración inicial
-pygame.init()
-pygame.font.init()
+def is_shortcut(mod: int) -> bool:
+    """Ctrl sin Alt: en Windows AltGr llega como Ctrl+Alt, y con él se escriben @ # [ ] { } €"""
+    return bool(mod & pygame.KMOD_CTRL) and not mod & (pygame.KMOD_ALT | pygame.KMOD_MODE)
+
+# Teclas que no editan la caja de entrada: envían, cambian de pestaña o abren paneles
+NON_EDITING_KEYS = {pygame.K_RETURN, pygame.K_TAB, pygame.K_ESCAPE,
+                    pygame.K_F1, pygame.K_F2, pygame.K_F3, pygame.K_F4, pygame.K_F5, pygame.K_F6,
+                    pygame.K_F7, pygame.K_F8, pygame.K_F9, pygame.K_F10, pygame.K_F11, pygame.K_F12}
 
 # Constantes y tipos
 @dataclass
@@ -37,6 +67,8 @@ class ColorTheme:
     button_hover: Tuple[int, int, int]
     scroll_bar: Tuple[int, int, int]
     border: Tuple[int, int, int]
+    selection: Tuple[int, int, int]
+    code_background: Tuple[int, int, int]
 
 LIGHT_THEME = ColorTheme(
     background=(245, 245, 245),
@@ -47,7 +79,9 @@ LIGHT_THEME = ColorTheme(
     button=(70, 130, 180),
     button_hover=(50, 110, 160),
     scroll_bar=(100, 150, 200),
-    border=(200, 200, 200)
+    border=(200, 200, 200),
+    selection=(180, 210, 240),
+    code_background=(225, 228, 232)
 )
 
 DARK_THEME = ColorTheme(
@@ -59,48 +93,169 @@ DARK_THEME = ColorTheme(
     button=(0, 150, 100),
     button_hover=(0, 130, 80),
     scroll_bar=(0, 180, 120),
-    border=(100, 100, 100)
+    border=(100, 100, 100),
+    selection=(40, 100, 80),
+    code_background=(30, 30, 30)
 )
 
 FONT_NAME = 'Segoe UI'
+CODE_FONT_NAME = 'Consolas,DejaVu Sans Mono,Courier New,Liberation Mono'
 FONT_SMALL = 16
 FONT_MEDIUM = 18
 FONT_LARGE = 24
 FONT_TITLE = 28
+HISTORY_PAGE_SIZE = 6
+MAX_TABS = 8
+MAX_BUBBLES = 128  # Burbujas pre-renderizadas en memoria (varias pantallas)
+MAX_INPUT_ROWS = 6  # La caja de entrada crece hasta estas líneas; luego se desplaza
+TAB_WIDTH = 140
+
+class MessageLayout:
+    """Maquetación de un mensaje en pantalla; se descarta cuando la conversación deja de verse"""
+    __slots__ = ("lines", "width", "cache", "document", "stable", "surface", "surface_key", "rect")
+
+    def __init__(self, lines: List[Line], width: int):
+        self.lines = lines
+        self.width = width  # Ancho con el que se ajustaron las líneas
+        self.cache: Dict[int, List[Line]] = {width: lines}  # Líneas ya maquetadas por ancho
+        # Solo mientras llega la respuesta: bloques ya analizados y cuántas líneas no van a cambiar
+        self.document: Optional[Document] = None
+        self.stable = 0
+        # Burbuja pre-renderizada; se descarta al cambiar el contenido, el ancho o el tema
+        self.surface: Optional[pygame.Surface] = None
+        self.surface_key: Optional[tuple] = None
+        self.rect: Optional[pygame.Rect] = None
 
 class ChatMessage:
-    def __init__(self, sender: str, content: str):
-        self.sender = sender
+    # Sin __dict__: en conversaciones largas cada mensaje ocupa solo sus cuatro campos
+    __slots__ = ("sender", "content", "created", "layout", "__weakref__")
+
+    def __init__(self, sender: str, content: str, created: Optional[int] = None):
+        self.sender = sys.intern(sender)  # Unos pocos remitentes compartidos por todos los mensajes
         self.content = content
-        self.timestamp = time.strftime("%H:%M")
-        self.lines: List[str] = []
-        self.bubble_rect: Optional[pygame.Rect] = None
+        self.created = int(time.time()) if created is None else created  # Segundos desde epoch
+        self.layout: Optional[MessageLayout] = None
+
+    @property
+    def timestamp(self) -> str:
+        return time.strftime("%H:%M", time.localtime(self.created))
 
     def to_dict(self):
         return {
             'sender': self.sender,
             'content': self.content,
-            'timestamp': self.timestamp
+            'timestamp': self.timestamp,
+            'created': self.created
         }
 
     @classmethod
     def from_dict(cls, data: dict):
-        message = cls(data['sender'], data['content'])
-        message.timestamp = data['timestamp']
-        return message
+        return cls(data['sender'], data['content'], data.get('created'))
+
+    def clear_layout(self):
+        """El contenido cambió fuera de pantalla: se re-ajusta cuando vuelva a mostrarse"""
+        self.layout = None
+
+class ChatTab:
+    """Una conversación abierta en una pestaña: historial, maquetación y petición en curso
+
+    Los turnos, el contexto y el guardado son de la sesión del motor; la pestaña solo los muestra.
+    """
+
+    def __init__(self, session: ChatSession, chat_surface_height: int):
+        self.session = session
+        self.chat_history: List[ChatMessage] = []
+        self.height_index = HeightIndex()  # Alturas de los mensajes en sumas prefijas
+        self.chat_surface_height = chat_surface_height
+        self.scroll_offset = 0
+        self.input = TextBuffer()  # Texto que se está escribiendo
+        self.welcome_shown = False
+        self.waiting_for_response = False
+        self.pending_message: Optional[ChatMessage] = None  # Burbuja "Escribiendo..." en curso
+        self.pending_received = False  # Si ya llegó el primer fragmento de la respuesta pendiente
+        self.unread = False  # Llegó una respuesta mientras la pestaña no estaba visible
+        self.archived_title: Optional[str] = None  # Si no es None, los mensajes están solo en el almacén
+
+    @property
+    def session_id(self) -> int:
+        return self.session.id  # Identifica la pestaña ante el worker de peticiones
+
+    @property
+    def conversation_id(self) -> Optional[int]:
+        return self.session.conversation_id  # Conversación en el almacén
+
+    def title(self) -> str:
+        if self.archived_title is not None:
+            return self.archived_title
+        for msg in self.chat_history:
+            if msg.sender == "Tú":
+                return msg.content.split("\n", 1)[0][:80]
+        return "Nueva conversación"
+
+    def hide(self):
+        """Libera la memoria de una pestaña que deja de verse
+
+        La maquetación se descarta siempre; los mensajes también si ya están todos guardados en el
+        almacén y no hay respuesta en curso (se vuelven a leer al mostrarla).
+        """
+        for msg in self.chat_history:
+            msg.layout = None
+        self.height_index.clear()
+        if self.conversation_id is not None and not self.waiting_for_response:
+            self.archived_title = self.title()
+            self.chat_history = []
+            self.session.turns = []  # También guardados: resume() los reconstruye al mostrarla
+
+    def show(self, store: ConversationStore):
+        if self.archived_title is not None:
+            messages = store.load_messages(self.conversation_id)
+            self.chat_history = [ChatMessage.from_dict(msg) for msg in messages]
+            engine.resume(self.session, self.conversation_id, messages)
+            self.archived_title = None
+
+def tab_attribute(name: str) -> property:
+    """Atributo de ChatUI que vive en la pestaña activa"""
+    return property(lambda self: getattr(self.tab, name),
+                    lambda self, value: setattr(self.tab, name, value))
 
 class ChatUI:
-    def __init__(self):
+    # Estado de cada conversación: se lee y se escribe en la pestaña activa
+    chat_history = tab_attribute("chat_history")
+    height_index = tab_attribute("height_index")
+    chat_surface_height = tab_attribute("chat_surface_height")
+    scroll_offset = tab_attribute("scroll_offset")
+    input_buffer = tab_attribute("input")
+    welcome_shown = tab_attribute("welcome_shown")
+    waiting_for_response = tab_attribute("waiting_for_response")
+    pending_message = tab_attribute("pending_message")
+    pending_received = tab_attribute("pending_received")
+    session_id = tab_attribute("session_id")
+    conversation_id = tab_attribute("conversation_id")
+
+    def __init__(self, startup_report: bool = False):
+        # Voz y cliente de la API ya arrancan en sus hilos; aquí solo lo necesario para la ventana
+        with startup.phase("pygame.init"):
+            pygame.init()
         self.screen_width, self.screen_height = 1000, 700
-        self.screen = pygame.display.set_mode((self.screen_width, self.screen_height), pygame.RESIZABLE)
-        pygame.display.set_caption('Asistente IA Profesional')
+        with startup.phase("ventana"):
+            self.screen = pygame.display.set_mode((self.screen_width, self.screen_height), pygame.RESIZABLE)
+            pygame.display.set_caption('Asistente IA Profesional')
+        self.startup_report = startup_report
         
         # Fuentes
-        self.font_small = pygame.font.SysFont(FONT_NAME, FONT_SMALL)
-        self.font_medium = pygame.font.SysFont(FONT_NAME, FONT_MEDIUM)
-        self.font_large = pygame.font.SysFont(FONT_NAME, FONT_LARGE)
-        self.font_title = pygame.font.SysFont(FONT_NAME, FONT_TITLE, bold=True)
-        self.font_bold = pygame.font.SysFont(FONT_NAME, FONT_MEDIUM, bold=True)
+        with startup.phase("fuentes"):
+            fonts = FontLoader()
+            self.font_small = fonts.load(FONT_NAME, FONT_SMALL)
+            self.font_medium = fonts.load(FONT_NAME, FONT_MEDIUM)
+            self.font_large = fonts.load(FONT_NAME, FONT_LARGE)
+            self.font_title = fonts.load(FONT_NAME, FONT_TITLE, bold=True)
+            self.font_bold = fonts.load(FONT_NAME, FONT_MEDIUM, bold=True)
+            self.font_italic = fonts.load(FONT_NAME, FONT_MEDIUM, italic=True)
+            self.font_bold_italic = fonts.load(FONT_NAME, FONT_MEDIUM, bold=True, italic=True)
+            self.font_code = fonts.load(CODE_FONT_NAME, FONT_MEDIUM - 2)
+        self.text_renderer = TextRenderer()  # Atlas de glifos + caché LRU de cadenas
+        self.input_view = InputView(self.font_medium, MAX_INPUT_ROWS)
+        self.clipboard = Clipboard()
         
         # Estado de la aplicación
         self.theme = LIGHT_THEME
@@ -109,16 +264,18 @@ class ChatUI:
         self.menu_active = True
         self.input_active = False
         self.scrolling = False
-        self.welcome_shown = False
-        self.waiting_for_response = False
         self.showing_history = False
-        
+
+        # Pestañas; cada una con su conversación y su petición en curso
+        self.tabs: List[ChatTab] = [self.create_tab()]
+        self.active_tab = 0
+
         # Elementos de la UI
-        self.input_text = ""
-        self.chat_history: List[ChatMessage] = []
-        self.scroll_offset = 0
-        self.chat_surface_height = 5000
-        self.chat_surface = pygame.Surface((self.screen_width, self.chat_surface_height))
+        self.text_wrapper = TextWrapper(self.font_medium)
+        self.formatter = Formatter({0: self.font_medium, BOLD: self.font_bold, ITALIC: self.font_italic,
+                                    BOLD | ITALIC: self.font_bold_italic}, self.font_code, self.text_wrapper)
+        self.layout_generation = 0
+        self.bubbles: "OrderedDict[int, weakref.ref]" = OrderedDict()  # Burbujas renderizadas, LRU
         
         # Rectángulos de UI
         self.input_box = pygame.Rect(30, self.screen_height - 80, self.screen_width - 110, 50)
@@ -127,80 +284,173 @@ class ChatUI:
         self.voice_button = pygame.Rect(self.screen_width - 270, 20, 60, 40)  # Botón de voz
         self.history_button = pygame.Rect(self.screen_width - 450, 20, 180, 40)  # Botón de historial
         
+        self.input_rows = 1  # Líneas que ocupa ahora la caja de entrada
+
         # Cursor
         self.cursor_visible = True
-        self.cursor_timer = 0
+        self.cursor_timer = 0  # Instante (ms) del último parpadeo
         self.cursor_blink_interval = 500
+
+        # Zonas pendientes de repintar
+        self.full_redraw = True
+        self.dirty_regions = set()
+        self.hover_state = ()
+
+        # Perfilado de fotogramas (F3 muestra el panel)
+        self.profiler = FrameProfiler()
+        self.show_profiler = False
+        self.frame_log = FrameLog(profile_file) if profile_file else None
+        if self.frame_log:
+            self.profiler.add_hook(self.frame_log)
+        self.profiler.add_hook(observe_frame)
         
-        # Historial de conversaciones
-        self.conversation_history: List[List[ChatMessage]] = []
-        self.load_conversation_history()
-
-    def load_conversation_history(self):
-        """Carga el historial de conversaciones desde el archivo JSON"""
-        history_file = Path('chat_history.json')
-        if history_file.exists():
-            try:
-                with open(history_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    self.conversation_history = [
-                        [ChatMessage.from_dict(msg) for msg in conversation] 
-                        for conversation in data
-                    ]
-                    # Mantener solo las 3 últimas conversaciones
-                    self.conversation_history = self.conversation_history[-3:]
-                    print(f"Historial cargado: {len(self.conversation_history)} conversaciones")
-            except Exception as e:
-                print(f"Error cargando historial: {e}")
-                self.conversation_history = []
-
-    def save_conversation_history(self):
-        """Guarda el historial de conversaciones en el archivo JSON"""
-        history_file = Path('chat_history.json')
-        try:
-            # Convertir todas las conversaciones a formato serializable
-            data = [
-                [msg.to_dict() for msg in conversation] 
-                for conversation in self.conversation_history
-            ]
-            # Mantener solo las 3 últimas conversaciones
-            data = data[-3:]
-            
-            with open(history_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
-            print(f"Historial guardado: {len(data)} conversaciones")
-        except Exception as e:
-            print(f"Error guardando historial: {e}")
-
-    def add_to_history(self):
-        """Añade la conversación actual al historial"""
-        if self.chat_history and len(self.chat_history) > 1:  # Solo guardar si hay conversación real
-            # Añadir la conversación actual al historial
-            self.conversation_history.append(self.chat_history.copy())
-            # Mantener solo las 3 últimas conversaciones
-            self.conversation_history = self.conversation_history[-3:]
-            self.save_conversation_history()
-            print(f"Conversación añadida al historial. Total: {len(self.conversation_history)}")
-
-    def load_conversation(self, index: int):
+        # Historial de conversaciones; los listados se leen al abrir el menú
+        with startup.phase("historial"):
+            self.store = ConversationStore()
+            engine.store = self.store  # Las sesiones guardan cada intercambio al completarse
+        self.history_page = 0
+        self.history_total = 0
+        self.history_items: List[dict] = []  # Metadatos de la página visible del historial
+        self.search_index: Optional[SearchIndex] = None  # Se crea en la primera búsqueda
+        self.search_active = False
+        self.history_query = ""
+        self.search_results: List[dict] = []
+        self.search_time = 0.0
+
+    def end_session(self, tab: ChatTab):
+        """Cancela la respuesta en curso de la pestaña y cierra su sesión; lo completado ya está guardado"""
+        engine.close_session(tab.session)
+        if tab.conversation_id is not None:
+            print(f"Conversación {tab.conversation_id} guardada en el historial")
+
+    def load_conversation(self, conversation_id: int):
         """Carga una conversación del historial"""
-        if 0 <= index < len(self.conversation_history):
-            self.chat_history = self.conversation_history[index].copy()
-            for msg in self.chat_history:
-                self.process_message_lines(msg)
+        for index, tab in enumerate(self.tabs):
+            if tab.conversation_id == conversation_id:
+                # Ya está abierta: dos pestañas escribiendo en ella desordenarían los mensajes
+                self.switch_tab(index)
+                self.showing_history = False
+                return
+        messages = self.store.load_messages(conversation_id)
+        if messages:
+            if self.waiting_for_response:
+                # La pestaña actual espera respuesta: se abre en otra en lugar de cancelarla
+                if len(self.tabs) >= MAX_TABS:
+                    self.showing_history = False
+                    self.add_message("Sistema", f"Hay una respuesta en curso y ya hay {MAX_TABS} pestañas; "
+                                                "cierra una para abrir la conversación.")
+                    return
+                self.tabs.append(self.create_tab())
+                self.switch_tab(len(self.tabs) - 1)
+            self.start_session()
+            self.welcome_shown = True  # Ya tiene su historial; no se añade otro saludo
+            self.chat_history = [ChatMessage.from_dict(msg) for msg in messages]
+            engine.resume(self.tab.session, conversation_id, messages)  # Los mensajes nuevos se añaden a ella
+            self.layout_messages()
             self.scroll_offset = 0
-            self.menu_active = False
-            self.welcome_shown = True
             self.showing_history = False
-            print(f"Conversación {index} cargada")
 
-    def handle_events(self):
+    def load_history_page(self, page: int):
+        """Carga solo los metadatos de una página del historial"""
+        self.history_total = self.store.count_conversations()
+        pages = max(1, (self.history_total + HISTORY_PAGE_SIZE - 1) // HISTORY_PAGE_SIZE)
+        self.history_page = max(0, min(page, pages - 1))
+        self.history_items = self.store.list_conversations(self.history_page * HISTORY_PAGE_SIZE, HISTORY_PAGE_SIZE)
+
+    @property
+    def tab(self) -> ChatTab:
+        return self.tabs[self.active_tab]
+
+    @property
+    def input_text(self) -> str:
+        """Texto completo de la caja de entrada; recorre todo el buffer, solo para enviar"""
+        return self.input_buffer.text()
+
+    @input_text.setter
+    def input_text(self, text: str):
+        self.input_buffer.set_text(text)
+        self.update_input_box()
+
+    def create_tab(self) -> ChatTab:
+        # Ids de sesión únicos entre pestañas: bastan para saber a quién va cada respuesta
+        return ChatTab(engine.create_session(), self.screen_height)
+
+    def tab_for_session(self, session: int) -> Optional[ChatTab]:
+        for tab in self.tabs:
+            if tab.session_id == session:
+                return tab
+        return None  # Conversación ya cerrada o reiniciada
+
+    def new_tab(self):
+        """Abre una conversación nueva en otra pestaña; las demás siguen recibiendo respuestas"""
+        if len(self.tabs) >= MAX_TABS:
+            self.add_message("Sistema", f"No se pueden abrir más de {MAX_TABS} pestañas.")
+            return
+        self.tabs.append(self.create_tab())
+        self.switch_tab(len(self.tabs) - 1)
+        self.start_chat()
+
+    def switch_tab(self, index: int):
+        if index == self.active_tab or not 0 <= index < len(self.tabs):
+            return
+        voice_control.stop()  # Se deja de leer la respuesta de la pestaña anterior
+        self.tab.hide()
+        self.active_tab = index
+        self.tab.show(self.store)
+        self.tab.unread = False
+        self.showing_history = False
+        self.update_input_box()
+        # Re-ajusta lo que cambió mientras estaba oculta y aplica el ancho actual
+        self.layout_messages()
+        self.invalidate()
+
+    def close_tab(self, index: int):
+        """Cierra una pestaña y cancela su petición; la última se reinicia en vez de cerrarse"""
+        if len(self.tabs) == 1:
+            self.reset_chat()
+            return
+        tab = self.tabs[index]
+        self.end_session(tab)
+        if index == self.active_tab:
+            voice_control.stop()
+        del self.tabs[index]
+        if index < self.active_tab or self.active_tab == len(self.tabs):
+            self.active_tab -= 1
+        self.tab.show(self.store)
+        self.update_input_box()
+        self.layout_messages()
+        self.invalidate()
+
+    def handle_tab_key(self, event):
+        """Ctrl+T abre, Ctrl+W cierra y Ctrl+Tab (Ctrl+Mayús+Tab) cambia de pestaña"""
+        if event.key == pygame.K_t:
+            self.new_tab()
+        elif event.key == pygame.K_w:
+            self.close_tab(self.active_tab)
+        elif event.key in (pygame.K_TAB, pygame.K_PAGEDOWN, pygame.K_PAGEUP):
+            step = -1 if event.mod & pygame.KMOD_SHIFT or event.key == pygame.K_PAGEUP else 1
+            self.switch_tab((self.active_tab + step) % len(self.tabs))
+        elif pygame.K_1 <= event.key <= pygame.K_9:
+            self.switch_tab(event.key - pygame.K_1)
+
+    def tab_rects(self) -> Tuple[List[pygame.Rect], pygame.Rect]:
+        """Rectángulos de las pestañas y del botón "+", en el hueco libre de la barra superior"""
+        available = self.history_button.x - 30 - 46
+        width = max(40, min(TAB_WIDTH, available // len(self.tabs) - 6))
+        rects = [pygame.Rect(20 + i * (width + 6), 20, width, 40) for i in range(len(self.tabs))]
+        plus = pygame.Rect(20 + len(self.tabs) * (width + 6), 20, 40, 40)
+        return rects, plus
+
+    def handle_events(self, events=None):
         mouse_pos = pygame.mouse.get_pos()
-        
-        for event in pygame.event.get():
+        if events is None:
+            events = pygame.event.get()
+
+        for event in events:
+            self.track_dirty(event)
+
             if event.type == pygame.QUIT:
-                self.add_to_history()
-                self.running = False
+                self.running = False  # run() cierra las sesiones al salir del bucle
             
             elif event.type == pygame.VIDEORESIZE:
                 self.handle_resize(event.w, event.h)
@@ -220,43 +470,140 @@ class ChatUI:
             elif event.type == pygame.MOUSEWHEEL:
                 self.handle_mouse_wheel(event)
             
-            elif event.type == pygame.USEREVENT and hasattr(event, "response"):
-                self.waiting_for_response = False
-                # Reemplaza "Escribiendo..." con la respuesta real
-                if self.chat_history and self.chat_history[-1].content == "Escribiendo...":
-                    self.chat_history[-1].content = event.response
-                    self.process_message_lines(self.chat_history[-1])
-                else:
-                    self.add_message("Asistente", event.response)
-                self.scroll_offset = max(0, self.chat_surface.get_height() - (self.screen_height - 120))
+            elif event.type == pygame.USEREVENT and hasattr(event, "relayout"):
+                self.apply_relayout(event.relayout, event.width, event.results)
+
+            elif event.type == pygame.USEREVENT and hasattr(event, "session"):
+                # Cada respuesta vuelve a su pestaña, esté visible o no
+                tab = self.tab_for_session(event.session)
+                if tab is None:
+                    continue  # Respuesta de una conversación ya cerrada
+                if hasattr(event, "chunk"):
+                    self.handle_response_chunk(tab, event.chunk)
+                elif hasattr(event, "retry"):
+                    self.handle_retry(tab, event.retry, event.delay)
+                elif hasattr(event, "response"):
+                    self.handle_response(tab, event.response)
         
         self.update_cursor()
 
+    def invalidate(self, region: Optional[str] = None):
+        """Marca una zona ("chat", "input", "toolbar") o toda la pantalla para repintar"""
+        if region is None:
+            self.full_redraw = True
+        else:
+            self.dirty_regions.add(region)
+
+    def track_dirty(self, event):
+        """Decide qué zonas hay que repintar tras un evento"""
+        in_chat = not (self.menu_active or self.showing_history)
+        if event.type == pygame.MOUSEMOTION:
+            if self.scrolling:
+                self.invalidate("chat")
+            elif self.showing_history:
+                self.invalidate()
+            elif in_chat:
+                # Solo se repinta si cambia el botón bajo el ratón
+                hover_state = tuple(button.collidepoint(event.pos) for button in
+                                    (self.send_button, self.new_chat_button, self.history_button))
+                if hover_state != self.hover_state:
+                    self.hover_state = hover_state
+                    self.invalidate("toolbar")
+                    self.invalidate("input")
+        elif (event.type == pygame.KEYDOWN and in_chat and self.input_active
+              and not self.waiting_for_response and event.key not in NON_EDITING_KEYS
+              and not is_shortcut(event.mod)):
+            # Solo la edición de texto se queda en la caja; atajos y teclas de función repintan todo
+            self.invalidate("input")
+        elif event.type in (pygame.TEXTINPUT, pygame.TEXTEDITING, pygame.KEYUP):
+            # El texto ya se escribe en KEYDOWN: como mucho cambia la caja de entrada
+            if in_chat and self.input_active:
+                self.invalidate("input")
+        elif event.type in (pygame.WINDOWMOVED, pygame.WINDOWENTER, pygame.WINDOWLEAVE):
+            pass  # No cambian nada de lo que se ve
+        elif event.type == pygame.USEREVENT and hasattr(event, "chunk"):
+            # Un fragmento de otra pestaña solo cambia su indicador en la barra
+            self.invalidate("chat" if event.session == self.session_id else "toolbar")
+        else:
+            self.invalidate()
+
+    def next_wakeup(self) -> int:
+        """Milisegundos hasta el próximo parpadeo del cursor; 0 si no hay nada que esperar"""
+        if self.menu_active or self.showing_history or not self.input_active or self.waiting_for_response:
+            return 0
+        elapsed = pygame.time.get_ticks() - self.cursor_timer
+        return max(1, self.cursor_blink_interval - elapsed)
+
     def handle_resize(self, width: int, height: int):
         self.screen_width, self.screen_height = width, height
         self.screen = pygame.display.set_mode((width, height), pygame.RESIZABLE)
-        self.input_box.y = height - 80
         self.input_box.width = width - 110
+        self.update_input_box()
         self.send_button.y = height - 80
         self.send_button.x = width - 70
         self.new_chat_button.x = width - 200
         self.voice_button.x = width - 270
         self.history_button.x = width - 450
-        self.chat_surface = pygame.Surface((width, self.chat_surface_height))
+        self.invalidate()
+        self.relayout()
+
+    def relayout(self):
+        """Re-ajusta los mensajes al ancho actual, en segundo plano si no están en caché"""
+        width = self.max_text_width()
+        self.layout_generation += 1
+        if all(msg.layout is not None and width in msg.layout.cache for msg in self.chat_history):
+            self.layout_messages()
+            return
+
+        generation = self.layout_generation
+        snapshot = [(msg, msg.content) for msg in self.chat_history
+                    if msg.layout is None or width not in msg.layout.cache]
+
+        def relayout_thread():
+            results = [(msg, content, self.format_lines(content, width)) for msg, content in snapshot]
+            pygame.event.post(pygame.event.Event(
+                pygame.USEREVENT,
+                {"relayout": generation, "width": width, "results": results}
+            ))
+
+        threading.Thread(target=relayout_thread, daemon=True).start()
+
+    def apply_relayout(self, generation: int, width: int, results):
+        for msg, content, lines in results:
+            if msg.content == content:
+                self.cache_lines(msg, width, lines)
+        if generation == self.layout_generation:
+            self.layout_messages()
 
     def handle_keydown(self, event):
-        if event.key == pygame.K_TAB:
+        if event.key == pygame.K_F3:
+            self.show_profiler = not self.show_profiler
+            self.invalidate()  # El panel se pinta sobre el chat: al quitarlo hay que repintar todo
+        elif is_shortcut(event.mod) and not self.menu_active and not self.showing_history:
+            if not self.handle_input_shortcut(event):
+                self.handle_tab_key(event)
+        elif event.key == pygame.K_TAB:
             self.toggle_theme()
+        elif self.showing_history and self.search_active:
+            self.handle_search_key(event)
         elif event.key == pygame.K_v and not self.input_active:  
-            voice_active = voice_control.toggle()
-            self.add_message("Sistema", f"Voz {'activada' if voice_active else 'desactivada'}")
+            self.toggle_voice()
         elif self.showing_history:
             if event.key == pygame.K_b or event.key == pygame.K_ESCAPE:
                 self.showing_history = False
-            elif event.key in [pygame.K_1, pygame.K_2, pygame.K_3]:
+            elif event.key == pygame.K_SLASH:
+                self.search_active = True
+            elif pygame.K_1 <= event.key < pygame.K_1 + HISTORY_PAGE_SIZE:
                 index = event.key - pygame.K_1
-                if index < len(self.conversation_history):
-                    self.load_conversation(index)
+                if self.history_query:
+                    if index < len(self.search_results):
+                        self.open_search_result(self.search_results[index])
+                elif index < len(self.history_items):
+                    self.load_conversation(self.history_items[index]['id'])
+            elif event.key in (pygame.K_RIGHT, pygame.K_PAGEDOWN):
+                self.load_history_page(self.history_page + 1)
+            elif event.key in (pygame.K_LEFT, pygame.K_PAGEUP):
+                self.load_history_page(self.history_page - 1)
         elif self.menu_active:
             if event.key == pygame.K_c:
                 self.start_chat()
@@ -265,182 +612,541 @@ class ChatUI:
             elif event.key == pygame.K_q:
                 self.running = False
         elif self.input_active and not self.waiting_for_response:
-            if event.key == pygame.K_RETURN and self.input_text.strip():
+            self.handle_input_key(event)
+
+    def handle_input_key(self, event):
+        """Edición en la caja de entrada; Mayús+Enter añade una línea y Mayús+flechas selecciona"""
+        buffer = self.input_buffer
+        shift = event.mod & pygame.KMOD_SHIFT
+        if event.key in (pygame.K_RETURN, pygame.K_KP_ENTER):
+            if shift:
+                buffer.insert("\n")
+            elif self.input_text.strip():
                 self.send_message()
-            elif event.key == pygame.K_BACKSPACE:
-                self.input_text = self.input_text[:-1]
+                return
+        elif event.key == pygame.K_BACKSPACE:
+            buffer.backspace()
+        elif event.key == pygame.K_DELETE:
+            buffer.delete()
+        elif event.key in (pygame.K_LEFT, pygame.K_RIGHT, pygame.K_UP, pygame.K_DOWN, pygame.K_HOME, pygame.K_END):
+            buffer.move(event.key, select=bool(shift))
+        elif event.unicode and event.unicode.isprintable():
+            buffer.insert(event.unicode)
+        else:
+            return
+        self.update_input_box()
+
+    def handle_input_shortcut(self, event) -> bool:
+        """Ctrl+A/C/X/V y Ctrl+Inicio/Fin en la caja de entrada; True si se ha usado"""
+        if not self.input_active or self.waiting_for_response:
+            return False
+        buffer = self.input_buffer
+        if event.key == pygame.K_a:
+            buffer.select_all()
+        elif event.key in (pygame.K_c, pygame.K_x):
+            if buffer.selection() is None:
+                return True
+            self.clipboard.put(buffer.selected_text())
+            if event.key == pygame.K_x:
+                buffer.delete_selection()
+        elif event.key == pygame.K_v:
+            buffer.insert(clean_paste(self.clipboard.get()))
+        elif event.key in (pygame.K_HOME, pygame.K_END):
+            select = bool(event.mod & pygame.KMOD_SHIFT)
+            if event.key == pygame.K_HOME:
+                buffer.move_to(0, 0, select)
             else:
-                self.input_text += event.unicode
+                last = buffer.line_count() - 1
+                buffer.move_to(last, buffer.line_length(last), select)
+        else:
+            return False
+        self.update_input_box()
+        return True
+
+    def input_text_width(self) -> int:
+        return self.input_box.width - 30
+
+    def input_area_height(self) -> int:
+        return 90 + (self.input_rows - 1) * self.input_view.line_height
+
+    def chat_view_height(self) -> int:
+        """Alto visible del chat: lo que deja libre la caja de entrada"""
+        return self.screen_height - 30 - self.input_area_height()
+
+    def update_input_box(self):
+        """Tras editar: desplaza la vista hasta el cursor y hace crecer o encoger la caja"""
+        buffer = self.input_buffer
+        self.input_view.scroll_to_cursor(buffer, self.input_text_width())
+        self.cursor_visible = True  # El cursor no parpadea mientras se escribe
+        self.cursor_timer = pygame.time.get_ticks()
+        self.invalidate("input")
+        rows = self.input_view.rows(buffer)
+        extra = (rows - 1) * self.input_view.line_height
+        self.input_box.y = self.screen_height - 80 - extra
+        self.input_box.height = 50 + extra
+        if rows != self.input_rows:
+            at_bottom = self.scroll_offset >= self.chat_surface_height - self.chat_view_height()
+            self.input_rows = rows
+            if at_bottom:
+                self.scroll_offset = max(0, self.chat_surface_height - self.chat_view_height())
+            self.invalidate()
 
     def handle_mouse_down(self, event, mouse_pos):
         if self.showing_history:
             # Manejar clic en el menú de historial
-            for i in range(len(self.conversation_history)):
+            self.search_active = self.history_search_rect().collidepoint(mouse_pos)
+            if self.search_active:
+                return
+
+            rows = self.search_results if self.history_query else self.history_items
+            for i, row in enumerate(rows):
                 option_rect = pygame.Rect(self.screen_width//2 - 200, 180 + i * 50, 400, 40)
                 if option_rect.collidepoint(mouse_pos):
-                    self.load_conversation(i)
+                    if self.history_query:
+                        self.open_search_result(row)
+                    else:
+                        self.load_conversation(row['id'])
                     return
             
             # Verificar si se hace clic fuera del menú
-            back_rect = pygame.Rect(self.screen_width//2 - 100, 300 + len(self.conversation_history) * 50, 200, 40)
+            back_rect = pygame.Rect(self.screen_width//2 - 100, 300 + len(rows) * 50, 200, 40)
             if not back_rect.collidepoint(mouse_pos):
                 self.showing_history = False
             return
 
+        if not self.menu_active and self.handle_tab_click(event, mouse_pos):
+            return
+
         if self.input_box.collidepoint(mouse_pos) and not self.waiting_for_response:
             self.input_active = True
+            if event.button == 1:
+                row, column = self.input_view.position_at(
+                    self.input_buffer, mouse_pos[0] - self.input_box.x - 15, mouse_pos[1] - self.input_box.y - 15,
+                    self.input_text_width())
+                self.input_buffer.move_to(row, column, select=bool(pygame.key.get_mods() & pygame.KMOD_SHIFT))
+                self.update_input_box()
         else:
             self.input_active = False
         
         if self.send_button.collidepoint(mouse_pos) and self.input_text.strip() and not self.waiting_for_response:
             self.send_message()
         elif self.voice_button.collidepoint(mouse_pos) and not self.input_active:
-            voice_active = voice_control.toggle()
-            self.add_message("Sistema", f"Voz {'activada' if voice_active else 'desactivada'}")
-        elif self.new_chat_button.collidepoint(mouse_pos) and not self.menu_active and not self.waiting_for_response:
-            self.add_to_history()
+            self.toggle_voice()
+        elif self.new_chat_button.collidepoint(mouse_pos) and not self.menu_active:
             self.reset_chat()
-        elif self.history_button.collidepoint(mouse_pos) and not self.waiting_for_response:
+        elif self.history_button.collidepoint(mouse_pos):
             self.show_history_menu()
         elif event.button == 1:  # Clic izquierdo para scroll
             self.scrolling = True
             self.scroll_start_pos = mouse_pos[1]
             self.scroll_start_offset = self.scroll_offset
 
+    def handle_tab_click(self, event, mouse_pos) -> bool:
+        """Clic en la barra de pestañas: izquierdo cambia, central cierra; True si se ha usado"""
+        rects, plus = self.tab_rects()
+        if plus.collidepoint(mouse_pos) and event.button == 1:
+            self.new_tab()
+            return True
+        for index, rect in enumerate(rects):
+            if rect.collidepoint(mouse_pos):
+                if event.button == 1:
+                    self.switch_tab(index)
+                elif event.button == 2:
+                    self.close_tab(index)
+                return True
+        return False
+
     def show_history_menu(self):
         """Muestra el menú de historial de conversaciones"""
-        if not self.conversation_history:
+        self.load_history_page(0)
+        if not self.history_items:
             self.add_message("Sistema", "No hay conversaciones anteriores guardadas.")
             return
         
         self.showing_history = True
         print("Mostrando menú de historial")
 
+    def history_search_rect(self) -> pygame.Rect:
+        return pygame.Rect(self.screen_width//2 - 200, 140, 400, 32)
+
+    def handle_search_key(self, event):
+        """Edita la consulta de búsqueda del historial"""
+        if event.key == pygame.K_ESCAPE:
+            self.search_active = False
+            return
+        if event.key == pygame.K_RETURN:
+            if self.search_results:
+                self.open_search_result(self.search_results[0])
+            return
+        if event.key == pygame.K_BACKSPACE:
+            self.history_query = self.history_query[:-1]
+        elif event.unicode and event.unicode.isprintable():
+            self.history_query += event.unicode
+        else:
+            return
+        self.run_search()
+
+    def run_search(self):
+        start = time.perf_counter()
+        if self.search_index is None:
+            # La primera vez puede tener que indexar todo el historial
+            self.search_index = SearchIndex(self.store)
+        self.search_results = self.search_index.search(self.history_query, HISTORY_PAGE_SIZE)
+        self.search_time = time.perf_counter() - start
+
+    def open_search_result(self, result: dict):
+        """Abre la conversación del resultado y se desplaza hasta el mensaje"""
+        self.load_conversation(result['conversation_id'])
+        position = min(result['position'], len(self.height_index))
+        max_scroll = self.chat_surface_height - self.chat_view_height()
+        self.scroll_offset = max(0, min(self.height_index.prefix(position), max_scroll))
+
     def handle_scroll(self, event):
         if not self.showing_history:  # Solo permitir scroll si no estamos en el menú de historial
             dy = event.pos[1] - self.scroll_start_pos
-            max_scroll = self.chat_surface.get_height() - (self.screen_height - 120)
+            max_scroll = self.chat_surface_height - self.chat_view_height()
             self.scroll_offset = min(max(self.scroll_start_offset + dy, 0), max_scroll)
 
     def handle_mouse_wheel(self, event):
         if not self.showing_history:  # Solo permitir scroll si no estamos en el menú de historial
             self.scroll_offset -= event.y * 30
-            max_scroll = self.chat_surface.get_height() - (self.screen_height - 120)
+            max_scroll = self.chat_surface_height - self.chat_view_height()
             self.scroll_offset = max(0, min(self.scroll_offset, max_scroll))
 
     def update_cursor(self):
-        self.cursor_timer += pygame.time.Clock().tick(60)
-        if self.cursor_timer >= self.cursor_blink_interval:
+        now = pygame.time.get_ticks()
+        if now - self.cursor_timer >= self.cursor_blink_interval:
             self.cursor_visible = not self.cursor_visible
-            self.cursor_timer = 0
+            self.cursor_timer = now
+            self.invalidate("input")
+
+    def toggle_voice(self):
+        voice_active = voice_control.toggle()
+        notice = f"Voz {'activada' if voice_active else 'desactivada'}"
+        self.add_message("Sistema", notice)
+        voice_control.speak(notice)  # Solo suena al activarla
 
     def toggle_theme(self):
         self.color_mode = "oscuro" if self.color_mode == "claro" else "claro"
         self.theme = DARK_THEME if self.color_mode == "oscuro" else LIGHT_THEME
+        self.invalidate()
 
     def start_chat(self):
         self.menu_active = False
         if not self.welcome_shown:
-            self.add_message("Asistente", "Hola, ¿en qué puedo ayudarte hoy?")
+            self.add_message("Asistente", welcome_message)
+            voice_control.speak(welcome_message)
             self.welcome_shown = True
 
     def reset_chat(self):
         """Reinicia el chat actual"""
-        self.add_to_history()  # Guardar la conversación actual antes de reiniciar
+        self.start_session()
         self.menu_active = True
         self.chat_history.clear()
+        self.height_index.clear()
         self.input_text = ""
         self.welcome_shown = False
         self.scroll_offset = 0
-        self.waiting_for_response = False
         print("Chat reiniciado")
 
+    def start_session(self):
+        """Cancela las peticiones de la pestaña actual y abre una nueva sesión"""
+        self.end_session(self.tab)
+        self.tab.session = engine.create_session()
+        self.waiting_for_response = False
+        self.pending_message = None
+        voice_control.stop()
+
     def send_message(self):
         user_input = self.input_text.strip()
         if user_input:
-            self.add_message("Tú", user_input)
+            voice_control.stop()  # El usuario interrumpe la lectura en curso
+            self.add_message("Tú", user_input, save=False)  # La guarda engine.send
             self.input_text = ""
             self.waiting_for_response = True
-            self.add_message("Asistente", "Escribiendo...")
-            
-            def get_bot_response_thread():
-                try:
-                    formatted_history = [
-                        f"{msg.sender}: {msg.content}" 
-                        for msg in self.chat_history 
-                        if msg.content != "Escribiendo..."
-                    ]
-                    bot_response = get_bot_response(formatted_history)
-                    
-                    if not bot_response:
-                        bot_response = "No se pudo obtener una respuesta."
-                    
-                    if voice_control.active:
-                        voice_control.speak(bot_response)
-                    
-                    response_event = pygame.event.Event(
-                        pygame.USEREVENT, 
-                        {"response": bot_response}
-                    )
-                    pygame.event.post(response_event)
-                
-                except Exception as e:
-                    error_event = pygame.event.Event(
-                        pygame.USEREVENT,
-                        {"response": f"Error: {str(e)}"}
-                    )
-                    pygame.event.post(error_event)
-            
-            threading.Thread(target=get_bot_response_thread, daemon=True).start()
+            self.add_message("Asistente", "Escribiendo...", save=False)
+            self.pending_message = self.chat_history[-1]
+            self.pending_received = False
+
+            session = self.session_id
+
+            def on_chunk(chunk: str):
+                # Cada fragmento se envía a la UI en cuanto llega
+                pygame.event.post(pygame.event.Event(pygame.USEREVENT, {"chunk": chunk, "session": session}))
 
-    def add_message(self, sender: str, content: str):
+            def on_retry(attempt: int, delay: float, kind: str):
+                pygame.event.post(pygame.event.Event(
+                    pygame.USEREVENT, {"retry": attempt, "delay": delay, "session": session}
+                ))
+
+            def on_done(bot_response: str):
+                # El motor ya ha añadido el turno y guardado el intercambio
+                response_event = pygame.event.Event(
+                    pygame.USEREVENT,
+                    {"response": bot_response, "session": session}
+                )
+                pygame.event.post(response_event)
+
+            engine.send(self.tab.session, user_input, on_chunk, on_done, stream=stream_responses, on_retry=on_retry)
+
+    def add_message(self, sender: str, content: str, save: bool = True):
+        """Muestra un mensaje en la pestaña activa y, con save, lo guarda en su sesión"""
+        if save:
+            engine.note(self.tab.session, sender, content)
         message = ChatMessage(sender, content)
         self.chat_history.append(message)
         self.process_message_lines(message)
+        self.invalidate("chat")
 
-    def process_message_lines(self, message: ChatMessage):
+    def max_text_width(self) -> int:
         bubble_margin = 30
         max_bubble_width = self.screen_width - 2 * bubble_margin - 40
-        
-        words = message.content.split(' ')
-        lines = []
-        current_line = []
-        
-        for word in words:
-            test_line = ' '.join(current_line + [word])
-            if self.font_medium.size(test_line)[0] <= max_bubble_width:
-                current_line.append(word)
+        return max_bubble_width - 40  # Menos el margen interior de la burbuja (20 por lado)
+
+    def message_height(self, message: ChatMessage) -> int:
+        return len(message.layout.lines) * self.font_medium.get_linesize() + 40 + 20
+
+    def cache_lines(self, message: ChatMessage, width: int, lines: List[Line]):
+        if message.layout is None:
+            message.layout = MessageLayout(lines, 0)  # Aún sin aplicar: lo hará layout_messages
+            message.layout.cache = {}
+        cache = message.layout.cache
+        cache[width] = lines
+        # Se conservan solo los últimos anchos usados
+        while len(cache) > 4:
+            del cache[next(iter(cache))]
+
+    def format_lines(self, content: str, width: int) -> List[Line]:
+        """Analiza el Markdown del mensaje y lo maqueta al ancho dado"""
+        document = Document(content)
+        document.close()
+        return self.formatter.layout_document(document, width)[0]
+
+    def process_message_lines(self, message: ChatMessage, streaming: bool = False):
+        """Maqueta el mensaje entero; con streaming conserva el análisis para seguirlo por fragmentos"""
+        width = self.max_text_width()
+        with self.profiler.measure("process_message_lines"):
+            document = Document(message.content)
+            if not streaming:
+                document.close()
+            lines, stable = self.formatter.layout_document(document, width)
+            message.layout = MessageLayout(lines, width)
+            if streaming:
+                message.layout.document = document
+                message.layout.stable = stable
+        self.update_message_height(message)
+
+    def layout_messages(self):
+        """Aplica el ancho actual a todos los mensajes y reconstruye el índice de alturas"""
+        width = self.max_text_width()
+        for msg in self.chat_history:
+            layout = msg.layout
+            if layout is not None and layout.width == width:
+                continue
+            lines = layout.cache.get(width) if layout is not None else None
+            if lines is None:
+                lines = self.format_lines(msg.content, width)
+                if layout is None:
+                    msg.layout = layout = MessageLayout(lines, width)
+                else:
+                    self.cache_lines(msg, width, lines)
+            layout.lines = lines
+            layout.width = width
+            layout.document = None  # Un fragmento posterior vuelve a analizar el mensaje entero
+            layout.surface = None
+        self.height_index.rebuild([self.message_height(msg) for msg in self.chat_history])
+        self.update_chat_height()
+        max_scroll = self.chat_surface_height - self.chat_view_height()
+        self.scroll_offset = max(0, min(self.scroll_offset, max_scroll))
+
+    def update_message_height(self, message: ChatMessage):
+        """Actualiza la altura de un mensaje en el índice de sumas prefijas"""
+        if self.chat_history and self.chat_history[-1] is message:
+            index = len(self.chat_history) - 1
+        elif message in self.chat_history:
+            index = self.chat_history.index(message)
+        else:
+            return
+        if index == len(self.height_index):
+            self.height_index.append(self.message_height(message))
+        else:
+            self.height_index.update(index, self.message_height(message))
+        self.update_chat_height()
+
+    def handle_response_chunk(self, tab: ChatTab, chunk: str):
+        """Añade un fragmento de la respuesta en streaming a la burbuja pendiente de la pestaña"""
+        message = tab.pending_message
+        if message is None or message not in tab.chat_history:
+            return
+        if not tab.pending_received:
+            # Primer fragmento: sustituye "Escribiendo..." o el aviso de reintento
+            tab.pending_received = True
+            message.content = ""
+            message.layout = None
+        message.content += chunk
+        if tab is not self.tab:
+            message.clear_layout()
+            return
+        voice_control.feed(chunk)
+        self.append_message_lines(message, chunk)
+        self.scroll_offset = max(0, self.chat_surface_height - self.chat_view_height())
+
+    def handle_response(self, tab: ChatTab, response: str):
+        """Sustituye la burbuja pendiente (o el texto parcial) por la respuesta final"""
+        tab.waiting_for_response = False
+        message = tab.pending_message
+        tab.pending_message = None
+        if message is None or message not in tab.chat_history:
+            return
+        visible = tab is self.tab
+        if visible:
+            self.speak_response_tail(tab, message, response)
+        else:
+            tab.unread = True
+        if message.content != response:
+            message.content = response
+            if visible:
+                self.process_message_lines(message)
             else:
-                lines.append(' '.join(current_line))
-                current_line = [word]
-        
-        if current_line:
-            lines.append(' '.join(current_line))
-        
-        message.lines = lines
-        
-        total_height = sum(20 + len(msg.lines) * self.font_medium.get_linesize() + 40 for msg in self.chat_history)
+                message.clear_layout()
+        elif message.layout is not None:
+            message.layout.document = None  # Respuesta completa: ya no llegan más fragmentos
+        if visible:
+            self.scroll_offset = max(0, self.chat_surface_height - self.chat_view_height())
+
+    def speak_response_tail(self, tab: ChatTab, message: ChatMessage, response: str):
+        """Lee lo que falta de la respuesta final: todo si no hubo streaming, o el error añadido"""
+        streamed = message.content.rstrip() if tab.pending_received else ""
+        if response.startswith(streamed):
+            voice_control.feed(response[len(streamed):])
+        else:
+            voice_control.stop()
+            voice_control.feed(response)
+        voice_control.finish()
+
+    def handle_retry(self, tab: ChatTab, attempt: int, delay: float):
+        """Muestra en la burbuja pendiente que la petición se está reintentando"""
+        message = tab.pending_message
+        if message is None or message not in tab.chat_history:
+            return
+        message.content = f"Reintentando… (intento {attempt + 1}, en {delay:.1f} s)"
+        if tab is self.tab:
+            self.process_message_lines(message)
+            self.invalidate("chat")
+        else:
+            message.clear_layout()
+
+    def append_message_lines(self, message: ChatMessage, text: str):
+        """Analiza y maqueta solo lo nuevo: las líneas de bloques completos se conservan"""
+        width = self.max_text_width()
+        layout = message.layout
+        if layout is None or layout.width != width or layout.document is None:
+            self.process_message_lines(message, streaming=True)
+            return
+
+        document = layout.document
+        line_count = len(layout.lines)
+        start = len(document.blocks)
+        with self.profiler.measure("process_message_lines"):
+            document.feed(text)
+            previous = document.blocks[start - 1].kind if start else None
+            # La línea que estaba incompleta se rehace, igual que los bloques recién completados
+            del layout.lines[layout.stable:]
+            layout.lines.extend(self.formatter.layout(document.blocks[start:], width, previous))
+            layout.stable = len(layout.lines)
+            layout.lines.extend(self.formatter.layout_tail(document, width))
+        layout.cache = {width: layout.lines}
+        layout.surface = None
+        if len(layout.lines) != line_count:
+            self.update_message_height(message)
+
+    def update_chat_height(self):
+        total_height = self.height_index.total()
         self.chat_surface_height = max(total_height + 100, self.screen_height)
-        self.chat_surface = pygame.Surface((self.screen_width, self.chat_surface_height))
 
     def render(self):
-        self.screen.fill(self.theme.background)
-        
-        if self.showing_history:
-            self.render_history_menu()
-        elif self.menu_active:
-            self.render_main_menu()
+        if self.full_redraw or self.showing_history or self.menu_active:
+            self.screen.fill(self.theme.background)
+
+            if self.showing_history:
+                self.render_history_menu()
+            elif self.menu_active:
+                self.render_main_menu()
+            else:
+                with self.profiler.measure("render_chat"):
+                    self.render_chat()
+                with self.profiler.measure("render_input_area"):
+                    self.render_input_area()
+                self.render_toolbar()
+
+            if self.show_profiler:
+                self.render_profiler_hud()
+            with self.profiler.measure("display.flip"):
+                pygame.display.flip()
         else:
-            self.render_chat()
-            self.render_input_area()
-        
-        pygame.display.flip()
+            # Solo se envían a la pantalla los rectángulos que han cambiado
+            rects = []
+            if "chat" in self.dirty_regions:
+                chat_rect = pygame.Rect(0, 0, self.screen_width, self.screen_height - self.input_area_height())
+                self.screen.fill(self.theme.background, chat_rect)
+                with self.profiler.measure("render_chat"):
+                    self.render_chat()
+                self.render_toolbar()
+                rects.append(chat_rect)
+            elif "toolbar" in self.dirty_regions:
+                self.render_toolbar()
+                rects.append(pygame.Rect(0, 20, self.screen_width, 40))
+            if "input" in self.dirty_regions:
+                with self.profiler.measure("render_input_area"):
+                    self.render_input_area()
+                rects.append(pygame.Rect(0, self.screen_height - self.input_area_height(), self.screen_width,
+                                         self.input_area_height()))
+            if self.show_profiler:
+                rects.append(self.render_profiler_hud())
+            with self.profiler.measure("display.flip"):
+                pygame.display.update(rects)
+
+        self.full_redraw = False
+        self.dirty_regions.clear()
+
+    def render_profiler_hud(self) -> pygame.Rect:
+        """Dibuja el panel de tiempos por fase y devuelve su rectángulo"""
+        summary = self.profiler.summary()
+        frame = summary["frame_time"]
+        lines = [
+            f"frame  p50 {frame['p50'] * 1000:.2f}  p95 {frame['p95'] * 1000:.2f}  p99 {frame['p99'] * 1000:.2f} ms",
+        ]
+        for phase, stats in summary["phases"].items():
+            lines.append(f"{phase}  media {stats['mean'] * 1000:.2f}  p95 {stats['p95'] * 1000:.2f} ms")
+        lines.append(f"superficies  {self.surface_memory() / (1024 * 1024):.1f} MB")
+        cache_stats = response_cache.stats()
+        lines.append(f"caché respuestas  {cache_stats['hits']}/{cache_stats['hits'] + cache_stats['misses']} aciertos")
+
+        line_height = self.font_small.get_linesize()
+        hud_rect = pygame.Rect(10, 70, 380, len(lines) * line_height + 10)
+        pygame.draw.rect(self.screen, (20, 20, 20), hud_rect)
+        for i, line in enumerate(lines):
+            text = self.text_renderer.render(line, self.font_small, (0, 255, 120), cache=False)
+            self.screen.blit(text, (hud_rect.x + 5, hud_rect.y + 5 + i * line_height))
+        return hud_rect
+
+    def surface_memory(self) -> int:
+        """Bytes ocupados por la pantalla, las burbujas y las cachés de texto"""
+        def size(surface):
+            return surface.get_width() * surface.get_height() * surface.get_bytesize()
+
+        total = size(self.screen)
+        total += sum(size(msg.layout.surface) for tab in self.tabs for msg in tab.chat_history
+                     if msg.layout is not None and msg.layout.surface is not None)
+        total += sum(size(page) for atlas in self.text_renderer.atlases.values() for page in atlas.pages)
+        total += sum(size(surface) for surface in self.text_renderer.strings.values())
+        return total
 
     def render_main_menu(self):
-        title = self.font_title.render("Asistente IA Profesional", True, self.theme.button)
+        title = self.text_renderer.render("Asistente IA Profesional", self.font_title, self.theme.button)
         self.screen.blit(title, (self.screen_width//2 - title.get_width()//2, 150))
         
-        subtitle = self.font_large.render("Tu asistente personal inteligente", True, self.theme.text)
+        subtitle = self.text_renderer.render("Tu asistente personal inteligente", self.font_large, self.theme.text)
         self.screen.blit(subtitle, (self.screen_width//2 - subtitle.get_width()//2, 210))
         
         options = [
@@ -449,85 +1155,175 @@ class ChatUI:
             "Presiona 'Q' para salir del programa",
             "Cambia entre temas claro/oscuro con TAB",
             "Activa/desactiva voz con V",
-            "Escribe tu mensaje y presiona Enter para enviar"
+            "Ctrl+T abre otra pestaña, Ctrl+Tab cambia y Ctrl+W la cierra",
+            "Escribe tu mensaje y presiona Enter para enviar (Mayús+Enter: nueva línea)"
         ]
         
         for i, option in enumerate(options):
-            text = self.font_medium.render(option, True, self.theme.text)
+            text = self.text_renderer.render(option, self.font_medium, self.theme.text)
             self.screen.blit(text, (self.screen_width//2 - text.get_width()//2, 300 + i * 40))
 
     def render_history_menu(self):
         """Renderiza el menú de historial de conversaciones"""
-        title = self.font_title.render("Historial de Conversaciones", True, self.theme.button)
+        title = self.text_renderer.render("Historial de Conversaciones", self.font_title, self.theme.button)
         self.screen.blit(title, (self.screen_width//2 - title.get_width()//2, 100))
         
-        if not self.conversation_history:
-            no_history = self.font_medium.render("No hay conversaciones guardadas", True, self.theme.text)
+        # Caja de búsqueda (se activa con clic o con "/")
+        search_rect = self.history_search_rect()
+        border_color = self.theme.button if self.search_active else self.theme.border
+        pygame.draw.rect(self.screen, self.theme.input_box, search_rect, border_radius=8)
+        pygame.draw.rect(self.screen, border_color, search_rect, 2, border_radius=8)
+        if self.history_query or self.search_active:
+            query_surface = self.text_renderer.render(self.history_query, self.font_medium, self.theme.text)
+        else:
+            query_surface = self.text_renderer.render("Buscar ( / )", self.font_medium, self.theme.border)
+        self.screen.blit(query_surface, (search_rect.x + 10, search_rect.centery - query_surface.get_height()//2))
+
+        if self.history_query:
+            self.render_search_results()
+        elif not self.history_items:
+            no_history = self.text_renderer.render("No hay conversaciones guardadas", self.font_medium, self.theme.text)
             self.screen.blit(no_history, (self.screen_width//2 - no_history.get_width()//2, 200))
         else:
-            for i, conversation in enumerate(self.conversation_history):
-                if conversation:
-                    # Obtener el primer mensaje como preview
-                    first_message = conversation[0].content[:50] + "..." if len(conversation[0].content) > 50 else conversation[0].content
-                    date = conversation[0].timestamp
-                    message_count = len(conversation)
-                    
-                    text = f"{i+1}. {date} - {first_message} ({message_count} mensajes)"
-                    text_surface = self.font_medium.render(text, True, self.theme.text)
-                    
-                    # Crear un rectángulo para la opción
-                    option_rect = pygame.Rect(self.screen_width//2 - 200, 180 + i * 50, 400, 40)
-                    
-                    # Resaltar si el mouse está sobre la opción
-                    if option_rect.collidepoint(pygame.mouse.get_pos()):
-                        pygame.draw.rect(self.screen, self.theme.button, option_rect, border_radius=8)
-                    
-                    self.screen.blit(text_surface, (option_rect.x + 10, option_rect.y + 10))
-        
+            for i, item in enumerate(self.history_items):
+                # El primer mensaje del usuario sirve de preview
+                title = item['title'] or "(sin mensajes)"
+                first_message = title[:50] + "..." if len(title) > 50 else title
+                date = item['timestamp']
+                message_count = item['message_count']
+
+                text = f"{i+1}. {date} - {first_message} ({message_count} mensajes)"
+                text_surface = self.text_renderer.render(text, self.font_medium, self.theme.text)
+
+                # Crear un rectángulo para la opción
+                option_rect = pygame.Rect(self.screen_width//2 - 200, 180 + i * 50, 400, 40)
+
+                # Resaltar si el mouse está sobre la opción
+                if option_rect.collidepoint(pygame.mouse.get_pos()):
+                    pygame.draw.rect(self.screen, self.theme.button, option_rect, border_radius=8)
+
+                self.screen.blit(text_surface, (option_rect.x + 10, option_rect.y + 10))
+
+            pages = (self.history_total + HISTORY_PAGE_SIZE - 1) // HISTORY_PAGE_SIZE
+            page_text = self.text_renderer.render(f"Página {self.history_page + 1}/{pages} (← / →)", self.font_small, self.theme.text)
+            self.screen.blit(page_text, (self.screen_width//2 - page_text.get_width()//2, 190 + len(self.history_items) * 50))
+
         # Botón para volver
-        back_rect = pygame.Rect(self.screen_width//2 - 100, 300 + len(self.conversation_history) * 50, 200, 40)
+        rows = self.search_results if self.history_query else self.history_items
+        back_rect = pygame.Rect(self.screen_width//2 - 100, 300 + len(rows) * 50, 200, 40)
         pygame.draw.rect(self.screen, self.theme.button, back_rect, border_radius=8)
-        back_text = self.font_medium.render("Volver (B o ESC)", True, self.theme.background)
+        back_text = self.text_renderer.render("Volver (B o ESC)", self.font_medium, self.theme.background)
         self.screen.blit(back_text, (back_rect.centerx - back_text.get_width()//2, back_rect.centery - back_text.get_height()//2))
 
+    def render_search_results(self):
+        """Resultados de búsqueda con los términos encontrados resaltados"""
+        for i, result in enumerate(self.search_results):
+            option_rect = pygame.Rect(self.screen_width//2 - 200, 180 + i * 50, 400, 40)
+            if option_rect.collidepoint(pygame.mouse.get_pos()):
+                pygame.draw.rect(self.screen, self.theme.button, option_rect, border_radius=8)
+
+            x = option_rect.x + 10
+            prefix = f"{i+1}. {result['timestamp']} {result['sender']}: "
+            segments = [(prefix, False)] + result['snippet']
+            for text, highlighted in segments:
+                font = self.font_bold if highlighted else self.font_medium
+                color = self.theme.button_hover if highlighted else self.theme.text
+                surface = self.text_renderer.render(text, font, color, cache=False)
+                self.screen.blit(surface, (x, option_rect.y + 10))
+                x += surface.get_width()
+
+        summary = f"{len(self.search_results)} resultados en {self.search_time * 1000:.1f} ms"
+        summary_text = self.text_renderer.render(summary, self.font_small, self.theme.text, cache=False)
+        self.screen.blit(summary_text, (self.screen_width//2 - summary_text.get_width()//2, 190 + len(self.search_results) * 50))
+
     def render_chat(self):
-        self.chat_surface.fill(self.theme.background)
-        
         y_offset = 20
+        visible_height = self.chat_view_height() - 10
+        view_top = self.scroll_offset
+        view_bottom = self.scroll_offset + visible_height
+        line_height = self.font_medium.get_linesize()
+
+        # Solo se dibujan las burbujas que intersectan la ventana visible
+        first = self.height_index.find(view_top - y_offset)
+        y_offset += self.height_index.prefix(first)
+        self.screen.set_clip(pygame.Rect(0, 0, self.screen_width, visible_height))
+        for index in range(first, len(self.chat_history)):
+            if y_offset >= view_bottom:
+                break
+            message = self.chat_history[index]
+            bubble = self.get_bubble_surface(message)
+            message.layout.rect.y = y_offset
+            self.screen.blit(bubble, (message.layout.rect.x, y_offset - view_top))
+            y_offset += len(message.layout.lines) * line_height + 40 + 20
+        self.screen.set_clip(None)
+
+        self.render_scroll_bar(20 + self.height_index.total(), visible_height)
+
+    def get_bubble_surface(self, message: ChatMessage) -> pygame.Surface:
+        """Devuelve la burbuja del mensaje, renderizándola solo si ha cambiado"""
+        layout = message.layout
+        key = (self.screen_width, self.color_mode)
+        if layout.surface is not None and layout.surface_key == key:
+            if id(message) in self.bubbles:
+                self.bubbles.move_to_end(id(message))
+            return layout.surface
+
         bubble_margin = 30
         max_bubble_width = self.screen_width - 2 * bubble_margin - 40
-        
-        for message in self.chat_history:
-            is_user = message.sender == "Tú"
-            bubble_color = self.theme.user_bubble if is_user else self.theme.bot_bubble
-            text_color = self.theme.text
-            
-            line_height = self.font_medium.get_linesize()
-            bubble_height = len(message.lines) * line_height + 40
-            if message.lines:
-                bubble_width = min(max(self.font_medium.size(line)[0] for line in message.lines) + 40, max_bubble_width)
-            else:
-                bubble_width = 120
-            
-            bubble_x = self.screen_width - bubble_width - bubble_margin if is_user else bubble_margin
-            
-            message.bubble_rect = pygame.Rect(bubble_x, y_offset, bubble_width, bubble_height)
-            pygame.draw.rect(self.chat_surface, bubble_color, message.bubble_rect, border_radius=15)
-            
-            sender_text = f"{message.sender} • {message.timestamp}"
-            sender_surface = self.font_bold.render(sender_text, True, text_color)
-            self.chat_surface.blit(sender_surface, (bubble_x + 20, y_offset + 15))
-            
-            for i, line in enumerate(message.lines):
-                line_surface = self.font_medium.render(line, True, text_color)
-                self.chat_surface.blit(line_surface, (bubble_x + 20, y_offset + 40 + i * line_height))
-            
-            y_offset += bubble_height + 20
-        
-        visible_height = self.screen_height - 130
-        self.screen.blit(self.chat_surface, (0, 0), (0, self.scroll_offset, self.screen_width, visible_height))
-        
-        self.render_scroll_bar(y_offset, visible_height)
+        is_user = message.sender == "Tú"
+        bubble_color = self.theme.user_bubble if is_user else self.theme.bot_bubble
+        text_color = self.theme.text
+
+        line_height = self.font_medium.get_linesize()
+        bubble_height = len(layout.lines) * line_height + 40
+        if layout.lines:
+            bubble_width = min(max(line.x + line.width for line in layout.lines) + 40, max_bubble_width)
+            if any(line.kind == "code" for line in layout.lines):
+                bubble_width = max_bubble_width  # Los bloques de código ocupan todo el ancho
+        else:
+            bubble_width = 120
+
+        bubble_x = self.screen_width - bubble_width - bubble_margin if is_user else bubble_margin
+        layout.rect = pygame.Rect(bubble_x, 0, bubble_width, bubble_height)
+
+        surface = pygame.Surface((bubble_width, bubble_height), pygame.SRCALPHA)
+        pygame.draw.rect(surface, bubble_color, (0, 0, bubble_width, bubble_height), border_radius=15)
+
+        sender_text = f"{message.sender} • {message.timestamp}"
+        sender_surface = self.text_renderer.render(sender_text, self.font_bold, text_color, cache=False)
+        surface.blit(sender_surface, (20, 15))
+
+        for i, line in enumerate(layout.lines):
+            y = 40 + i * line_height
+            if line.kind == "code":
+                code_rect = pygame.Rect(12, y, bubble_width - 24, line_height)
+                pygame.draw.rect(surface, self.theme.code_background, code_rect)
+                surface.set_clip(code_rect.inflate(-8, 0))  # El código largo se recorta, no se ajusta
+            x = 20 + line.x
+            for text, style in line.runs:
+                font = self.formatter.font(style)
+                run_surface = self.text_renderer.render(text, font, text_color, cache=False)
+                if style & CODE and line.kind != "code":
+                    pygame.draw.rect(surface, self.theme.code_background,
+                                     (x - 2, y, run_surface.get_width() + 4, line_height), border_radius=4)
+                surface.blit(run_surface, (x, y + (line_height - run_surface.get_height()) // 2))
+                x += run_surface.get_width()
+            surface.set_clip(None)
+
+        layout.surface = surface
+        layout.surface_key = key
+        self.remember_bubble(message)
+        return surface
+
+    def remember_bubble(self, message: ChatMessage):
+        """Limita las burbujas en memoria a las últimas dibujadas, no a todos los mensajes"""
+        self.bubbles[id(message)] = weakref.ref(message)
+        self.bubbles.move_to_end(id(message))
+        while len(self.bubbles) > MAX_BUBBLES:
+            _, ref = self.bubbles.popitem(last=False)
+            old = ref()
+            if old is not None and old.layout is not None:
+                old.layout.surface = None
 
     def render_scroll_bar(self, content_height: int, visible_height: int):
         if content_height > visible_height:
@@ -539,7 +1335,9 @@ class ChatUI:
             pygame.draw.rect(self.screen, self.theme.scroll_bar, scroll_bar, border_radius=3)
 
     def render_input_area(self):
-        pygame.draw.rect(self.screen, self.theme.input_box, (0, self.screen_height - 90, self.screen_width, 90))
+        area_height = self.input_area_height()
+        pygame.draw.rect(self.screen, self.theme.input_box,
+                         (0, self.screen_height - area_height, self.screen_width, area_height))
         
         input_box_color = self.theme.input_box
         border_color = self.theme.button if self.input_active else self.theme.border
@@ -547,90 +1345,165 @@ class ChatUI:
         pygame.draw.rect(self.screen, input_box_color, self.input_box, border_radius=12)
         pygame.draw.rect(self.screen, border_color, self.input_box, 2, border_radius=12)
         
-        input_surface = self.font_medium.render(self.input_text, True, self.theme.text)
-        self.screen.blit(input_surface, (self.input_box.x + 15, self.input_box.y + 15))
+        # Solo las filas y columnas que caben en la caja, aunque el texto pegado sea enorme
+        buffer = self.input_buffer
+        view = self.input_view
+        width = self.input_text_width()
+        text_x, text_y = self.input_box.x + 15, self.input_box.y + 15
+        line_height = view.line_height
+        selection = buffer.selection()
+        self.screen.set_clip(pygame.Rect(text_x - 1, self.input_box.y + 2, width + 4, self.input_box.height - 4))
+        for i, (row, text) in enumerate(view.lines(buffer, width)):
+            y = text_y + i * line_height
+            if selection is not None and selection[0][0] <= row <= selection[1][0]:
+                start = view.x_of(buffer, row, selection[0][1], width) if row == selection[0][0] else 0
+                end = view.x_of(buffer, row, selection[1][1], width) if row == selection[1][0] else width
+                pygame.draw.rect(self.screen, self.theme.selection, (text_x + start, y, max(end - start, 4), line_height))
+            if text:
+                surface = self.text_renderer.render(text, self.font_medium, self.theme.text, cache=False)
+                self.screen.blit(surface, (text_x, y))
         
         if self.input_active and self.cursor_visible and not self.waiting_for_response:
-            cursor_x = self.input_box.x + 15 + input_surface.get_width()
+            row, column = buffer.cursor
+            cursor_x = text_x + view.x_of(buffer, row, column, width)
+            cursor_y = text_y + (row - buffer.top_row) * line_height
             pygame.draw.line(self.screen, self.theme.text,
-                           (cursor_x, self.input_box.y + 15),
-                           (cursor_x, self.input_box.y + 35), 2)
+                           (cursor_x, cursor_y),
+                           (cursor_x, cursor_y + 20), 2)
+        self.screen.set_clip(None)
         
         # Botón enviar
         send_color = self.theme.button_hover if self.send_button.collidepoint(pygame.mouse.get_pos()) and not self.waiting_for_response else (150, 150, 150)
         pygame.draw.rect(self.screen, send_color, self.send_button, border_radius=12)
-        send_icon = self.font_large.render("→", True, self.theme.background)
+        send_icon = self.text_renderer.render("→", self.font_large, self.theme.background)
         self.screen.blit(send_icon, (self.send_button.centerx - send_icon.get_width()//2,
                                    self.send_button.centery - send_icon.get_height()//2))
-        
+
+    def render_toolbar(self):
+        self.render_tabs()
+
         # Botón nueva conversación
-        new_chat_color = self.theme.button_hover if self.new_chat_button.collidepoint(pygame.mouse.get_pos()) and not self.waiting_for_response else (150, 150, 150)
+        new_chat_color = self.theme.button_hover if self.new_chat_button.collidepoint(pygame.mouse.get_pos()) else (150, 150, 150)
         pygame.draw.rect(self.screen, new_chat_color, self.new_chat_button, border_radius=20)
-        new_chat_text = self.font_medium.render("Nueva Conversación", True, self.theme.background)
+        new_chat_text = self.text_renderer.render("Nueva Conversación", self.font_medium, self.theme.background)
         self.screen.blit(new_chat_text, (self.new_chat_button.centerx - new_chat_text.get_width()//2,
                                         self.new_chat_button.centery - new_chat_text.get_height()//2))
         
         # Botón de voz
         voice_color = (0, 200, 0) if voice_control.active else (200, 0, 0)
         pygame.draw.rect(self.screen, voice_color, self.voice_button, border_radius=20)
-        voice_text = self.font_medium.render("Voz", True, self.theme.background)
+        voice_text = self.text_renderer.render("Voz", self.font_medium, self.theme.background)
         self.screen.blit(voice_text, (self.voice_button.centerx - voice_text.get_width()//2,
                                     self.voice_button.centery - voice_text.get_height()//2))
         
         # Botón de historial
-        history_color = self.theme.button_hover if self.history_button.collidepoint(pygame.mouse.get_pos()) and not self.waiting_for_response else self.theme.button
+        history_color = self.theme.button_hover if self.history_button.collidepoint(pygame.mouse.get_pos()) else self.theme.button
         pygame.draw.rect(self.screen, history_color, self.history_button, border_radius=20)
-        history_text = self.font_medium.render("Ver Historial", True, self.theme.background)
+        history_text = self.text_renderer.render("Ver Historial", self.font_medium, self.theme.background)
         self.screen.blit(history_text, (self.history_button.centerx - history_text.get_width()//2,
                                       self.history_button.centery - history_text.get_height()//2))
 
+    def render_tabs(self):
+        """Barra de pestañas: "…" si espera respuesta, "•" si tiene una respuesta sin leer"""
+        rects, plus = self.tab_rects()
+        pygame.draw.rect(self.screen, self.theme.background, (0, 20, self.history_button.x - 10, 40))
+        for index, (tab, rect) in enumerate(zip(self.tabs, rects)):
+            active = index == self.active_tab
+            color = self.theme.button if active else self.theme.border
+            pygame.draw.rect(self.screen, color, rect, border_radius=10)
+            marker = "… " if tab.waiting_for_response else "• " if tab.unread else ""
+            label = self.fit_text(marker + tab.title(), self.font_small, rect.width - 16)
+            text_color = self.theme.background if active else self.theme.text
+            label_surface = self.text_renderer.render(label, self.font_small, text_color)
+            self.screen.blit(label_surface, (rect.x + 8, rect.centery - label_surface.get_height()//2))
+
+        if len(self.tabs) < MAX_TABS:
+            plus_color = self.theme.button_hover if plus.collidepoint(pygame.mouse.get_pos()) else (150, 150, 150)
+            pygame.draw.rect(self.screen, plus_color, plus, border_radius=10)
+            plus_text = self.text_renderer.render("+", self.font_large, self.theme.background)
+            self.screen.blit(plus_text, (plus.centerx - plus_text.get_width()//2,
+                                         plus.centery - plus_text.get_height()//2))
+
+    def fit_text(self, text: str, font: pygame.font.Font, width: int) -> str:
+        """Recorta el texto con "…" para que quepa en el ancho dado"""
+        if font.size(text)[0] <= width:
+            return text
+        while text and font.size(text + "…")[0] > width:
+            text = text[:-1]
+        return text + "…"
+
+    def print_startup_report(self):
+        """Espera a que terminen las fases en segundo plano e imprime el informe"""
+        startup.mark("primer fotograma")
+
+        def report_thread():
+            voice_control.ready.wait(timeout=15)
+            engine.worker.ready.wait(timeout=15)
+            print(startup.report())
+
+        threading.Thread(target=report_thread, daemon=True).start()
+
     def run(self):
         clock = pygame.time.Clock()
+        first_frame = True
         
         while self.running:
-            self.handle_events()
-            self.render()
-            clock.tick(60)
+            events = None
+            if not self.full_redraw and not self.dirty_regions:
+                # En reposo se bloquea hasta el próximo evento o parpadeo del cursor
+                timeout = self.next_wakeup()
+                event = pygame.event.wait(timeout) if timeout else pygame.event.wait()
+                events = [] if event.type == pygame.NOEVENT else [event]
+                events += pygame.event.get()
+            self.profiler.begin_frame()
+            with self.profiler.measure("handle_events"):
+                self.handle_events(events)
+            if self.full_redraw or self.dirty_regions:
+                self.render()
+                self.profiler.end_frame()
+                if first_frame:
+                    first_frame = False
+                    if self.startup_report:
+                        self.print_startup_report()
+                clock.tick(60)
+
+        if self.frame_log:
+            self.frame_log.close()
         
-        self.add_to_history()
+        for tab in self.tabs:
+            self.end_session(tab)
+        self.store.close()
+        engine.close()
+        voice_control.close()
         pygame.quit()
         sys.exit()
 
-def get_bot_response(chat_history):
+def get_bot_response(messages, use_cache=False):
+    """Respuesta completa sin streaming; pasa por el worker para tener reintentos y caché"""
+    return engine.complete(messages, use_cache)
+
+def main():
+    parser = argparse.ArgumentParser(description="Asistente IA con interfaz pygame")
+    parser.add_argument("--startup-report", action="store_true",
+                        help="imprime cuánto tarda cada fase del arranque")
+    parser.add_argument("--serve", action="store_true",
+                        help="sirve el asistente por HTTP/WebSocket, sin ventana; admite las opciones de servidor_chat.py")
+    args, rest = parser.parse_known_args()
+    if args.serve:
+        # Solo llega aquí si se llama a main() tras importar el módulo: se sueltan la voz y el worker de la ventana
+        engine.close()
+        voice_control.close()
+        serve_without_ui(sys.argv[1:])
+        return
+    if rest:
+        parser.error(f"argumentos no reconocidos: {' '.join(rest)}")
+    exporter = start_metrics()
     try:
-        messages = [{"role": "system", "content": system_prompt}]
-        for msg in chat_history:
-            if msg.startswith("Tú: "):
-                messages.append({"role": "user", "content": msg[4:]})
-            elif msg.startswith("Asistente: "):
-                messages.append({"role": "assistant", "content": msg[10:]})
-        
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=messages,
-            temperature=0.7,
-            max_tokens=256,
-        )
-        return response.choices[0].message.content.strip()
-    except Exception as e:
-        error_str = str(e)
-        if "403" in error_str and "insufficient_resource" in error_str:
-            return "Límite de uso alcanzado: Has agotado tu cuota de solicitudes. Por favor, actualiza tu método de pago para continuar usando el servicio."
-        elif "rate limit" in error_str.lower() or "busy" in error_str.lower():
-            return "El servidor está ocupado, por favor inténtalo de nuevo más tarde."
-        elif "404" in error_str:
-            return "Error: Recurso no encontrado (404)"
-        elif "401" in error_str:
-            return "Error: No autorizado (comprueba tu API key)"
-        elif "304" in error_str:
-            return "Error: No se pudo modificar el recurso (304)"
-        elif "500" in error_str:
-            return "Error interno del servidor (500)"
-        elif "502" in error_str or "503" in error_str or "504" in error_str:
-            return "Problemas de conexión con el servidor. Por favor, inténtalo de nuevo más tarde."
-        else:
-            return "Se produjo un error inesperado. Por favor, inténtalo de nuevo más tarde."
+        app = ChatUI(startup_report=args.startup_report)
+        app.run()
+    finally:
+        if exporter is not None:
+            exporter.close()  # Último volcado con los datos de la sesión
 
 if __name__ == "__main__":
-    app = ChatUI()
-    app.run()
\ No newline at end of file
+    main()
\ No newline at end of file
@@ -0,0 +1,310 @@
+import json
+import queue
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from metricas import HISTORY_SAVE_SECONDS
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversations (
+    id INTEGER PRIMARY KEY,
+    created REAL NOT NULL,
+    title TEXT NOT NULL DEFAULT '',
+    timestamp TEXT NOT NULL DEFAULT '',
+    message_count INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    conversation_id INTEGER NOT NULL REFERENCES conversations(id),
+    position INTEGER NOT NULL,
+    sender TEXT NOT NULL,
+    content TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    created INTEGER NOT NULL DEFAULT 0,
+    UNIQUE (conversation_id, position)
+);
+CREATE INDEX IF NOT EXISTS conversations_created ON conversations (created);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+# Mensajes guardados antes de la columna created: fecha de la conversación con la hora "HH:MM" del mensaje
+BACKFILL_CREATED = """
+UPDATE messages SET created = COALESCE(
+    (SELECT CAST(strftime('%s', date(c.created, 'unixepoch', 'localtime') || ' ' || messages.timestamp, 'utc') AS INTEGER)
+     FROM conversations c WHERE c.id = messages.conversation_id),
+    (SELECT CAST(c.created AS INTEGER) FROM conversations c WHERE c.id = messages.conversation_id),
+    0
+) WHERE created = 0
+"""
+
+
+class ConversationStore:
+    """Historial en SQLite; las escrituras las hace un hilo en segundo plano por lotes
+
+    Las lecturas no esperan al escritor: leen lo ya guardado y le superponen las escrituras que
+    siguen en cola, que se guardan también en memoria (pending) hasta que se confirman.
+    """
+
+    batch_window = 0.05  # Segundos que el escritor espera para agrupar operaciones
+    batch_size = 256
+
+    def __init__(self, path: str = 'chat_history.db', legacy_json: str = 'chat_history.json'):
+        self.path = path
+        self.legacy_json = legacy_json
+        self.queue: "queue.Queue" = queue.Queue()
+        self.id_lock = threading.Lock()
+        # Escrituras aún sin confirmar, por conversación: {"created": ..., "messages": {posición: (n, datos)}}
+        self.pending: Dict[int, dict] = {}
+        self.pending_lock = threading.Lock()
+        self.sequence = 0  # Número de cada escritura, para no borrar de pending una más reciente
+
+        self.reader = self.connect()
+        with self.reader:
+            self.reader.executescript(SCHEMA)
+            columns = {row[1] for row in self.reader.execute("PRAGMA table_info(messages)")}
+            if "created" not in columns:
+                self.reader.execute("ALTER TABLE messages ADD COLUMN created INTEGER NOT NULL DEFAULT 0")
+                self.reader.execute(BACKFILL_CREATED)
+        self.next_id = self.reader.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM conversations").fetchone()[0]
+
+        self.writer = threading.Thread(target=self.writer_loop, daemon=True)
+        self.writer.start()
+        self.queue.put((self._import_legacy_json, None))
+
+    def connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path)
+        connection.execute("PRAGMA journal_mode=WAL")
+        # En modo WAL, FULL sincroniza el disco en cada commit (uno por lote)
+        connection.execute("PRAGMA synchronous=FULL")
+        return connection
+
+    def allocate_id(self) -> int:
+        with self.id_lock:
+            conversation_id = self.next_id
+            self.next_id += 1
+        return conversation_id
+
+    # --- Escritura (hilo en segundo plano) ---
+
+    def writer_loop(self):
+        connection = self.connect()
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.batch_window
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            stop = False
+            start = time.perf_counter()
+            try:
+                with connection:
+                    for item in batch:
+                        if item is None:
+                            stop = True
+                        else:
+                            item[0](connection)
+                HISTORY_SAVE_SECONDS.observe(time.perf_counter() - start)
+                for item in batch:
+                    if item is not None and item[1] is not None:
+                        item[1]()  # Ya está en disco: fuera de pending
+            except Exception as e:
+                print(f"Error guardando historial: {e}")
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+            if stop:
+                connection.close()
+                return
+
+    def new_conversation(self) -> int:
+        """Reserva un id y crea la conversación en segundo plano"""
+        conversation_id = self.allocate_id()
+        created = time.time()
+
+        def insert(connection):
+            connection.execute(
+                "INSERT INTO conversations (id, created) VALUES (?, ?)",
+                (conversation_id, created)
+            )
+
+        def committed():
+            with self.pending_lock:
+                entry = self.pending.get(conversation_id)
+                if entry is not None:
+                    entry["created"] = None
+                    self.drop_if_empty(conversation_id, entry)
+
+        with self.pending_lock:
+            self.pending.setdefault(conversation_id, {"created": None, "messages": {}})["created"] = created
+        self.queue.put((insert, committed))
+        return conversation_id
+
+    def append_message(self, conversation_id: int, position: int, data: dict):
+        """Guarda (o reemplaza) el mensaje en la posición indicada"""
+        def upsert(connection):
+            self._write_message(connection, conversation_id, position, data)
+
+        def committed():
+            with self.pending_lock:
+                entry = self.pending.get(conversation_id)
+                if entry is not None and entry["messages"].get(position, (None,))[0] == sequence:
+                    del entry["messages"][position]
+                    self.drop_if_empty(conversation_id, entry)
+
+        with self.pending_lock:
+            self.sequence += 1
+            sequence = self.sequence
+            entry = self.pending.setdefault(conversation_id, {"created": None, "messages": {}})
+            entry["messages"][position] = (sequence, data)
+        self.queue.put((upsert, committed))
+
+    def drop_if_empty(self, conversation_id: int, entry: dict):
+        if entry["created"] is None and not entry["messages"]:
+            del self.pending[conversation_id]
+
+    def _write_message(self, connection, conversation_id: int, position: int, data: dict):
+        connection.execute(
+            "INSERT INTO messages (conversation_id, position, sender, content, timestamp, created) "
+            "VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (conversation_id, position) DO UPDATE SET "
+            "sender = excluded.sender, content = excluded.content, timestamp = excluded.timestamp, "
+            "created = excluded.created",
+            (conversation_id, position, data['sender'], data['content'], data['timestamp'], data.get('created', 0))
+        )
+        connection.execute(
+            "UPDATE conversations SET message_count = MAX(message_count, ?), "
+            "timestamp = CASE WHEN timestamp = '' THEN ? ELSE timestamp END, "
+            "title = CASE WHEN title = '' AND ? = 'Tú' THEN ? ELSE title END "
+            "WHERE id = ?",
+            (position + 1, data['timestamp'], data['sender'], data['content'][:80], conversation_id)
+        )
+
+    def _import_legacy_json(self, connection):
+        """Importa una sola vez el antiguo chat_history.json"""
+        if connection.execute("SELECT 1 FROM meta WHERE key = 'json_imported'").fetchone():
+            return
+        history_file = Path(self.legacy_json)
+        if history_file.exists():
+            with open(history_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            # Fechas anteriores a la del archivo, manteniendo el orden original
+            modified = history_file.stat().st_mtime
+            for i, conversation in enumerate(data):
+                conversation_id = self.allocate_id()
+                connection.execute(
+                    "INSERT INTO conversations (id, created) VALUES (?, ?)",
+                    (conversation_id, modified - len(data) + i)
+                )
+                for position, message in enumerate(conversation):
+                    self._write_message(connection, conversation_id, position, message)
+            connection.execute(BACKFILL_CREATED)
+            print(f"Historial importado: {len(data)} conversaciones")
+        connection.execute("INSERT INTO meta (key, value) VALUES ('json_imported', '1')")
+
+    def flush(self):
+        """Espera a que todas las escrituras pendientes estén en disco (no hace falta para leer)"""
+        self.queue.join()
+
+    def close(self):
+        self.queue.put(None)
+        self.writer.join()
+        self.reader.close()
+
+    # --- Lectura ---
+
+    def pending_snapshot(self) -> Dict[int, Tuple[Optional[float], Dict[int, dict]]]:
+        """Copia de las escrituras en cola; se toma antes de consultar la base de datos
+
+        En ese orden, lo que el escritor confirme entre medias aparece en la copia o en la consulta.
+        """
+        with self.pending_lock:
+            return {
+                conversation_id: (entry["created"], {position: data for position, (_, data) in entry["messages"].items()})
+                for conversation_id, entry in self.pending.items()
+            }
+
+    def pending_conversations(self, snapshot) -> List[dict]:
+        """Metadatos de las conversaciones con escrituras en cola, como si ya estuvieran guardadas"""
+        if not snapshot:
+            return []
+        ids = list(snapshot)
+        rows = self.reader.execute(
+            f"SELECT id, created, title, timestamp, message_count FROM conversations "
+            f"WHERE id IN ({','.join('?' * len(ids))})", ids
+        ).fetchall()
+        saved = {row[0]: row for row in rows}
+        conversations = []
+        for conversation_id, (created, messages) in snapshot.items():
+            row = saved.get(conversation_id)
+            if row is not None:
+                _, created, title, timestamp, count = row
+            elif created is not None:
+                title, timestamp, count = '', '', 0
+            else:
+                continue  # Mensajes de una conversación que no existe
+            # Lo mismo que hace _write_message al guardarlos
+            for position in sorted(messages):
+                data = messages[position]
+                count = max(count, position + 1)
+                timestamp = timestamp or data['timestamp']
+                if not title and data['sender'] == 'Tú':
+                    title = data['content'][:80]
+            conversations.append({'id': conversation_id, 'created': created, 'title': title,
+                                  'timestamp': timestamp, 'message_count': count})
+        return conversations
+
+    def count_conversations(self) -> int:
+        snapshot = self.pending_snapshot()
+        ids = list(snapshot)
+        saved = self.reader.execute(
+            f"SELECT COUNT(*) FROM conversations WHERE message_count > 1 "
+            f"AND id NOT IN ({','.join('?' * len(ids))})", ids
+        ).fetchone()[0]
+        return saved + sum(row['message_count'] > 1 for row in self.pending_conversations(snapshot))
+
+    def list_conversations(self, offset: int = 0, limit: int = 9) -> List[dict]:
+        """Metadatos de las conversaciones más recientes, sin cargar los mensajes"""
+        snapshot = self.pending_snapshot()
+        ids = list(snapshot)
+        rows = self.reader.execute(
+            f"SELECT id, created, title, timestamp, message_count FROM conversations "
+            f"WHERE message_count > 1 AND id NOT IN ({','.join('?' * len(ids))}) "
+            f"ORDER BY created DESC, id DESC LIMIT ?",
+            (*ids, offset + limit)
+        ).fetchall()
+        conversations = [
+            {'id': row[0], 'created': row[1], 'title': row[2], 'timestamp': row[3], 'message_count': row[4]}
+            for row in rows
+        ]
+        conversations += [row for row in self.pending_conversations(snapshot) if row['message_count'] > 1]
+        conversations.sort(key=lambda row: (row['created'], row['id']), reverse=True)
+        return [
+            {key: row[key] for key in ('id', 'title', 'timestamp', 'message_count')}
+            for row in conversations[offset:offset + limit]
+        ]
+
+    def load_messages(self, conversation_id: int) -> List[dict]:
+        _, pending = self.pending_snapshot().get(conversation_id, (None, {}))
+        rows = self.reader.execute(
+            "SELECT position, sender, content, timestamp, created FROM messages "
+            "WHERE conversation_id = ? ORDER BY position",
+            (conversation_id,)
+        ).fetchall()
+        messages = {row[0]: {'sender': row[1], 'content': row[2], 'timestamp': row[3], 'created': row[4]}
+                    for row in rows}
+        for position, data in pending.items():
+            messages[position] = {'sender': data['sender'], 'content': data['content'],
+                                  'timestamp': data['timestamp'], 'created': data.get('created', 0)}
+        return [messages[position] for position in sorted(messages)]
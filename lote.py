@@ -0,0 +1,243 @@
+"""Modo por lotes: pasa un JSONL de preguntas por el asistente, sin interfaz ni pygame
+
+Uso: python lote.py preguntas.jsonl respuestas.jsonl [--concurrency 8] [--ordered] [--restart]
+                    [--field prompt] [--id-field id] [--no-cache]
+
+Cada línea de entrada es una cadena JSON o un objeto con la pregunta en --field (por defecto el primero
+de prompt, content o body que exista). El id del resultado es --id-field (por defecto id o
+request_id) o, si no hay, el número de línea. La entrada se lee a medida que quedan huecos, así que un
+fichero enorme no se carga en memoria.
+
+Cada resultado es una línea {"id", "line", "outcome", "response", "seconds"}, en el orden en que
+terminan o, con --ordered, en el de la entrada. Las preguntas usan el mismo system_prompt, caché y
+reintentos que la interfaz (ChatEngine y RequestWorker de motor.py).
+
+La salida es el punto de control: al relanzar el mismo comando se saltan las preguntas ya respondidas
+(outcome ok o cached) y el resto se añade al final; los errores se vuelven a intentar.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from typing import Dict, Iterator, Optional, Set, Tuple
+
+from cache import ResponseCache
+from motor import ChatEngine, create_backend, start_metrics
+from perfil import stats
+from peticiones import RequestWorker, classify_error
+
+PROMPT_FIELDS = ("prompt", "content", "body")
+ID_FIELDS = ("id", "request_id")
+DONE = {"ok", "cached"}  # Resultados que no se repiten al reanudar
+
+
+def read_prompts(path: str, field: Optional[str] = None,
+                 id_field: Optional[str] = None) -> Iterator[Tuple[int, object, str]]:
+    """(línea, id, pregunta) de cada línea válida, leyendo el fichero de una en una"""
+    with open(path, 'r', encoding='utf-8') as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                print(f"línea {number}: no es JSON válido, se omite", file=sys.stderr)
+                continue
+            if isinstance(record, str):
+                record = {"prompt": record}
+            if not isinstance(record, dict):
+                print(f"línea {number}: se esperaba un objeto o una cadena, se omite", file=sys.stderr)
+                continue
+            fields = (field,) if field else PROMPT_FIELDS
+            prompt = next((record[name] for name in fields if isinstance(record.get(name), str)), "")
+            if not prompt.strip():
+                print(f"línea {number}: sin pregunta, se omite", file=sys.stderr)
+                continue
+            ids = (id_field,) if id_field else ID_FIELDS
+            item_id = next((record[name] for name in ids if name in record), number)
+            yield number, item_id, prompt.strip()
+
+
+def id_key(item_id) -> str:
+    # 3 y "3" son ids distintos
+    return json.dumps(item_id)
+
+
+def load_checkpoint(path: str) -> Set[str]:
+    """Ids ya respondidos en la salida; corta la última línea si quedó a medias al interrumpir"""
+    done: Set[str] = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, 'rb+') as f:
+        end = 0
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            end += len(line)
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get("outcome") in DONE:
+                done.add(id_key(record.get("id")))
+        f.truncate(end)
+    return done
+
+
+class BatchRunner:
+    """Lanza las preguntas con como mucho `concurrency` a la vez y escribe cada resultado al terminar
+
+    Un hueco se libera al escribir el resultado, no al recibirlo: con --ordered, una pregunta lenta
+    frena la lectura en lugar de acumular en memoria las respuestas que van por delante.
+    """
+
+    def __init__(self, engine: ChatEngine, output, concurrency: int, ordered: bool = False,
+                 timeout: float = 120.0):
+        self.engine = engine
+        self.output = output
+        self.concurrency = concurrency
+        self.ordered = ordered
+        self.timeout = timeout
+        self.finished: Dict[int, dict] = {}  # Resultados esperando su turno (--ordered)
+        self.next_to_write = 0
+        self.latencies = []
+        self.outcomes: Dict[str, int] = {}
+        self.characters = 0
+
+    async def run(self, prompts: Iterator[Tuple[int, object, str]], done: Set[str]) -> dict:
+        slots = asyncio.Semaphore(self.concurrency)
+        tasks = set()
+        skipped = 0
+        start = time.perf_counter()
+        sequence = 0
+        for line, item_id, prompt in prompts:
+            if id_key(item_id) in done:
+                skipped += 1
+                continue
+            await slots.acquire()
+            task = asyncio.ensure_future(self.answer(sequence, line, item_id, prompt, slots))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            sequence += 1
+        if tasks:
+            await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - start
+        answered = sum(self.outcomes.values())
+        return {
+            "seconds": elapsed,
+            "answered": answered,
+            "skipped": skipped,
+            "outcomes": dict(self.outcomes),
+            "errors": answered - sum(self.outcomes.get(outcome, 0) for outcome in DONE),
+            "prompts_per_second": answered / elapsed if elapsed > 0 else 0.0,
+            "characters_per_second": self.characters / elapsed if elapsed > 0 else 0.0,
+            "latency": stats(self.latencies),
+        }
+
+    async def answer(self, sequence: int, line: int, item_id, prompt: str, slots: asyncio.Semaphore):
+        start = time.perf_counter()
+        response, outcome = "", "cancelled"
+        try:
+            response, outcome = await self.ask(prompt)
+        except Exception as e:
+            # Cualquier fallo queda como fila con error: se reintenta al reanudar
+            print(f"línea {line}: {e}", file=sys.stderr)
+            outcome = classify_error(e)
+        finally:
+            # También al cancelar: si no, el hueco no se liberaría nunca
+            seconds = time.perf_counter() - start
+            self.latencies.append(seconds)
+            self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+            self.characters += len(response)
+            self.finish(sequence, {"id": item_id, "line": line, "outcome": outcome, "response": response,
+                                   "seconds": round(seconds, 3)}, slots)
+
+    async def ask(self, prompt: str) -> Tuple[str, str]:
+        """(respuesta, outcome) de una pregunta"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def done(text: str):  # Hilo del worker
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(text))
+
+        engine = self.engine
+        session_id = engine.new_session_id()
+        messages, use_cache = engine.build_request(engine.new_context(), [{"role": "user", "content": prompt}])
+        request = engine.worker.submit(session_id, messages, lambda chunk: None, done, use_cache, stream=False)
+        try:
+            return await asyncio.wait_for(future, self.timeout), request.outcome
+        except asyncio.TimeoutError:
+            return "", "timeout"
+        finally:
+            if not future.done():
+                engine.worker.cancel(session_id)
+
+    def finish(self, sequence: int, result: dict, slots: asyncio.Semaphore):
+        """Escribe el resultado (con --ordered, cuando le toca) y libera su hueco"""
+        if not self.ordered:
+            try:
+                self.write(result)
+            finally:
+                slots.release()
+            return
+        self.finished[sequence] = result
+        while self.next_to_write in self.finished:
+            result = self.finished.pop(self.next_to_write)
+            self.next_to_write += 1
+            try:
+                self.write(result)
+            finally:
+                slots.release()
+
+    def write(self, result: dict):
+        # Una línea completa por write y con flush: una interrupción pierde como mucho la línea en curso
+        self.output.write(json.dumps(result, ensure_ascii=False) + "\n")
+        self.output.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pasa un JSONL de preguntas por el asistente, sin interfaz")
+    parser.add_argument("input", help="JSONL de entrada, una pregunta por línea")
+    parser.add_argument("output", help="JSONL de resultados; también sirve de punto de control")
+    parser.add_argument("--concurrency", type=int, default=8, help="preguntas a la vez")
+    parser.add_argument("--ordered", action="store_true", help="escribe los resultados en el orden de entrada")
+    parser.add_argument("--restart", action="store_true", help="descarta la salida anterior en lugar de reanudar")
+    parser.add_argument("--field", help="campo con la pregunta (por defecto prompt, content o body)")
+    parser.add_argument("--id-field", help="campo con el id (por defecto id o request_id; si no, el número de línea)")
+    parser.add_argument("--no-cache", action="store_true", help="no usar la caché de respuestas")
+    parser.add_argument("--timeout", type=float, default=120.0, help="segundos máximos por pregunta")
+    args = parser.parse_args()
+    if args.concurrency < 1:
+        parser.error("--concurrency debe ser al menos 1")
+
+    done = set() if args.restart else load_checkpoint(args.output)
+    exporter = start_metrics()
+    worker = RequestWorker(create_backend(args.concurrency), cache=None if args.no_cache else ResponseCache(),
+                           max_concurrent=args.concurrency)
+    engine = ChatEngine(worker, cache_responses=not args.no_cache)
+    try:
+        with open(args.output, 'w' if args.restart else 'a', encoding='utf-8') as output:
+            runner = BatchRunner(engine, output, args.concurrency, args.ordered, args.timeout)
+            prompts = read_prompts(args.input, args.field, args.id_field)
+            results = asyncio.run(runner.run(prompts, done))
+    except KeyboardInterrupt:
+        print("Interrumpido: vuelve a lanzar el mismo comando para continuar", file=sys.stderr)
+        return
+    finally:
+        engine.close()
+        if exporter is not None:
+            exporter.close()
+
+    print(f"{results['answered']} preguntas en {results['seconds']:.1f} s ({results['skipped']} ya respondidas, "
+          f"{results['errors']} errores)")
+    print(f"{results['prompts_per_second']:.2f} preguntas/s, {results['characters_per_second']:.0f} caracteres/s")
+    if results["latency"]["n"]:
+        print(f"latencia p50 {results['latency']['p50']:.2f} s, p95 {results['latency']['p95']:.2f} s")
+    if results["outcomes"]:
+        print("resultados: " + ", ".join(f"{outcome} {count}" for outcome, count in sorted(results["outcomes"].items())))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+from typing import Dict, List, Tuple
+
+
+class TextWrapper:
+    """Ajuste de líneas en tiempo lineal con caché de anchos de palabra"""
+
+    max_cached_words = 50000
+
+    def __init__(self, font):
+        self.font = font
+        self.word_widths: Dict[str, int] = {}
+        self.space_width = font.size(' ')[0]
+
+    def word_width(self, word: str) -> int:
+        width = self.word_widths.get(word)
+        if width is None:
+            if len(self.word_widths) >= self.max_cached_words:
+                self.word_widths.clear()
+            width = self.font.size(word)[0]
+            self.word_widths[word] = width
+        return width
+
+    def wrap(self, text: str, max_width: int) -> List[str]:
+        """Ajusta el texto al ancho dado; las palabras demasiado largas se parten"""
+        return [line for line, _ in self.wrap_measured(text, max_width)]
+
+    def wrap_measured(self, text: str, max_width: int) -> List[Tuple[str, int]]:
+        """Como wrap, con el ancho de cada línea (suma de palabras y espacios)"""
+        lines = []
+        current_line: List[str] = []
+        current_width = 0
+
+        for word in text.split(' '):
+            width = self.word_width(word)
+            if current_line and current_width + self.space_width + width <= max_width:
+                current_line.append(word)
+                current_width += self.space_width + width
+                continue
+
+            if current_line:
+                lines.append((' '.join(current_line), current_width))
+            # URLs y tokens más anchos que la línea se parten por búsqueda binaria
+            while width > max_width and len(word) > 1:
+                cut = self.break_index(word, max_width)
+                lines.append((word[:cut], self.word_width(word[:cut])))
+                word = word[cut:]
+                width = self.word_width(word)
+            current_line = [word]
+            current_width = width
+
+        if current_line:
+            lines.append((' '.join(current_line), current_width))
+        return lines
+
+    def break_index(self, word: str, max_width: int) -> int:
+        """Mayor prefijo de la palabra que cabe en max_width (al menos un carácter)"""
+        low, high = 1, len(word) - 1
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self.font.size(word[:middle])[0] <= max_width:
+                low = middle
+            else:
+                high = middle - 1
+        return low
+
+
+class HeightIndex:
+    """Sumas prefijas de alturas (árbol de Fenwick) con actualización incremental"""
+
+    def __init__(self):
+        self.heights: List[int] = []
+        self.tree: List[int] = [0]
+
+    def __len__(self):
+        return len(self.heights)
+
+    def clear(self):
+        self.heights = []
+        self.tree = [0]
+
+    def rebuild(self, heights: List[int]):
+        """Reconstruye el índice en O(n)"""
+        self.heights = list(heights)
+        self.tree = [0] + self.heights
+        for i in range(1, len(self.tree)):
+            parent = i + (i & -i)
+            if parent < len(self.tree):
+                self.tree[parent] += self.tree[i]
+
+    def append(self, height: int):
+        self.heights.append(height)
+        i = len(self.heights)
+        # El nodo i cubre (i - lowbit(i), i]
+        self.tree.append(height + self.prefix(i - 1) - self.prefix(i - (i & -i)))
+
+    def update(self, index: int, height: int):
+        delta = height - self.heights[index]
+        if not delta:
+            return
+        self.heights[index] = height
+        i = index + 1
+        while i < len(self.tree):
+            self.tree[i] += delta
+            i += i & -i
+
+    def prefix(self, count: int) -> int:
+        """Suma de las primeras `count` alturas"""
+        total = 0
+        while count > 0:
+            total += self.tree[count]
+            count -= count & -count
+        return total
+
+    def total(self) -> int:
+        return self.prefix(len(self.heights))
+
+    def find(self, y: int) -> int:
+        """Índice del elemento que contiene el desplazamiento y, en O(log n)"""
+        if y < 0:
+            return 0
+        index = 0
+        step = 1 << len(self.tree).bit_length()
+        while step:
+            next_index = index + step
+            if next_index < len(self.tree) and self.tree[next_index] <= y:
+                index = next_index
+                y -= self.tree[next_index]
+            step >>= 1
+        return index
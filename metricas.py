@@ -0,0 +1,235 @@
+import bisect
+import json
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# Límites de los histogramas, en segundos
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0)
+FRAME_BUCKETS = (0.002, 0.004, 0.008, 0.016, 0.033, 0.05, 0.1, 0.25, 0.5, 1.0)
+SAVE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+RATE_BUCKETS = (1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 200, 400)  # Tokens por segundo
+
+
+def escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def format_number(value: float) -> str:
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metric:
+    """Serie con etiquetas; los valores de las etiquetas se pasan por posición, en el orden de `labels`"""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        super().__init__(name, help, labels)
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def get(self, *labels: str) -> float:
+        return self.values.get(labels, 0)
+
+    def render(self) -> List[str]:
+        with self.lock:
+            values = sorted(self.values.items())
+        return self.header() + [f"{self.name}{format_labels(self.labels, key)} {format_number(value)}"
+                                for key, value in values]
+
+
+class Gauge(Counter):
+    """Valor que sube y baja; con `function` se lee en el momento de exportar"""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (),
+                 function: Optional[Callable[[], float]] = None):
+        super().__init__(name, help, labels)
+        self.function = function
+
+    def set(self, value: float, *labels: str):
+        self.values[labels] = value  # Una asignación: no hace falta el lock
+
+    def render(self) -> List[str]:
+        if self.function is not None:
+            self.set(self.function())
+        return super().render()
+
+
+class Histogram(Metric):
+    """Recuentos por intervalo, suma y total; observe() es una búsqueda binaria y tres sumas"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        self.series: Dict[Tuple[str, ...], list] = {}  # etiquetas -> [recuentos por intervalo..., suma, total]
+
+    def observe(self, value: float, *labels: str):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(labels)
+            if series is None:
+                series = self.series[labels] = [0] * (len(self.buckets) + 3)
+            series[index] += 1  # El último intervalo es +Inf
+            series[-2] += value
+            series[-1] += 1
+
+    def count(self, *labels: str) -> int:
+        series = self.series.get(labels)
+        return series[-1] if series else 0
+
+    def render(self) -> List[str]:
+        with self.lock:
+            series = sorted((key, list(values)) for key, values in self.series.items())
+        lines = self.header()
+        for key, values in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), values):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{format_number(bound)}"'
+                lines.append(f"{self.name}_bucket{format_labels(self.labels, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.labels, key)} {format_number(values[-2])}")
+            lines.append(f"{self.name}_count{format_labels(self.labels, key)} {values[-1]}")
+        return lines
+
+
+class MetricsRegistry:
+    """Métricas del proceso, exportables en el formato de texto de Prometheus"""
+
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self.metrics:
+            raise ValueError(f"Métrica repetida: {metric.name}")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, labels: Sequence[str] = (),
+              function: Optional[Callable[[], float]] = None) -> Gauge:
+        return self.register(Gauge(name, help, labels, function))
+
+    def histogram(self, name: str, help: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str):
+        """Escribe el fichero de una vez (renombrado atómico), para que quien lo lea nunca lo vea a medias"""
+        temporary = f"{path}.tmp"
+        with open(temporary, 'w', encoding='utf-8') as f:
+            f.write(self.render())
+        os.replace(temporary, path)
+
+
+class MetricsExporter:
+    """Hilo que vuelca las métricas a un fichero cada `interval` segundos (p. ej. para node_exporter)"""
+
+    def __init__(self, registry: MetricsRegistry, path: str, interval: float = 15.0):
+        self.registry = registry
+        self.path = path
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.export()
+
+    def export(self):
+        try:
+            self.registry.write(self.path)
+        except OSError as e:
+            print(f"Error exportando métricas: {e}")
+
+    def close(self):
+        self.stopped.set()
+        self.export()
+
+
+class RequestLog:
+    """Una línea JSON por petición al modelo; sin fichero no hace nada"""
+
+    def __init__(self):
+        self.file = None
+        self.lock = threading.Lock()
+
+    def open(self, path: str):
+        self.file = open(path, 'a', encoding='utf-8', buffering=1)
+
+    def write(self, record: dict):
+        if self.file is None:
+            return
+        line = json.dumps({"time": round(time.time(), 3), **record}, ensure_ascii=False)
+        with self.lock:
+            self.file.write(line + "\n")
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+# Métricas globales del proceso; cada módulo anota las suyas
+metrics = MetricsRegistry()
+request_log = RequestLog()
+
+REQUESTS = metrics.counter("chatbot_requests_total", "Peticiones al modelo por resultado", ("model", "outcome"))
+REQUEST_SECONDS = metrics.histogram("chatbot_request_seconds", "Duración de las peticiones completadas, reintentos incluidos", ("model",))
+FIRST_TOKEN_SECONDS = metrics.histogram("chatbot_time_to_first_token_seconds", "Tiempo hasta el primer fragmento de la respuesta", ("model",))
+TOKENS_PER_SECOND = metrics.histogram("chatbot_tokens_per_second", "Tokens por segundo generados tras el primer fragmento", ("model",), RATE_BUCKETS)
+QUEUE_SECONDS = metrics.histogram("chatbot_queue_seconds", "Espera en la cola del worker antes de llamar a la API", ("model",))
+ERRORS = metrics.counter("chatbot_errors_total", "Errores de la API por tipo, también los reintentados", ("model", "kind"))
+CACHE_LOOKUPS = metrics.counter("chatbot_cache_lookups_total", "Consultas a la caché de respuestas", ("result",))
+QUEUE_DEPTH = metrics.gauge("chatbot_queue_depth", "Peticiones esperando en la cola del worker")
+IN_FLIGHT = metrics.gauge("chatbot_requests_in_flight", "Peticiones llamando a la API")
+TTS_FIRST_AUDIO_SECONDS = metrics.histogram("chatbot_tts_time_to_first_audio_seconds", "Desde que una respuesta encola su primera frase hasta que empieza a sonar")
+FRAME_SECONDS = metrics.histogram("chatbot_frame_seconds", "Tiempo de los fotogramas dibujados", buckets=FRAME_BUCKETS)
+HISTORY_SAVE_SECONDS = metrics.histogram("chatbot_history_save_seconds", "Escritura de un lote en el historial SQLite", buckets=SAVE_BUCKETS)
+
+
+def observe_frame(record: dict):
+    """Hook para FrameProfiler"""
+    FRAME_SECONDS.observe(record["frame_time"])
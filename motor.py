@@ -0,0 +1,235 @@
+"""Núcleo del asistente sin interfaz: configuración, sesiones de chat, contexto e historial
+
+Lo usan tanto la ventana de pygame (grafica.py) como el servidor (servidor_chat.py); no importa pygame.
+"""
+import concurrent.futures
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from contexto import ContextBuilder
+from historial import ConversationStore
+from metricas import MetricsExporter, metrics, request_log
+from peticiones import RequestWorker
+from proveedores import ChatBackend, OpenAIBackend, RecordingBackend, ReplayBackend
+
+# Configuración del chatbot
+base_url = "https://api.aimlapi.com/v1"
+api_key = os.getenv("API_KEY", "fa0e452867df46829a6434883a5b5d11")
+system_prompt = "Eres un asistente inteligente. Responde de manera clara y útil a cualquier pregunta."
+welcome_message = "Hola, ¿en qué puedo ayudarte hoy?"
+stream_responses = True  # Mostrar la respuesta token a token mientras se genera
+cache_responses = True  # Reutilizar respuestas a preguntas repetidas
+context_token_budget = 3000  # Tokens máximos por petición (los turnos antiguos se resumen)
+record_file = os.getenv("RECORD_FILE")  # Graba las respuestas reales, con sus tiempos, en este JSONL
+replay_file = os.getenv("REPLAY_FILE")  # Reproduce respuestas grabadas en lugar de llamar a la API
+replay_speed = float(os.getenv("REPLAY_SPEED", "1"))  # 0 = sin esperas
+metrics_file = os.getenv("METRICS_FILE")  # Métricas en formato Prometheus, reescritas cada metrics_interval s
+metrics_interval = float(os.getenv("METRICS_INTERVAL", "15"))
+request_log_file = os.getenv("REQUEST_LOG")  # Una línea JSON por petición al modelo
+
+ROLES = {"user": "Tú", "assistant": "Asistente"}  # Rol de la API -> remitente en el historial
+SENDERS = {sender: role for role, sender in ROLES.items()}  # Los demás remitentes (avisos) no son turnos
+
+
+def create_backend(max_connections: int = 8) -> ChatBackend:
+    if replay_file:
+        return ReplayBackend(replay_file, speed=replay_speed)
+    backend = OpenAIBackend(base_url, api_key, max_connections=max_connections)
+    if record_file:
+        backend = RecordingBackend(backend, record_file)
+    return backend
+
+
+def start_metrics() -> Optional[MetricsExporter]:
+    """Abre el registro de peticiones y arranca la exportación de métricas, si están configurados"""
+    if request_log_file:
+        request_log.open(request_log_file)
+    if metrics_file:
+        return MetricsExporter(metrics, metrics_file, metrics_interval)
+    return None
+
+
+class ChatSession:
+    """Una conversación del motor: turnos role/content, contexto y conversación en el almacén"""
+
+    def __init__(self, session_id: int, context: ContextBuilder):
+        self.id = session_id
+        self.context = context
+        self.turns: List[dict] = []
+        self.conversation_id: Optional[int] = None
+        self.unsaved: List[dict] = []  # Mensajes anteriores a la primera pregunta, aún sin conversación
+        self.position = 0  # Posición del siguiente mensaje en la conversación guardada
+        self.busy = False  # Hay una respuesta en curso; los turnos van de uno en uno
+        self.pending: Optional[dict] = None  # Turno del usuario que espera respuesta
+        self.last_used = time.monotonic()
+        # send y cancel corren en el hilo del llamante y la respuesta en el del worker
+        self.lock = threading.Lock()
+
+
+class ChatEngine:
+    """Sesiones de chat sobre un RequestWorker compartido
+
+    Los ids de sesión son también los de conversación del worker, así que toda petición del mismo
+    worker debe pedir su id aquí (new_session_id) para poder cancelarse sin afectar a otras.
+    """
+
+    def __init__(self, worker: RequestWorker, store: Optional[ConversationStore] = None,
+                 cache_responses: bool = cache_responses, token_budget: int = context_token_budget):
+        self.worker = worker
+        self.store = store
+        self.cache_responses = cache_responses
+        self.token_budget = token_budget
+        self.sessions: Dict[int, ChatSession] = {}
+        self.lock = threading.Lock()
+        self.last_session = 0
+
+    def new_session_id(self) -> int:
+        with self.lock:
+            self.last_session += 1
+            return self.last_session
+
+    def new_context(self) -> ContextBuilder:
+        return ContextBuilder(system_prompt, self.token_budget, summarizer=self.summarize)
+
+    def build_request(self, context: ContextBuilder, turns: List[dict]) -> Tuple[List[dict], bool]:
+        """Mensajes a enviar y si se puede usar la caché de respuestas"""
+        messages = context.build(turns)
+        # Solo se cachean preguntas sueltas; en mitad de una conversación importa la variedad
+        use_cache = self.cache_responses and sum(turn["role"] == "user" for turn in turns) == 1
+        return messages, use_cache
+
+    # --- Sesiones ---
+
+    def create_session(self) -> ChatSession:
+        session = ChatSession(self.new_session_id(), self.new_context())
+        with self.lock:
+            self.sessions[session.id] = session
+        return session
+
+    def get_session(self, session_id: int) -> Optional[ChatSession]:
+        with self.lock:
+            return self.sessions.get(session_id)
+
+    def close_session(self, session: ChatSession):
+        self.cancel(session)
+        with self.lock:
+            self.sessions.pop(session.id, None)
+
+    def send(self, session: ChatSession, text: str, on_chunk: Callable[[str], None],
+             on_done: Callable[[str], None], stream: bool = True,
+             on_retry: Optional[Callable[[int, float, str], None]] = None) -> bool:
+        """Añade el turno del usuario y lanza la petición; False si la sesión ya espera respuesta
+
+        Los callbacks se ejecutan en el hilo del worker; on_done no se llama si se cancela antes.
+        """
+        turn = {"role": "user", "content": text}
+        with session.lock:
+            if session.busy:
+                return False
+            session.busy = True
+            session.pending = turn
+            session.last_used = time.monotonic()
+            session.turns.append(turn)
+            # Se guarda ya: la pregunta no se pierde si la respuesta se cancela o el proceso cae
+            self.persist(session, ROLES["user"], text, create=True)
+            turns = list(session.turns)
+        messages, use_cache = self.build_request(session.context, turns)
+
+        def done(response: str):
+            if not response:
+                response = "No se pudo obtener una respuesta."
+            with session.lock:
+                if session.pending is not turn:
+                    return  # Cancelada mientras llegaba: la pregunta ya se retiró
+                session.turns.append({"role": "assistant", "content": response})
+                session.pending = None
+                session.busy = False
+                self.persist(session, ROLES["assistant"], response)
+            on_done(response)
+
+        self.worker.submit(session.id, messages, on_chunk, done, use_cache, stream=stream, on_retry=on_retry)
+        return True
+
+    def note(self, session: ChatSession, sender: str, content: str):
+        """Mensaje añadido fuera de send (saludo, avisos); los del asistente también son contexto"""
+        with session.lock:
+            role = SENDERS.get(sender)
+            if role is not None:
+                session.turns.append({"role": role, "content": content})
+            self.persist(session, sender, content)
+
+    def cancel(self, session: ChatSession):
+        """Cancela la respuesta en curso y retira del contexto la pregunta sin contestar (sigue guardada)"""
+        self.worker.cancel(session.id)
+        with session.lock:
+            if session.pending is not None and session.turns and session.turns[-1] is session.pending:
+                session.turns.pop()
+            session.pending = None
+            session.busy = False
+
+    def resume(self, session: ChatSession, conversation_id: int, messages: List[dict]):
+        """Continúa en la sesión una conversación del almacén (mensajes de load_messages)
+
+        Los mensajes de otros remitentes (avisos de la interfaz) no son turnos, pero ocupan su posición.
+        """
+        with session.lock:
+            session.turns = [{"role": SENDERS[msg['sender']], "content": msg['content']}
+                             for msg in messages if msg['sender'] in SENDERS]
+            session.conversation_id = conversation_id
+            session.unsaved = []
+            session.position = len(messages)
+
+    def persist(self, session: ChatSession, sender: str, content: str, create: bool = False):
+        """Guarda un mensaje en cuanto se añade, en su posición; se llama con session.lock tomado
+
+        Un saludo o un aviso solos no son conversación: esperan en la sesión hasta la primera pregunta
+        (create=True), que crea la conversación y los guarda delante de ella.
+        """
+        if self.store is None:
+            return
+        created = int(time.time())
+        session.unsaved.append({
+            'sender': sender,
+            'content': content,
+            'timestamp': time.strftime("%H:%M", time.localtime(created)),
+            'created': created,
+        })
+        if session.conversation_id is None:
+            if not create:
+                return
+            session.conversation_id = self.store.new_conversation()
+        for message in session.unsaved:
+            self.store.append_message(session.conversation_id, session.position, message)
+            session.position += 1
+        session.unsaved.clear()
+
+    # --- Peticiones sueltas ---
+
+    def complete(self, messages: List[dict], use_cache: bool = False) -> str:
+        """Respuesta completa sin streaming; pasa por el worker para tener reintentos y caché"""
+        future = concurrent.futures.Future()
+        # Id -1: ninguna sesión lo usa, así no la cancela un cambio de conversación
+        self.worker.submit(-1, messages, lambda chunk: None, future.set_result, use_cache, stream=False)
+        return future.result()
+
+    def summarize(self, previous_summary: str, turns: List[dict]) -> str:
+        """Resume los turnos que ya no caben en el contexto, partiendo del resumen previo"""
+        transcript = "\n".join(
+            f"{'Usuario' if turn['role'] == 'user' else 'Asistente'}: {turn['content']}" for turn in turns
+        )
+        if previous_summary:
+            transcript = f"Resumen previo: {previous_summary}\n\n{transcript}"
+        future = self.worker.complete(
+            [
+                {"role": "system", "content": "Resume la conversación en pocas frases, conservando datos, nombres y decisiones importantes."},
+                {"role": "user", "content": transcript},
+            ],
+            temperature=0.3,
+            max_tokens=200,
+        )
+        return future.result(timeout=60)
+
+    def close(self):
+        self.worker.close()
@@ -0,0 +1,149 @@
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Deque, Dict, List
+
+
+def percentile(values, fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def stats(samples: list) -> dict:
+    """Número de muestras, media, p50, p95 y máximo"""
+    return {
+        "n": len(samples),
+        "mean": sum(samples) / len(samples) if samples else 0.0,
+        "p50": percentile(samples, 0.50),
+        "p95": percentile(samples, 0.95),
+        "max": max(samples, default=0.0),
+    }
+
+
+class FrameProfiler:
+    """Tiempos por fase de cada fotograma en una ventana deslizante"""
+
+    def __init__(self, window: int = 240):
+        self.window = window
+        self.frames = 0
+        self.frame_start = time.perf_counter()
+        self.current: Dict[str, float] = {}
+        self.phases: Dict[str, Deque[float]] = {}
+        self.frame_times: Deque[float] = deque(maxlen=window)
+        self.hooks: List[Callable[[dict], None]] = []
+
+    def begin_frame(self):
+        self.frame_start = time.perf_counter()
+
+    @contextmanager
+    def measure(self, phase: str):
+        """Acumula el tiempo del bloque en la fase indicada del fotograma actual"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.current[phase] = self.current.get(phase, 0.0) + time.perf_counter() - start
+
+    def end_frame(self):
+        frame_time = time.perf_counter() - self.frame_start
+        self.frame_times.append(frame_time)
+        for phase, seconds in self.current.items():
+            samples = self.phases.get(phase)
+            if samples is None:
+                samples = self.phases[phase] = deque(maxlen=self.window)
+            samples.append(seconds)
+
+        record = {"frame": self.frames, "frame_time": frame_time, "phases": self.current}
+        self.frames += 1
+        self.current = {}
+        for hook in self.hooks:
+            hook(record)
+
+    def add_hook(self, hook: Callable[[dict], None]):
+        """Registra una función que recibe los tiempos de cada fotograma"""
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook: Callable[[dict], None]):
+        if hook in self.hooks:
+            self.hooks.remove(hook)
+
+    def summary(self) -> dict:
+        """Percentiles del tiempo de fotograma y media/p95/máximo por fase, en segundos"""
+        frame_times = list(self.frame_times)
+        return {
+            "frames": self.frames,
+            "frame_time": {
+                "p50": percentile(frame_times, 0.50),
+                "p95": percentile(frame_times, 0.95),
+                "p99": percentile(frame_times, 0.99),
+                "max": max(frame_times, default=0.0),
+            },
+            "phases": {
+                phase: {
+                    "mean": sum(samples) / len(samples),
+                    "p95": percentile(samples, 0.95),
+                    "max": max(samples),
+                }
+                for phase, samples in self.phases.items() if samples
+            },
+        }
+
+    def dump(self, path: str):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.summary(), f, indent=2)
+
+
+class FrameLog:
+    """Hook que escribe una línea JSON por fotograma"""
+
+    def __init__(self, path: str):
+        self.file = open(path, 'a', encoding='utf-8')
+
+    def __call__(self, record: dict):
+        self.file.write(json.dumps(record) + "\n")
+
+    def close(self):
+        self.file.close()
+
+
+class StartupTimer:
+    """Fases del arranque, desde cualquier hilo, medidas desde la creación del temporizador"""
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.lock = threading.Lock()
+        self.phases: List[tuple] = []  # (inicio, duración, nombre, hilo)
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, start, time.perf_counter())
+
+    def mark(self, name: str):
+        """Instante sin duración, p. ej. el primer fotograma"""
+        now = time.perf_counter()
+        self.record(name, now, now)
+
+    def record(self, name: str, start: float, end: float):
+        with self.lock:
+            self.phases.append((start - self.origin, end - start, name, threading.current_thread().name))
+
+    def report(self) -> str:
+        with self.lock:
+            phases = sorted(self.phases)
+        lines = ["Arranque (ms desde el inicio, duración, fase, hilo):"]
+        for start, duration, name, thread in phases:
+            lines.append(f"  {start * 1000:8.1f}  {duration * 1000:8.1f}  {name}  [{thread}]")
+        return "\n".join(lines)
+
+
+# Temporizador global del arranque; los módulos que inician trabajo en segundo plano anotan aquí sus fases
+startup = StartupTimer()
@@ -0,0 +1,411 @@
+import asyncio
+import concurrent.futures
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+from email.utils import parsedate_to_datetime
+from typing import Callable, Dict, List, Optional, Set
+
+import metricas
+from cache import ResponseCache
+from contexto import TokenCounter
+from metricas import request_log
+from perfil import startup
+from proveedores import ChatBackend
+
+
+# Errores transitorios: se reintentan y cuentan para el circuit breaker
+RETRYABLE = {"rate_limit", "server", "timeout", "connection"}
+
+
+class CircuitOpenError(Exception):
+    """El circuit breaker está abierto: se falla sin llamar a la API"""
+
+    def __init__(self, retry_in: float):
+        super().__init__(f"circuit open, retry in {retry_in:.0f}s")
+        self.retry_in = retry_in
+
+
+def classify_error(e: Exception) -> str:
+    """Clasifica la excepción por su tipo o código de estado"""
+    import openai
+    if isinstance(e, CircuitOpenError):
+        return "circuit_open"
+    if isinstance(e, (openai.APITimeoutError, asyncio.TimeoutError)):
+        return "timeout"
+    if isinstance(e, openai.APIConnectionError):
+        return "connection"
+    if isinstance(e, openai.APIStatusError):
+        status = e.status_code
+        if status == 429:
+            return "rate_limit"
+        if status == 403 and "insufficient" in str(e):
+            return "quota"
+        if status == 401:
+            return "auth"
+        if status == 404:
+            return "not_found"
+        if status == 304:
+            return "not_modified"
+        if status >= 500:
+            return "server"
+        return "client"
+    return "unknown"
+
+
+def retry_after(e: Exception) -> Optional[float]:
+    """Segundos indicados por la cabecera Retry-After (o retry-after-ms), si la hay"""
+    response = getattr(e, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000
+        if "retry-after" in headers:
+            value = headers["retry-after"]
+            try:
+                return float(value)
+            except ValueError:
+                return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+    return None
+
+
+# Mensajes fijos para el usuario (también se precargan en la caché de voz)
+ERROR_MESSAGES = {
+    "quota": "Límite de uso alcanzado: Has agotado tu cuota de solicitudes. Por favor, actualiza tu método de pago para continuar usando el servicio.",
+    "rate_limit": "El servidor está ocupado, por favor inténtalo de nuevo más tarde.",
+    "not_found": "Error: Recurso no encontrado (404)",
+    "auth": "Error: No autorizado (comprueba tu API key)",
+    "not_modified": "Error: No se pudo modificar el recurso (304)",
+    "internal": "Error interno del servidor (500)",
+    "connection": "Problemas de conexión con el servidor. Por favor, inténtalo de nuevo más tarde.",
+    "unknown": "Se produjo un error inesperado. Por favor, inténtalo de nuevo más tarde.",
+}
+
+
+def describe_api_error(e: Exception) -> str:
+    """Traduce una excepción de la API a un mensaje para el usuario"""
+    kind = classify_error(e)
+    if kind == "circuit_open":
+        return f"El servicio no responde. Se volverá a intentar en {e.retry_in:.0f} s."
+    if kind == "server" and e.status_code == 500:
+        return ERROR_MESSAGES["internal"]
+    if kind in ("server", "timeout", "connection"):
+        return ERROR_MESSAGES["connection"]
+    return ERROR_MESSAGES.get(kind, ERROR_MESSAGES["unknown"])
+
+
+@dataclass
+class RetryPolicy:
+    max_attempts: int = 4
+    base_delay: float = 0.5
+    max_delay: float = 8.0
+    deadline: float = 60.0  # Tiempo total por petición, reintentos incluidos
+
+    def delay(self, attempt: int, server_hint: Optional[float] = None) -> float:
+        """Espera exponencial con jitter completo; Retry-After manda si es mayor"""
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+        if server_hint is not None:
+            delay = max(delay, server_hint)
+        return delay
+
+
+class CircuitBreaker:
+    """Tras varios fallos seguidos deja de llamar a la API durante un tiempo"""
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_running = False
+
+    def is_open(self) -> bool:
+        """Si ahora mismo se rechazaría una llamada; a diferencia de allow() no ocupa la prueba"""
+        if self.opened_at is None:
+            return False
+        return time.monotonic() - self.opened_at < self.reset_timeout or self.trial_running
+
+    def allow(self) -> bool:
+        """Se llama justo antes de cada intento: en semiabierto se queda la única prueba"""
+        if self.opened_at is None:
+            return True
+        # Semiabierto: pasado el tiempo de espera se deja pasar una petición de prueba
+        if not self.is_open():
+            self.trial_running = True
+            return True
+        return False
+
+    def retry_in(self) -> float:
+        if self.opened_at is None:
+            return 0.0
+        return max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+
+    def record_failure(self):
+        self.failures += 1
+        self.trial_running = False
+        if self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+
+@dataclass(eq=False)
+class ChatRequest:
+    conversation_id: int
+    messages: List[dict]
+    on_chunk: Callable[[str], None]
+    on_done: Callable[[str], None]
+    use_cache: bool = False
+    stream: bool = True
+    on_retry: Optional[Callable[[int, float, str], None]] = None  # (intento, espera, tipo de error)
+    cancelled: bool = False
+    task: Optional[asyncio.Task] = field(default=None, repr=False)
+    # Para las métricas (instantes de time.perf_counter)
+    submitted: float = field(default_factory=time.perf_counter)
+    started: Optional[float] = None
+    first_chunk: Optional[float] = None
+    last_chunk: Optional[float] = None
+    chunks: int = 0
+    first_text: str = field(default="", repr=False)  # Primer fragmento y respuesta, para contar tokens
+    response: str = field(default="", repr=False)
+    attempts: int = 0
+    outcome: str = "ok"  # "ok", "cached", "cancelled" o el tipo de error
+
+
+class RequestWorker:
+    """Hilo con un bucle asyncio que atiende todas las peticiones al modelo
+
+    Las respuestas las da el proveedor (ChatBackend) indicado. Cada petición lleva el id de su
+    conversación, de modo que se pueden cancelar las que quedan obsoletas.
+    Los callbacks se ejecutan en el hilo del bucle.
+    """
+
+    def __init__(self, backend: ChatBackend, cache: Optional[ResponseCache] = None, max_concurrent: int = 4,
+                 retry_policy: Optional[RetryPolicy] = None, breaker: Optional[CircuitBreaker] = None):
+        self.backend = backend
+        self.cache = cache
+        self.max_concurrent = max_concurrent
+        self.active: Dict[int, Set[ChatRequest]] = {}
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.breaker = breaker or CircuitBreaker()
+        self.in_flight = 0
+        self.token_counter = TokenCounter(backend.model)
+
+        # No se espera al hilo: las peticiones enviadas antes de que arranque quedan en cola
+        self.loop = asyncio.new_event_loop()
+        self.ready = threading.Event()
+        self.thread = threading.Thread(target=self.run_loop, daemon=True)
+        self.thread.start()
+
+    def run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        # La cola existe antes de arrancar el proveedor: las peticiones ya enviadas se encolan mientras
+        self.queue: "asyncio.Queue[ChatRequest]" = asyncio.Queue()
+        with startup.phase("cliente API"):
+            self.loop.run_until_complete(self.backend.start())
+        self.consumers = [self.loop.create_task(self.consume()) for _ in range(self.max_concurrent)]
+        self.ready.set()
+        self.loop.run_forever()
+
+    # --- API para otros hilos ---
+
+    def submit(self, conversation_id: int, messages: List[dict], on_chunk: Callable[[str], None],
+               on_done: Callable[[str], None], use_cache: bool = False, stream: bool = True,
+               on_retry: Optional[Callable[[int, float, str], None]] = None) -> ChatRequest:
+        request = ChatRequest(conversation_id, messages, on_chunk, on_done, use_cache, stream, on_retry)
+        self.loop.call_soon_threadsafe(self.enqueue, request)
+        return request
+
+    def cancel(self, conversation_id: int):
+        """Cancela las peticiones en cola o en curso de la conversación"""
+        self.loop.call_soon_threadsafe(self.cancel_conversation, conversation_id)
+
+    def complete(self, messages: List[dict], **options) -> concurrent.futures.Future:
+        """Petición sin streaming ni caché; devuelve un Future con el texto"""
+        return asyncio.run_coroutine_threadsafe(self.backend.complete(messages, **options), self.loop)
+
+    def close(self):
+        self.ready.wait()
+
+        async def shutdown():
+            for consumer in self.consumers:
+                consumer.cancel()
+            await self.backend.close()
+
+        asyncio.run_coroutine_threadsafe(shutdown(), self.loop).result(timeout=5)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout=5)
+
+    # --- Dentro del bucle ---
+
+    def enqueue(self, request: ChatRequest):
+        self.active.setdefault(request.conversation_id, set()).add(request)
+        self.queue.put_nowait(request)
+        metricas.QUEUE_DEPTH.set(self.queue.qsize())
+
+    def cancel_conversation(self, conversation_id: int):
+        for request in self.active.pop(conversation_id, ()):
+            request.cancelled = True
+            if request.task is not None:
+                request.task.cancel()
+
+    async def consume(self):
+        while True:
+            request = await self.queue.get()
+            metricas.QUEUE_DEPTH.set(self.queue.qsize())
+            if request.cancelled:
+                continue
+            request.task = asyncio.ensure_future(self.handle(request))
+            try:
+                await request.task
+            except asyncio.CancelledError:
+                if not request.task.cancelled():
+                    raise  # Se está cerrando el propio consumidor
+            except Exception as e:
+                print(f"Error en la petición: {e}")
+            finally:
+                requests = self.active.get(request.conversation_id)
+                if requests is not None:
+                    requests.discard(request)
+                    if not requests:
+                        del self.active[request.conversation_id]
+
+    async def handle(self, request: ChatRequest):
+        request.started = time.perf_counter()
+        self.in_flight += 1
+        metricas.IN_FLIGHT.set(self.in_flight)
+        try:
+            await self.answer(request)
+        except asyncio.CancelledError:
+            request.outcome = "cancelled"
+            raise
+        except Exception as e:
+            request.outcome = classify_error(e)
+            raise
+        finally:
+            self.in_flight -= 1
+            metricas.IN_FLIGHT.set(self.in_flight)
+            self.record(request)
+
+    async def answer(self, request: ChatRequest):
+        cache_key = ResponseCache.key(self.backend.model, request.messages, self.backend.temperature)
+        if request.use_cache and self.cache is not None:
+            cached = await asyncio.to_thread(self.cache.get, cache_key)
+            metricas.CACHE_LOOKUPS.inc("miss" if cached is None else "hit")
+            if cached is not None:
+                request.outcome = "cached"
+                request.on_done(cached)
+                return
+
+        text = await self.call_with_retries(request)
+        if text is None:
+            return
+        if text and request.use_cache and self.cache is not None:
+            await asyncio.to_thread(self.cache.put, cache_key, text)
+        request.on_done(text)
+
+    async def call_with_retries(self, request: ChatRequest) -> Optional[str]:
+        """Llama a la API reintentando los fallos transitorios dentro del plazo de la petición
+
+        Devuelve el texto para cachear, o None si ya se ha entregado un error.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.retry_policy.deadline
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                request.outcome = "circuit_open"
+                request.on_done(describe_api_error(CircuitOpenError(self.breaker.retry_in())))
+                return None
+            attempt += 1
+            request.attempts = attempt
+            parts = []
+            try:
+                remaining = deadline - loop.time()
+                if request.stream:
+                    await asyncio.wait_for(self.collect_stream(request, parts), remaining)
+                    text = request.response = "".join(parts).strip()
+                else:
+                    text = await asyncio.wait_for(self.backend.complete(request.messages), remaining)
+                self.breaker.record_success()
+                return text
+            except asyncio.CancelledError:
+                self.breaker.trial_running = False
+                raise
+            except Exception as e:
+                kind = classify_error(e)
+                metricas.ERRORS.inc(self.backend.model, kind)
+                if kind in RETRYABLE:
+                    self.breaker.record_failure()
+                else:
+                    self.breaker.record_success()  # El servidor ha respondido
+                delay = self.retry_policy.delay(attempt, retry_after(e))
+                # Con texto ya mostrado no se reintenta: el usuario vería la respuesta duplicada
+                give_up = (
+                    parts or kind not in RETRYABLE or isinstance(e, asyncio.TimeoutError)
+                    or attempt >= self.retry_policy.max_attempts
+                    or loop.time() + delay >= deadline
+                    or self.breaker.is_open()
+                )
+                if give_up:
+                    request.outcome = kind
+                    text = describe_api_error(e)
+                    if parts:
+                        text = "".join(parts).strip() + "\n" + text
+                    request.on_done(text)
+                    return None
+                if request.on_retry is not None:
+                    request.on_retry(attempt, delay, kind)
+                await asyncio.sleep(delay)
+
+    async def collect_stream(self, request: ChatRequest, parts: List[str]):
+        async for delta in self.backend.stream(request.messages):
+            request.last_chunk = time.perf_counter()
+            if request.first_chunk is None:
+                request.first_chunk = request.last_chunk
+                request.first_text = delta
+            request.chunks += 1
+            parts.append(delta)
+            request.on_chunk(delta)
+
+    def record(self, request: ChatRequest):
+        """Métricas y línea de registro de una petición terminada"""
+        now = time.perf_counter()
+        model = self.backend.model
+        metricas.REQUESTS.inc(model, request.outcome)
+        metricas.QUEUE_SECONDS.observe(request.started - request.submitted, model)
+        record = {
+            "conversation": request.conversation_id,
+            "model": model,
+            "outcome": request.outcome,
+            "stream": request.stream,
+            "attempts": request.attempts,
+            "messages": len(request.messages),
+            "queue_ms": round((request.started - request.submitted) * 1000, 1),
+            "duration_ms": round((now - request.started) * 1000, 1),
+        }
+        if request.outcome == "ok":
+            metricas.REQUEST_SECONDS.observe(now - request.started, model)
+        if request.first_chunk is not None:
+            first_token = request.first_chunk - request.started
+            record["first_token_ms"] = round(first_token * 1000, 1)
+            record["chunks"] = request.chunks
+            if request.outcome == "ok":
+                metricas.FIRST_TOKEN_SECONDS.observe(first_token, model)
+                # Tokens generados tras el primer fragmento, entre el primero y el último
+                tokens = self.token_counter.count(request.response, cache=False)
+                generated = tokens - self.token_counter.count(request.first_text, cache=False)
+                record["tokens"] = tokens
+                if generated > 0 and request.last_chunk > request.first_chunk:
+                    rate = generated / (request.last_chunk - request.first_chunk)
+                    metricas.TOKENS_PER_SECOND.observe(rate, model)
+                    record["tokens_per_second"] = round(rate, 1)
+        request_log.write(record)
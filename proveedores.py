@@ -0,0 +1,222 @@
+import abc
+import asyncio
+import json
+import threading
+import time
+from pathlib import Path
+from typing import AsyncIterator, Dict, List, Optional
+
+from cache import ResponseCache
+
+
+class ChatBackend(abc.ABC):
+    """Proveedor de respuestas del modelo
+
+    Los métodos se ejecutan dentro del bucle asyncio del RequestWorker. `stream` devuelve los
+    fragmentos de la respuesta sin espacios iniciales y `complete` el texto entero.
+    """
+
+    model = "gpt-4o"
+    temperature = 0.7
+
+    async def start(self):
+        """Crea los recursos que dependen del bucle (clientes, conexiones)"""
+
+    @abc.abstractmethod
+    async def complete(self, messages: List[dict], **options) -> str:
+        """Texto completo de la respuesta"""
+
+    @abc.abstractmethod
+    def stream(self, messages: List[dict]) -> AsyncIterator[str]:
+        """Fragmentos de la respuesta según llegan"""
+
+    async def close(self):
+        pass
+
+
+class OpenAIBackend(ChatBackend):
+    """API compatible con OpenAI mediante un único AsyncOpenAI con conexiones persistentes"""
+
+    def __init__(self, base_url: str, api_key: str, model: str = "gpt-4o", temperature: float = 0.7,
+                 max_tokens: int = 256, max_connections: int = 8):
+        self.base_url = base_url
+        self.api_key = api_key
+        self.model = model
+        self.temperature = temperature
+        self.max_tokens = max_tokens
+        self.max_connections = max_connections
+        self.client = None
+
+    async def start(self):
+        if self.client is None:
+            self.client = self.create_client()
+
+    def create_client(self) -> "openai.AsyncOpenAI":
+        # openai tarda casi un segundo en importarse: se hace aquí, fuera del hilo de la interfaz
+        import httpx
+        import openai
+
+        # Pool de conexiones keep-alive: se evita repetir el handshake TLS en cada mensaje
+        http_client = openai.DefaultAsyncHttpxClient(
+            limits=httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_connections,
+                keepalive_expiry=120,
+            ),
+            timeout=openai.Timeout(60.0, connect=10.0),
+        )
+        # Los reintentos los gestiona el worker, no el cliente
+        return openai.AsyncOpenAI(base_url=self.base_url, api_key=self.api_key,
+                                  http_client=http_client, max_retries=0)
+
+    async def complete(self, messages: List[dict], **options) -> str:
+        response = await self.client.chat.completions.create(
+            model=options.get("model", self.model),
+            messages=messages,
+            temperature=options.get("temperature", self.temperature),
+            max_tokens=options.get("max_tokens", self.max_tokens),
+        )
+        return response.choices[0].message.content.strip()
+
+    async def stream(self, messages: List[dict]) -> AsyncIterator[str]:
+        stream = await self.client.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            temperature=self.temperature,
+            max_tokens=self.max_tokens,
+            stream=True,
+        )
+        received = False
+        try:
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    if not received:
+                        delta = delta.lstrip()
+                        if not delta:
+                            continue
+                    received = True
+                    yield delta
+        finally:
+            await stream.close()
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.close()
+
+
+def fixture_key(model: str, messages: List[dict], options: dict) -> str:
+    """Clave de una grabación: la misma que usa la caché de respuestas, más las opciones"""
+    key = ResponseCache.key(model, messages, options["temperature"])
+    extra = {name: value for name, value in options.items() if name != "temperature"}
+    return key + (json.dumps(extra, sort_keys=True) if extra else "")
+
+
+class RecordingBackend(ChatBackend):
+    """Envuelve otro proveedor y añade cada respuesta, con sus tiempos, a un archivo JSONL
+
+    Cada línea: {"key", "messages", "stream", "chunks": [[segundos desde el anterior, texto], ...]}.
+    El primer retardo incluye la espera hasta el primer fragmento.
+    """
+
+    def __init__(self, inner: ChatBackend, path: str):
+        self.inner = inner
+        self.model = inner.model
+        self.temperature = inner.temperature
+        self.path = Path(path)
+        self.lock = threading.Lock()
+
+    async def start(self):
+        await self.inner.start()
+
+    async def complete(self, messages: List[dict], **options) -> str:
+        start = time.perf_counter()
+        text = await self.inner.complete(messages, **options)
+        elapsed = time.perf_counter() - start
+        self.save(messages, {"temperature": self.temperature, **options}, False, [[round(elapsed, 4), text]])
+        return text
+
+    async def stream(self, messages: List[dict]) -> AsyncIterator[str]:
+        chunks = []
+        last = time.perf_counter()
+        async for delta in self.inner.stream(messages):
+            now = time.perf_counter()
+            chunks.append([round(now - last, 4), delta])
+            last = now
+            yield delta
+        # Solo se graban las respuestas completas; un error corta antes de llegar aquí
+        self.save(messages, {"temperature": self.temperature}, True, chunks)
+
+    def save(self, messages: List[dict], options: dict, stream: bool, chunks: list):
+        record = {
+            "key": fixture_key(self.model, messages, options),
+            "messages": messages,
+            "stream": stream,
+            "chunks": chunks,
+        }
+        with self.lock, open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    async def close(self):
+        await self.inner.close()
+
+
+class ReplayMissError(LookupError):
+    """No hay ninguna grabación para esa petición"""
+
+
+class ReplayBackend(ChatBackend):
+    """Reproduce respuestas grabadas por RecordingBackend, con su ritmo original
+
+    speed=1 respeta los tiempos grabados, speed=10 va diez veces más rápido y speed=0 no espera.
+    En modo estricto una petición sin grabación falla; si no, se usan las grabaciones por orden.
+    """
+
+    def __init__(self, path: str, speed: float = 1.0, strict: bool = False,
+                 model: str = "gpt-4o", temperature: float = 0.7):
+        self.model = model
+        self.temperature = temperature
+        self.speed = speed
+        self.strict = strict
+        self.records: Dict[str, List[dict]] = {}  # Varias grabaciones por clave se reparten por turnos
+        self.ordered: List[dict] = []
+        self.served: Dict[str, int] = {}
+        self.next_index = 0
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    self.records.setdefault(record["key"], []).append(record)
+                    self.ordered.append(record)
+        if not self.ordered:
+            raise ValueError(f"{path} no contiene grabaciones")
+
+    def find(self, messages: List[dict], options: dict) -> dict:
+        key = fixture_key(self.model, messages, options)
+        candidates = self.records.get(key)
+        if candidates:
+            index = self.served.get(key, 0)
+            self.served[key] = index + 1
+            return candidates[index % len(candidates)]
+        if self.strict:
+            raise ReplayMissError(f"Sin grabación para la petición ({key[:12]}…)")
+        record = self.ordered[self.next_index % len(self.ordered)]
+        self.next_index += 1
+        return record
+
+    async def wait(self, delay: float):
+        if self.speed > 0 and delay > 0:
+            await asyncio.sleep(delay / self.speed)
+
+    async def complete(self, messages: List[dict], **options) -> str:
+        record = self.find(messages, {"temperature": self.temperature, **options})
+        await self.wait(sum(delay for delay, _ in record["chunks"]))
+        return "".join(text for _, text in record["chunks"]).strip()
+
+    async def stream(self, messages: List[dict]) -> AsyncIterator[str]:
+        record = self.find(messages, {"temperature": self.temperature})
+        for delay, text in record["chunks"]:
+            await self.wait(delay)
+            yield text
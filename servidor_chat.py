@@ -0,0 +1,486 @@
+"""Servidor HTTP/WebSocket del asistente, sin interfaz gráfica
+
+Uso: python servidor_chat.py [--host 127.0.0.1] [--port 8080]   (o python grafica.py --serve)
+
+HTTP (JSON):
+  POST   /sessions                  -> {"session": id}
+  POST   /sessions/<id>/messages    {"content": ..., "stream": true}
+         stream=true: text/event-stream, "data: {"chunk": ...}" y al final "data: {"done": true, "response": ...}"
+         stream=false: {"response": ...}
+  DELETE /sessions/<id>             -> cancela la respuesta en curso y cierra la sesión
+  GET    /health                    -> {"sessions": n, "connections": n, "busy": n}
+  GET    /metrics                   -> métricas en formato de texto de Prometheus (ver metricas.py)
+WebSocket: GET /ws (o /ws?session=<id> para retomar una sesión)
+  cliente -> {"content": ...} | {"cancel": true}
+  servidor -> {"session": id} al conectar, {"chunk": ...}, {"done": true, "response": ...}, {"error": ...}
+
+Contrapresión por sesión: una respuesta a la vez (409 o error si ya hay una en curso). Si el cliente
+lee más despacio de lo que llegan los tokens, los fragmentos pendientes se agrupan en uno en lugar de
+acumularse en una cola, y un cliente que deja de leer durante send_timeout segundos se desconecta y su
+petición se cancela.
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import struct
+import threading
+import time
+from dataclasses import dataclass
+from http import HTTPStatus
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from cache import ResponseCache
+from historial import ConversationStore
+from metricas import metrics
+from motor import ChatEngine, ChatSession, create_backend, start_metrics
+from peticiones import RequestWorker
+
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+WS_TEXT, WS_CLOSE, WS_PING, WS_PONG = 0x1, 0x8, 0x9, 0xA
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+@dataclass
+class Request:
+    method: str
+    path: str
+    query: Dict[str, List[str]]
+    headers: Dict[str, str]
+    body: bytes
+
+    def json(self) -> dict:
+        try:
+            data = json.loads(self.body or b"{}")
+        except ValueError:
+            raise HTTPError(400, "El cuerpo no es JSON válido")
+        if not isinstance(data, dict):
+            raise HTTPError(400, "Se esperaba un objeto JSON")
+        return data
+
+
+class ChunkStream:
+    """Fragmentos de una respuesta, del hilo del worker al bucle del servidor
+
+    No es una cola: lo que el cliente aún no ha leído se agrupa en un único fragmento, y solo hay
+    un aviso al bucle pendiente a la vez (cada aviso es una escritura en el socket interno del bucle).
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.lock = threading.Lock()
+        self.parts: List[str] = []
+        self.response: Optional[str] = None
+        self.scheduled = False
+        self.wakeup = asyncio.Event()
+
+    # Se llaman desde el hilo del worker
+    def push(self, chunk: str):
+        with self.lock:
+            self.parts.append(chunk)
+            if self.scheduled:
+                return
+            self.scheduled = True
+        self.wake()
+
+    def finish(self, response: str):
+        with self.lock:
+            self.response = response
+            if self.scheduled:
+                return
+            self.scheduled = True
+        self.wake()
+
+    def wake(self):
+        try:
+            self.loop.call_soon_threadsafe(self.notify)
+        except RuntimeError:
+            pass  # El servidor ya se ha cerrado
+
+    def notify(self):
+        with self.lock:
+            self.scheduled = False
+        self.wakeup.set()
+
+    async def next(self) -> Tuple[str, Optional[str]]:
+        """Espera novedades y devuelve (texto pendiente, respuesta final o None)"""
+        await self.wakeup.wait()
+        self.wakeup.clear()
+        with self.lock:
+            text = "".join(self.parts)
+            self.parts.clear()
+            return text, self.response
+
+
+class ChatServer:
+    max_body = 1024 * 1024
+    max_ws_message = 1024 * 1024
+
+    def __init__(self, engine: ChatEngine, host: str = "127.0.0.1", port: int = 8080,
+                 max_sessions: int = 10000, send_timeout: float = 30.0, idle_timeout: float = 600.0,
+                 keepalive_timeout: float = 60.0):
+        self.engine = engine
+        self.host = host
+        self.port = port
+        self.max_sessions = max_sessions
+        self.send_timeout = send_timeout
+        self.idle_timeout = idle_timeout
+        self.keepalive_timeout = keepalive_timeout
+        self.connections = 0
+        self.attached: Set[int] = set()  # Sesiones con un WebSocket abierto
+        self.server: Optional[asyncio.AbstractServer] = None
+        self.reaper: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle_connection, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]  # Por si se pidió el puerto 0
+        self.reaper = asyncio.get_running_loop().create_task(self.reap_sessions())
+        return self
+
+    async def run(self):
+        await self.start()
+        print(f"Servidor del asistente en http://{self.host}:{self.port}")
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def close(self):
+        if self.reaper is not None:
+            self.reaper.cancel()
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+
+    async def reap_sessions(self):
+        """Cierra las sesiones sin actividad; su conversación ya está en el historial"""
+        while True:
+            await asyncio.sleep(min(60.0, self.idle_timeout))
+            limit = time.monotonic() - self.idle_timeout
+            for session in list(self.engine.sessions.values()):
+                if not session.busy and session.id not in self.attached and session.last_used < limit:
+                    self.engine.close_session(session)
+
+    # --- HTTP ---
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(self.read_request(reader), self.keepalive_timeout)
+                except HTTPError as e:
+                    await self.send_json(writer, e.status, {"error": e.message}, keep_alive=False)
+                    break
+                if request is None:
+                    break
+                keep_alive = request.headers.get("connection", "").lower() != "close"
+                try:
+                    if request.path == "/ws":
+                        await self.handle_websocket(request, reader, writer)
+                        break
+                    await self.route(request, writer, keep_alive)
+                except HTTPError as e:
+                    await self.send_json(writer, e.status, {"error": e.message}, keep_alive=keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.connections -= 1
+            writer.close()
+
+    async def read_request(self, reader: asyncio.StreamReader) -> Optional[Request]:
+        try:
+            line = await reader.readline()
+            if not line:
+                return None
+            method, target, _ = line.decode('latin-1').split(" ", 2)
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode('latin-1').partition(":")
+                headers[name.strip().lower()] = value.strip()
+            length = int(headers.get("content-length", "0") or 0)
+        except ValueError:  # Línea mal formada o demasiado larga
+            raise HTTPError(400, "Petición mal formada")
+        if length > self.max_body:
+            raise HTTPError(413, "Cuerpo demasiado grande")
+        body = await reader.readexactly(length) if length else b""
+        url = urlsplit(target)
+        return Request(method.upper(), url.path.rstrip("/") or "/", parse_qs(url.query), headers, body)
+
+    async def route(self, request: Request, writer: asyncio.StreamWriter, keep_alive: bool):
+        parts = request.path.strip("/").split("/")
+        if request.method == "GET" and parts == ["health"]:
+            busy = sum(session.busy for session in list(self.engine.sessions.values()))
+            await self.send_json(writer, 200, {"sessions": len(self.engine.sessions),
+                                               "connections": self.connections, "busy": busy}, keep_alive)
+        elif request.method == "GET" and parts == ["metrics"]:
+            body = metrics.render().encode('utf-8')
+            writer.write(self.response_head(200, "text/plain; version=0.0.4; charset=utf-8", keep_alive,
+                                            {"Content-Length": str(len(body))}) + body)
+            await writer.drain()
+        elif request.method == "POST" and parts == ["sessions"]:
+            session = self.create_session()
+            await self.send_json(writer, 201, {"session": session.id}, keep_alive)
+        elif len(parts) == 2 and parts[0] == "sessions" and request.method == "DELETE":
+            self.engine.close_session(self.find_session(parts[1]))
+            await self.send_json(writer, 200, {"closed": True}, keep_alive)
+        elif len(parts) == 3 and parts[0] == "sessions" and parts[2] == "messages" and request.method == "POST":
+            session = self.find_session(parts[1])
+            data = request.json()
+            content = data.get("content")
+            if not isinstance(content, str) or not content.strip():
+                raise HTTPError(400, "Falta el campo content")
+            if data.get("stream", True):
+                await self.stream_reply(session, content.strip(), writer, keep_alive)
+            else:
+                response = await self.run_turn(session, content.strip(), None, stream=False)
+                await self.send_json(writer, 200, {"response": response}, keep_alive)
+        else:
+            raise HTTPError(404, "Ruta desconocida")
+
+    def create_session(self) -> ChatSession:
+        if len(self.engine.sessions) >= self.max_sessions:
+            raise HTTPError(503, "Demasiadas sesiones abiertas")
+        return self.engine.create_session()
+
+    def find_session(self, session_id: str) -> ChatSession:
+        session = self.engine.get_session(int(session_id)) if session_id.isdigit() else None
+        if session is None:
+            raise HTTPError(404, "Sesión desconocida")
+        return session
+
+    async def stream_reply(self, session: ChatSession, content: str, writer: asyncio.StreamWriter,
+                           keep_alive: bool):
+        """Respuesta en Server-Sent Events con transferencia por trozos"""
+        # El turno se reclama antes de la cabecera: si la sesión está ocupada aún se puede responder 409
+        chunks = self.start_turn(session, content, stream=True)
+        head = self.response_head(200, "text/event-stream", keep_alive,
+                                  {"Cache-Control": "no-cache", "Transfer-Encoding": "chunked"})
+        writer.write(head)
+
+        async def send(event: dict):
+            data = f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode('utf-8')
+            writer.write(f"{len(data):x}\r\n".encode('ascii') + data + b"\r\n")
+            await writer.drain()
+
+        await self.relay(session, chunks, send)
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    async def run_turn(self, session: ChatSession, content: str,
+                       send: Optional[Callable[[dict], Awaitable[None]]], stream: bool = True) -> str:
+        """Lanza el turno y reenvía los fragmentos con `send`"""
+        chunks = self.start_turn(session, content, stream=stream and send is not None)
+        return await self.relay(session, chunks, send)
+
+    def start_turn(self, session: ChatSession, content: str, stream: bool) -> ChunkStream:
+        """Envía la pregunta; HTTPError 409 si la sesión ya espera una respuesta"""
+        chunks = ChunkStream(asyncio.get_running_loop())
+        if not self.engine.send(session, content, chunks.push, chunks.finish, stream=stream):
+            raise HTTPError(409, "La sesión ya está esperando una respuesta")
+        return chunks
+
+    async def relay(self, session: ChatSession, chunks: ChunkStream,
+                    send: Optional[Callable[[dict], Awaitable[None]]]) -> str:
+        """Reenvía los fragmentos con `send`; cancela la petición si el cliente falla"""
+        try:
+            while True:
+                text, response = await chunks.next()
+                if text and send is not None:
+                    await asyncio.wait_for(send({"chunk": text}), self.send_timeout)
+                if response is not None:
+                    if send is not None:
+                        await asyncio.wait_for(send({"done": True, "response": response}), self.send_timeout)
+                    return response
+        except BaseException:
+            if session.busy:
+                self.engine.cancel(session)
+            raise
+
+    def response_head(self, status: int, content_type: str, keep_alive: bool,
+                      headers: Optional[Dict[str, str]] = None) -> bytes:
+        lines = [f"HTTP/1.1 {status} {HTTPStatus(status).phrase}", f"Content-Type: {content_type}",
+                 f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+        lines += [f"{name}: {value}" for name, value in (headers or {}).items()]
+        return ("\r\n".join(lines) + "\r\n\r\n").encode('latin-1')
+
+    async def send_json(self, writer: asyncio.StreamWriter, status: int, payload: dict, keep_alive: bool = True):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        head = self.response_head(status, "application/json; charset=utf-8", keep_alive,
+                                  {"Content-Length": str(len(body))})
+        writer.write(head + body)
+        await writer.drain()
+
+    # --- WebSocket ---
+
+    async def handle_websocket(self, request: Request, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        key = request.headers.get("sec-websocket-key")
+        if request.headers.get("upgrade", "").lower() != "websocket" or not key:
+            raise HTTPError(400, "Se esperaba una conexión WebSocket")
+        session_ids = request.query.get("session")
+        session = self.find_session(session_ids[0]) if session_ids else self.create_session()
+        if session.id in self.attached:
+            raise HTTPError(409, "La sesión ya tiene un WebSocket abierto")
+
+        accept = base64.b64encode(hashlib.sha1((key + WS_GUID).encode('ascii')).digest()).decode('ascii')
+        writer.write((
+            "HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+            f"Sec-WebSocket-Accept: {accept}\r\n\r\n"
+        ).encode('ascii'))
+        socket = WebSocket(reader, writer, self.max_ws_message)
+        self.attached.add(session.id)
+        turn: Optional[asyncio.Task] = None
+
+        async def send(event: dict):
+            await socket.send_text(json.dumps(event, ensure_ascii=False))
+
+        async def reply(content: str):
+            try:
+                await self.run_turn(session, content, send)
+            except HTTPError as e:
+                await send({"error": e.message})
+            except (asyncio.TimeoutError, ConnectionError):
+                writer.close()  # El cliente no lee: se corta y el bucle de lectura termina
+
+        try:
+            await send({"session": session.id})
+            while True:
+                message = await socket.receive()
+                if message is None:
+                    break
+                try:
+                    data = json.loads(message)
+                except ValueError:
+                    await send({"error": "El mensaje no es JSON válido"})
+                    continue
+                if data.get("cancel"):
+                    if turn is not None:
+                        turn.cancel()
+                elif isinstance(data.get("content"), str) and data["content"].strip():
+                    if turn is not None and not turn.done():
+                        await send({"error": "La sesión ya está esperando una respuesta"})
+                    else:
+                        turn = asyncio.ensure_future(reply(data["content"].strip()))
+                else:
+                    await send({"error": "Falta el campo content"})
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            self.attached.discard(session.id)
+            if turn is not None:
+                turn.cancel()
+
+
+class WebSocket:
+    """Lado servidor de RFC 6455: mensajes de texto, ping/pong y cierre"""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, max_message: int):
+        self.reader = reader
+        self.writer = writer
+        self.max_message = max_message
+        self.send_lock = asyncio.Lock()  # El bucle de lectura y el turno en curso escriben a la vez
+
+    async def receive(self) -> Optional[str]:
+        """Siguiente mensaje de texto completo; None si el cliente cierra"""
+        fragments = []
+        size = 0
+        while True:
+            header = await self.reader.readexactly(2)
+            fin, opcode = header[0] & 0x80, header[0] & 0x0F
+            masked, length = header[1] & 0x80, header[1] & 0x7F
+            if length == 126:
+                length = struct.unpack("!H", await self.reader.readexactly(2))[0]
+            elif length == 127:
+                length = struct.unpack("!Q", await self.reader.readexactly(8))[0]
+            if size + length > self.max_message:
+                await self.close(1009)
+                return None
+            mask = await self.reader.readexactly(4) if masked else b""
+            payload = unmask(await self.reader.readexactly(length), mask) if masked else await self.reader.readexactly(length)
+
+            if opcode == WS_CLOSE:
+                await self.close(1000)
+                return None
+            if opcode == WS_PING:
+                await self.send_frame(WS_PONG, payload)
+                continue
+            if opcode == WS_PONG:
+                continue
+            fragments.append(payload)
+            size += length
+            if fin:
+                return b"".join(fragments).decode('utf-8', errors='replace')
+
+    async def send_text(self, text: str):
+        await self.send_frame(WS_TEXT, text.encode('utf-8'))
+
+    async def send_frame(self, opcode: int, payload: bytes):
+        length = len(payload)
+        if length < 126:
+            header = struct.pack("!BB", 0x80 | opcode, length)
+        elif length < 1 << 16:
+            header = struct.pack("!BBH", 0x80 | opcode, 126, length)
+        else:
+            header = struct.pack("!BBQ", 0x80 | opcode, 127, length)
+        async with self.send_lock:
+            self.writer.write(header + payload)
+            await self.writer.drain()
+
+    async def close(self, code: int):
+        try:
+            await self.send_frame(WS_CLOSE, struct.pack("!H", code))
+        except ConnectionError:
+            pass
+
+
+def unmask(payload: bytes, mask: bytes) -> bytes:
+    # XOR de todo el bloque como un único entero: mucho más rápido que byte a byte en Python
+    if not payload:
+        return payload
+    key = (mask * (len(payload) // 4 + 1))[:len(payload)]
+    return (int.from_bytes(payload, 'big') ^ int.from_bytes(key, 'big')).to_bytes(len(payload), 'big')
+
+
+def serve(engine: ChatEngine, host: str = "127.0.0.1", port: int = 8080, **options):
+    """Atiende peticiones hasta Ctrl+C y luego cierra el worker"""
+    server = ChatServer(engine, host, port, **options)
+    try:
+        asyncio.run(server.run())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        engine.close()
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Servidor HTTP/WebSocket del asistente")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--max-sessions", type=int, default=10000)
+    parser.add_argument("--max-concurrent", type=int, default=64, help="peticiones simultáneas al modelo")
+    args = parser.parse_args(argv)
+    exporter = start_metrics()
+    store = ConversationStore()
+    worker = RequestWorker(create_backend(args.max_concurrent), cache=ResponseCache(),
+                           max_concurrent=args.max_concurrent)
+    try:
+        serve(ChatEngine(worker, store=store), args.host, args.port, max_sessions=args.max_sessions)
+    finally:
+        store.close()
+        if exporter is not None:
+            exporter.close()
+
+
+if __name__ == "__main__":
+    main()
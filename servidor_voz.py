@@ -0,0 +1,406 @@
+"""Servidor de voz en un proceso aparte
+
+Protocolo: una línea JSON por mensaje por stdin/stdout.
+  {"id": n, "cmd": "speak", "text": ...}          -> {"id": n, "started": true} al empezar a sonar y
+                                                     {"id": n, "ok": bool, "initialized": bool} al terminar
+  {"id": n, "cmd": "stop"}                         -> corta la frase en curso y descarta las encoladas (sin respuesta)
+  {"id": n, "cmd": "set", "name": ..., "value": ...} -> {"id": n, "ok": bool}
+  {"id": n, "cmd": "status"}                       -> {"id": n, "ok": true, "initialized": ..., ...}
+  {"id": n, "cmd": "warm", "phrases": [...]}       -> sintetiza a disco esas frases cuando esté libre
+  {"cmd": "quit"}
+Al arrancar, el servidor envía {"id": 0, "ready": true, "initialized": bool}.
+El motor solo se usa desde el hilo de voz: speak, set y warm se encolan y stop solo marca la parada.
+"""
+import json
+import os
+import queue
+import subprocess
+import sys
+import threading
+import time
+import concurrent.futures
+from collections import deque
+from typing import Callable, Dict, List, Optional
+
+import pyttsx3
+
+from cache_voz import AudioCache
+
+
+class LocalSpeaker:
+    """Motor pyttsx3 en el propio proceso; solo debe usarlo un hilo a la vez
+
+    La excepción es stop(), que desde cualquier hilo solo marca la parada: la aplica el hilo que
+    está hablando, desde el callback de pyttsx3 o desde el bucle de reproducción.
+    """
+
+    max_heard = 1000
+
+    def __init__(self, audio_cache: Optional[AudioCache] = None):
+        self.engine = None
+        self.initialized = False
+        self.speaking = False
+        self.stopped = False
+        self.audio_cache = audio_cache
+        self.heard = set()  # Frases dichas una vez: a la segunda se guardan en disco
+        self.to_render = deque()  # Frases pendientes de sintetizar a disco
+        self.on_start: Optional[Callable[[], None]] = None  # Aviso de la frase en curso al empezar a sonar
+        self.initialize_engine()
+        if audio_cache is not None:
+            self.initialize_player()
+
+    def initialize_engine(self):
+        try:
+            self.engine = pyttsx3.init()
+            voices = self.engine.getProperty('voices')
+            self.engine.setProperty('rate', 160)
+            self.engine.setProperty('volume', 1.0)
+            # Seleccionar voz en español si está disponible
+            for voice in voices:
+                if 'spanish' in voice.languages or 'es' in voice.languages:
+                    self.engine.setProperty('voice', voice.id)
+                    break
+            self.engine.connect('started-utterance', lambda name: self.started())
+            self.engine.connect('started-word', lambda name, location, length: self.interrupt())
+            self.initialized = True
+        except Exception as e:
+            print(f"Error al inicializar TTS: {e}")
+            self.initialized = False
+
+    def initialize_player(self):
+        try:
+            os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+            import pygame
+            if not pygame.mixer.get_init():
+                pygame.mixer.init()
+            self.mixer = pygame.mixer
+        except Exception as e:
+            print(f"Caché de voz desactivada, no se puede reproducir audio: {e}")
+            self.audio_cache = None
+
+    def audio_key(self, text: str) -> str:
+        engine = self.engine
+        return AudioCache.key(text, engine.getProperty('voice'), engine.getProperty('rate'),
+                              engine.getProperty('volume'))
+
+    def started(self):
+        # Solo avisa una vez por frase; las síntesis a disco de render_pending no tienen aviso
+        on_start, self.on_start = self.on_start, None
+        if on_start is not None:
+            on_start()
+
+    def speak(self, text: str, on_start: Optional[Callable[[], None]] = None) -> bool:
+        """Habla y espera a terminar (o a que se llame a stop); on_start se llama cuando empieza a sonar"""
+        self.speaking = True
+        self.stopped = False
+        self.on_start = on_start
+        try:
+            if self.audio_cache is not None:
+                path = self.audio_cache.get(self.audio_key(text))
+                if path is not None:
+                    return self.play(path)
+                if text in self.heard:
+                    self.to_render.append(text)
+                elif len(self.heard) < self.max_heard:
+                    self.heard.add(text)
+            self.engine.say(text)
+            self.engine.runAndWait()
+            return True
+        except Exception as e:
+            print(f"Error al reproducir voz: {e}")
+            # Reintentar inicialización
+            time.sleep(1)
+            self.initialize_engine()
+            return False
+        finally:
+            self.speaking = False
+            self.on_start = None
+
+    def interrupt(self):
+        # Dentro de runAndWait, en el hilo que habla: es donde pyttsx3 admite engine.stop()
+        if self.stopped:
+            self.engine.stop()
+
+    def play(self, path) -> bool:
+        channel = self.mixer.Sound(str(path)).play()
+        self.started()
+        while channel is not None and channel.get_busy():
+            if self.stopped:
+                channel.stop()
+                break
+            time.sleep(0.01)
+        return True
+
+    def warm(self, phrases: List[str]):
+        """Encola frases conocidas para sintetizarlas a disco en los ratos libres"""
+        self.to_render.extend(phrases)
+
+    def render_pending(self) -> bool:
+        """Sintetiza a disco una frase pendiente; False si no había ninguna"""
+        if self.audio_cache is None or not self.initialized or not self.to_render:
+            return False
+        text = self.to_render.popleft()
+        key = self.audio_key(text)
+        if key in self.audio_cache.files:
+            return True
+        try:
+            self.engine.save_to_file(text, str(self.audio_cache.path(key)))
+            self.engine.runAndWait()
+            self.audio_cache.add(key)
+        except Exception as e:
+            print(f"Error guardando audio: {e}")
+        return True
+
+    def stop(self):
+        """Pide cortar la frase en curso; seguro desde cualquier hilo"""
+        self.stopped = True
+
+    def set_property(self, name: str, value) -> bool:
+        try:
+            self.engine.setProperty(name, value)
+            return True
+        except Exception as e:
+            print(f"Error al cambiar {name} de la voz: {e}")
+            return False
+
+    def status(self) -> dict:
+        status = {"initialized": self.initialized, "speaking": self.speaking, "pid": os.getpid()}
+        if self.audio_cache is not None:
+            status["audio_cache"] = self.audio_cache.stats()
+        return status
+
+    def close(self):
+        self.stop()
+
+
+class SpeechProcess:
+    """Cliente del servidor de voz; un supervisor lo relanza si el proceso muere
+
+    Tiene la misma interfaz que LocalSpeaker, pero el motor vive en otro proceso.
+    """
+
+    min_uptime = 5.0  # Un proceso que muere antes de esto cuenta como fallo de arranque
+    max_restart_delay = 30.0
+
+    def __init__(self):
+        self.initialized = False
+        self.speaking = False
+        self.closed = False
+        self.settings: Dict[str, object] = {}  # Se reaplican tras cada reinicio
+        self.warm_phrases: List[str] = []
+        self.send_lock = threading.Lock()
+        self.pending: Dict[int, concurrent.futures.Future] = {}
+        self.on_start: Dict[int, Callable[[], None]] = {}  # Avisos de "speak" pendientes de empezar
+        self.next_id = 1
+        self.ready = threading.Event()
+        self.restarts = 0
+        self.process: Optional[subprocess.Popen] = None
+        self.start()
+        self.supervisor = threading.Thread(target=self.supervise, daemon=True)
+        self.supervisor.start()
+
+    def start(self):
+        self.ready.clear()
+        # Cada proceso tiene sus peticiones pendientes: si muere, solo fallan las suyas
+        self.pending = {}
+        self.on_start = {}
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__)],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            text=True, encoding='utf-8', bufsize=1,
+        )
+        self.started_at = time.monotonic()
+        threading.Thread(target=self.reader_loop, args=(self.process, self.pending, self.on_start),
+                         daemon=True).start()
+
+    def supervise(self):
+        delay = 1.0
+        while True:
+            process = self.process
+            process.wait()
+            if self.closed:
+                return
+            print(f"El servidor de voz terminó (código {process.returncode}); reiniciando")
+            if time.monotonic() - self.started_at < self.min_uptime:
+                time.sleep(delay)
+                delay = min(delay * 2, self.max_restart_delay)
+            else:
+                delay = 1.0
+            if self.closed:
+                return
+            self.restarts += 1
+            self.start()
+            for name, value in self.settings.items():
+                self.send("set", name=name, value=value)
+            if self.warm_phrases:
+                self.send("warm", phrases=self.warm_phrases)
+
+    def reader_loop(self, process: subprocess.Popen, pending: Dict[int, concurrent.futures.Future],
+                    on_start: Dict[int, Callable[[], None]]):
+        for line in process.stdout:
+            try:
+                message = json.loads(line)
+            except ValueError:
+                continue
+            if "initialized" in message:
+                self.initialized = message["initialized"]
+            if message.get("ready"):
+                self.ready.set()
+                continue
+            callback = on_start.pop(message.get("id"), None)
+            if message.get("started"):
+                if callback is not None:
+                    callback()
+                continue
+            future = pending.pop(message.get("id"), None)
+            if future is not None:
+                future.set_result(message)
+        # El proceso ha muerto: las peticiones en curso fallan sin bloquear a nadie
+        self.initialized = False
+        on_start.clear()
+        for request_id in list(pending):
+            future = pending.pop(request_id, None)
+            if future is not None:
+                future.set_result({"ok": False})
+
+    def send(self, cmd: str, future: Optional[concurrent.futures.Future] = None,
+             on_start: Optional[Callable[[], None]] = None, **args) -> bool:
+        with self.send_lock:
+            request_id = self.next_id
+            self.next_id += 1
+            if future is not None:
+                self.pending[request_id] = future
+            if on_start is not None:
+                self.on_start[request_id] = on_start
+            try:
+                self.process.stdin.write(json.dumps({"id": request_id, "cmd": cmd, **args}) + "\n")
+                self.process.stdin.flush()
+            except (OSError, ValueError):
+                # Proceso caído; el supervisor lo relanzará
+                self.pending.pop(request_id, None)
+                self.on_start.pop(request_id, None)
+                return False
+        return True
+
+    def request(self, cmd: str, timeout: Optional[float] = None,
+                on_start: Optional[Callable[[], None]] = None, **args) -> dict:
+        """Envía una orden y espera su respuesta; si el proceso muere devuelve ok=False"""
+        future = concurrent.futures.Future()
+        if not self.send(cmd, future, on_start, **args):
+            return {"ok": False}
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            return {"ok": False}
+
+    def speak(self, text: str, on_start: Optional[Callable[[], None]] = None) -> bool:
+        self.speaking = True
+        try:
+            return self.request("speak", on_start=on_start, text=text)["ok"]
+        finally:
+            self.speaking = False
+
+    def stop(self):
+        self.send("stop")
+
+    def set_property(self, name: str, value) -> bool:
+        self.settings[name] = value
+        return self.request("set", timeout=5, name=name, value=value)["ok"]
+
+    def status(self) -> dict:
+        status = self.request("status", timeout=2)
+        status["restarts"] = self.restarts
+        return status
+
+    def warm(self, phrases: List[str]):
+        self.warm_phrases.extend(phrases)
+        self.send("warm", phrases=phrases)
+
+    def render_pending(self) -> bool:
+        return False  # Lo hace el propio servidor cuando está libre
+
+    def initialize_engine(self):
+        """El motor se inicializa en el servidor; aquí solo se espera a que arranque"""
+        self.ready.wait(timeout=5)
+
+    def close(self):
+        self.closed = True
+        self.send("quit")
+        try:
+            self.process.wait(timeout=2)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+
+def serve():
+    """Bucle del proceso servidor: lee órdenes por stdin y responde por stdout"""
+    output = sys.stdout
+    sys.stdout = sys.stderr  # Los print del motor no deben mezclarse con el protocolo
+    output_lock = threading.Lock()
+
+    def reply(message: dict):
+        with output_lock:
+            output.write(json.dumps(message) + "\n")
+            output.flush()
+
+    jobs: "queue.Queue" = queue.Queue()
+    stops = 0  # Paradas recibidas: las frases encoladas antes de la última se descartan
+    created = threading.Event()
+    speakers: List[LocalSpeaker] = []
+
+    def speech_loop():
+        # Único hilo que usa el motor: se crea aquí y aquí se atienden speak, set y warm
+        speaker = LocalSpeaker(AudioCache())
+        speakers.append(speaker)
+        created.set()
+        reply({"id": 0, "ready": True, "initialized": speaker.initialized})
+        while True:
+            try:
+                job = jobs.get(timeout=0.2)
+            except queue.Empty:
+                speaker.render_pending()
+                continue
+            if job is None:
+                return
+            cmd, request_id, args = job
+            if cmd == "speak":
+                text, stop_count = args
+                ok = (stop_count == stops and speaker.initialized and speaker.speak(
+                    text, on_start=lambda: reply({"id": request_id, "started": True})))
+                reply({"id": request_id, "ok": ok, "initialized": speaker.initialized})
+            elif cmd == "set":
+                reply({"id": request_id, "ok": speaker.set_property(*args)})
+            elif cmd == "warm":
+                speaker.warm(args)
+
+    thread = threading.Thread(target=speech_loop, daemon=True)
+    thread.start()
+    created.wait()
+    speaker = speakers[0]
+
+    for line in sys.stdin:
+        try:
+            message = json.loads(line)
+        except ValueError:
+            continue
+        cmd = message.get("cmd")
+        if cmd == "speak":
+            jobs.put(("speak", message["id"], (message["text"], stops)))
+        elif cmd == "stop":
+            stops += 1
+            speaker.stop()  # Solo marca la parada; la aplica el hilo de voz
+        elif cmd == "set":
+            jobs.put(("set", message["id"], (message["name"], message["value"])))
+        elif cmd == "warm":
+            jobs.put(("warm", None, message["phrases"]))
+        elif cmd == "status":
+            reply({"id": message["id"], "ok": True, **speaker.status()})  # Solo lee el estado
+        elif cmd == "quit":
+            break
+    speaker.close()
+    jobs.put(None)
+    thread.join(timeout=2)
+
+
+if __name__ == "__main__":
+    serve()
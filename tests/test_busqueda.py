@@ -0,0 +1,49 @@
+"""build_match: nada de lo que escriba el usuario llega a FTS5 como sintaxis"""
+import sqlite3
+
+import pytest
+
+from busqueda import build_match, highlight_segments
+
+
+@pytest.fixture
+def fts():
+    connection = sqlite3.connect(":memory:")
+    connection.execute("CREATE VIRTUAL TABLE docs USING fts5(content, tokenize='unicode61 remove_diacritics 2')")
+    connection.executemany("INSERT INTO docs (content) VALUES (?)",
+                           [("Cómo se configura el servidor",), ("Error NEAR la línea 3",), ("hola mundo",)])
+    yield connection
+    connection.close()
+
+
+def matches(connection, query):
+    match = build_match(query)
+    return [row[0] for row in connection.execute("SELECT content FROM docs WHERE docs MATCH ?", (match,))]
+
+
+def test_words_are_quoted_prefixes():
+    assert build_match("hola mun") == '"hola"* "mun"*'
+    assert build_match('"hola mundo" error') == '"hola mundo" "error"*'
+
+
+def test_operators_and_punctuation_are_escaped():
+    assert build_match('a* OR b- NOT "c"" (d) col:e') == '"a"* "OR"* "b"* "NOT"* "c" "d"* "cole"*'
+
+
+@pytest.mark.parametrize("query", ["", "   ", "*", '""', "-:()^"])
+def test_empty_queries_give_none(query):
+    assert build_match(query) is None
+
+
+@pytest.mark.parametrize("query", ['NEAR(', 'content:hola', 'hola OR', '"abierta', "^mundo", "AND", "a'b"])
+def test_any_query_is_valid_fts5(fts, query):
+    matches(fts, query)  # No debe lanzar sqlite3.OperationalError
+
+
+def test_accents_and_keywords_match_as_text(fts):
+    assert matches(fts, "como configu") == ["Cómo se configura el servidor"]
+    assert matches(fts, "NEAR") == ["Error NEAR la línea 3"]
+
+
+def test_highlight_segments():
+    assert highlight_segments("a \x01hola\x02 b") == [("a ", False), ("hola", True), (" b", False)]
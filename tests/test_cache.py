@@ -0,0 +1,71 @@
+"""ResponseCache: claves normalizadas, caducidad y las dos capas (memoria y disco)"""
+import pytest
+
+import cache
+from cache import ResponseCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache.time, "time", clock)
+    return clock
+
+
+def messages(question, system="Eres un asistente."):
+    return [{"role": "system", "content": system}, {"role": "user", "content": question}]
+
+
+def test_key_ignores_case_and_whitespace():
+    key = ResponseCache.key("gpt-4o", messages("¿Qué hora es?"), 0.7)
+    assert ResponseCache.key("gpt-4o", messages("  ¿qué   HORA\nes? "), 0.7) == key
+    assert ResponseCache.key("gpt-4o", messages("¿Qué hora es?"), 0.701) == key  # Se redondea a 2 decimales
+
+
+def test_key_depends_on_model_temperature_roles_and_system_prompt():
+    key = ResponseCache.key("gpt-4o", messages("hola"), 0.7)
+    assert ResponseCache.key("gpt-4o-mini", messages("hola"), 0.7) != key
+    assert ResponseCache.key("gpt-4o", messages("hola"), 0.2) != key
+    assert ResponseCache.key("gpt-4o", messages("hola", system="Otro prompt."), 0.7) != key
+    assert ResponseCache.key("gpt-4o", [{"role": "assistant", "content": "hola"}], 0.7) != \
+        ResponseCache.key("gpt-4o", [{"role": "user", "content": "hola"}], 0.7)
+
+
+def test_entries_expire_after_the_ttl(clock):
+    responses = ResponseCache(path=None, ttl=60)
+    responses.put("k", "respuesta")
+    clock.now += 60
+    assert responses.get("k") == "respuesta"
+    clock.now += 1
+    assert responses.get("k") is None
+    assert responses.stats()["entries"] == 0
+
+
+def test_disk_entries_survive_a_restart_until_they_expire(tmp_path, clock):
+    path = str(tmp_path / "response_cache.db")
+    ResponseCache(path, ttl=60).put("k", "respuesta")
+    reopened = ResponseCache(path, ttl=60)
+    assert reopened.get("k") == "respuesta"
+    assert reopened.stats()["disk_hits"] == 1
+    clock.now += 61
+    assert ResponseCache(path, ttl=60).get("k") is None
+
+
+def test_memory_is_bounded_by_entries_and_bytes():
+    responses = ResponseCache(path=None, max_entries=2, max_bytes=10)
+    responses.put("a", "12345")
+    responses.put("b", "12345")
+    responses.get("a")  # "a" pasa a ser la más reciente
+    responses.put("c", "1")
+    assert responses.get("b") is None
+    assert responses.get("a") == "12345"
+    responses.put("d", "1234567890")
+    assert responses.stats()["bytes"] <= 10
@@ -0,0 +1,75 @@
+"""TextBuffer: el texto, el cursor y la longitud siguen coherentes tras cada edición"""
+import pygame
+
+from entrada import TextBuffer
+
+
+def check(buffer: TextBuffer, text: str, cursor):
+    assert buffer.text() == text
+    assert len(buffer) == len(text)
+    assert buffer.cursor == cursor
+
+
+def test_insert_and_delete_across_lines():
+    buffer = TextBuffer("hola\nmundo")
+    check(buffer, "hola\nmundo", (1, 5))
+    buffer.move_to(1, 0)
+    buffer.backspace()  # Une las dos líneas
+    check(buffer, "holamundo", (0, 4))
+    buffer.insert("\n¿qué tal?\n")
+    check(buffer, "hola\n¿qué tal?\nmundo", (2, 0))
+    buffer.move_to(0, 4)
+    buffer.delete()
+    check(buffer, "hola¿qué tal?\nmundo", (0, 4))
+
+
+def test_edges_do_nothing():
+    buffer = TextBuffer("ab")
+    buffer.delete()
+    check(buffer, "ab", (0, 2))
+    buffer.move_to(0, 0)
+    buffer.backspace()
+    check(buffer, "ab", (0, 0))
+
+
+def test_vertical_moves_keep_the_column():
+    buffer = TextBuffer("una línea larga\nx\notra línea larga")
+    buffer.move_to(0, 10)
+    buffer.move(pygame.K_DOWN)
+    assert buffer.cursor == (1, 1)  # La línea corta recorta la columna...
+    buffer.move(pygame.K_DOWN)
+    assert buffer.cursor == (2, 10)  # ...pero se recupera en la siguiente
+    buffer.move(pygame.K_DOWN)
+    assert buffer.cursor == (2, 16)  # Bajar desde la última línea va al final
+
+
+def test_horizontal_moves_wrap_between_lines():
+    buffer = TextBuffer("ab\ncd")
+    buffer.move_to(1, 0)
+    buffer.move(pygame.K_LEFT)
+    assert buffer.cursor == (0, 2)
+    buffer.move(pygame.K_RIGHT)
+    assert buffer.cursor == (1, 0)
+    buffer.move(pygame.K_END)
+    assert buffer.cursor == (1, 2)
+    buffer.move(pygame.K_HOME)
+    assert buffer.cursor == (1, 0)
+
+
+def test_selection_is_replaced_in_one_step():
+    buffer = TextBuffer("uno\ndos\ntres")
+    buffer.move_to(0, 1)
+    buffer.move_to(2, 2, select=True)
+    assert buffer.selected_text() == "no\ndos\ntr"
+    buffer.insert("X")
+    check(buffer, "uXes", (0, 2))
+    assert buffer.selection() is None
+
+
+def test_select_all_and_segment():
+    buffer = TextBuffer("primera\nsegunda")
+    buffer.select_all()
+    assert buffer.selected_text() == "primera\nsegunda"
+    buffer.move_to(1, 3)
+    assert buffer.segment(1, 1, 6) == "egund"
+    assert buffer.segment(0, 2, 5) == "ime"
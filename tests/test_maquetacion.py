@@ -0,0 +1,52 @@
+"""HeightIndex: sumas prefijas y búsqueda por desplazamiento frente a un recorrido lineal"""
+import random
+
+from maquetacion import HeightIndex
+
+
+def linear_find(heights, y):
+    top = 0
+    for index, height in enumerate(heights):
+        if y < top + height:
+            return index
+        top += height
+    return len(heights)
+
+
+def check(index: HeightIndex, heights):
+    assert index.total() == sum(heights)
+    for count in range(len(heights) + 1):
+        assert index.prefix(count) == sum(heights[:count])
+    for y in range(-2, sum(heights) + 3):
+        assert index.find(y) == (0 if y < 0 else linear_find(heights, y)), y
+
+
+def test_find_on_boundaries():
+    index = HeightIndex()
+    index.rebuild([10, 20, 30])
+    assert [index.find(y) for y in (0, 9, 10, 29, 30, 59, 60)] == [0, 0, 1, 1, 2, 2, 3]
+
+
+def test_zero_heights_are_skipped():
+    index = HeightIndex()
+    for height in (0, 5, 0, 0, 5):
+        index.append(height)
+    assert index.find(0) == 1
+    assert index.find(5) == 4
+
+
+def test_append_update_and_rebuild_agree():
+    rng = random.Random(3)
+    appended, rebuilt = HeightIndex(), HeightIndex()
+    heights = []
+    for _ in range(40):
+        heights.append(rng.randint(0, 12))
+        appended.append(heights[-1])
+        check(appended, heights)
+    for _ in range(40):
+        position = rng.randrange(len(heights))
+        heights[position] = rng.randint(0, 12)
+        appended.update(position, heights[position])
+    check(appended, heights)
+    rebuilt.rebuild(heights)
+    assert rebuilt.tree == appended.tree
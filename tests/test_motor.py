@@ -0,0 +1,125 @@
+"""Guardado de las sesiones de ChatEngine: cada mensaje llega al historial al añadirse"""
+import sqlite3
+import subprocess
+import sys
+import textwrap
+import time
+
+from historial import ConversationStore
+from motor import ChatEngine
+
+
+class SilentWorker:
+    """Worker que acepta las peticiones y no responde hasta que se le pide"""
+
+    def __init__(self):
+        self.requests = []
+        self.cancelled = []
+
+    def submit(self, session_id, messages, on_chunk, on_done, use_cache, stream=True, on_retry=None):
+        self.requests.append((session_id, messages, on_done))
+
+    def cancel(self, session_id):
+        self.cancelled.append(session_id)
+
+    def answer(self, text):
+        self.requests.pop(0)[2](text)
+
+
+def stored(path):
+    connection = sqlite3.connect(path)
+    try:
+        return connection.execute(
+            "SELECT conversation_id, position, sender, content FROM messages ORDER BY conversation_id, position"
+        ).fetchall()
+    finally:
+        connection.close()
+
+
+def make_engine(tmp_path):
+    store = ConversationStore(str(tmp_path / "chat_history.db"), str(tmp_path / "chat_history.json"))
+    worker = SilentWorker()
+    return ChatEngine(worker, store=store, cache_responses=False), worker, store
+
+
+def test_question_is_saved_before_the_reply(tmp_path):
+    engine, worker, store = make_engine(tmp_path)
+    session = engine.create_session()
+    assert engine.send(session, "¿Qué hora es?", lambda chunk: None, lambda text: None)
+    store.flush()
+    assert stored(tmp_path / "chat_history.db") == [(1, 0, "Tú", "¿Qué hora es?")]
+    worker.answer("Las tres.")
+    store.close()
+    assert stored(tmp_path / "chat_history.db") == [(1, 0, "Tú", "¿Qué hora es?"), (1, 1, "Asistente", "Las tres.")]
+
+
+def test_cancel_keeps_the_question_in_the_store(tmp_path):
+    engine, worker, store = make_engine(tmp_path)
+    session = engine.create_session()
+    engine.send(session, "pregunta", lambda chunk: None, lambda text: None)
+    engine.close_session(session)
+    worker.answer("respuesta tardía")  # Llega después de cancelar: se descarta
+    store.close()
+    assert session.turns == []
+    assert stored(tmp_path / "chat_history.db") == [(1, 0, "Tú", "pregunta")]
+
+
+def test_greeting_and_notices_wait_for_the_first_question(tmp_path):
+    engine, worker, store = make_engine(tmp_path)
+    session = engine.create_session()
+    engine.note(session, "Asistente", "Hola")
+    engine.note(session, "Sistema", "Voz activada")
+    store.flush()
+    assert stored(tmp_path / "chat_history.db") == []
+    engine.send(session, "uno", lambda chunk: None, lambda text: None)
+    store.close()
+    assert stored(tmp_path / "chat_history.db") == [
+        (1, 0, "Asistente", "Hola"), (1, 1, "Sistema", "Voz activada"), (1, 2, "Tú", "uno"),
+    ]
+    # El saludo es contexto para el modelo; el aviso no
+    assert [turn["role"] for turn in session.turns] == ["assistant", "user"]
+
+
+def test_resume_appends_after_stored_notices(tmp_path):
+    engine, worker, store = make_engine(tmp_path)
+    session = engine.create_session()
+    engine.note(session, "Sistema", "aviso")
+    engine.send(session, "uno", lambda chunk: None, lambda text: None)
+    worker.answer("respuesta")
+    conversation_id = session.conversation_id
+    resumed = engine.create_session()
+    engine.resume(resumed, conversation_id, store.load_messages(conversation_id))
+    engine.send(resumed, "dos", lambda chunk: None, lambda text: None)
+    store.close()
+    assert [row[1:] for row in stored(tmp_path / "chat_history.db")] == [
+        (0, "Sistema", "aviso"), (1, "Tú", "uno"), (2, "Asistente", "respuesta"), (3, "Tú", "dos"),
+    ]
+
+
+def test_question_survives_a_killed_process(tmp_path):
+    """Se mata el proceso con la respuesta aún en curso: la pregunta ya está en la base de datos"""
+    script = textwrap.dedent(f"""
+        import sys, time
+        sys.path[:0] = {sys.path!r}
+        from test_motor import make_engine
+        import pathlib
+        engine, worker, store = make_engine(pathlib.Path({str(tmp_path)!r}))
+        engine.send(engine.create_session(), "no me pierdas", lambda chunk: None, lambda text: None)
+        time.sleep(60)
+    """)
+    child = subprocess.Popen([sys.executable, "-c", script])
+    try:
+        deadline = time.monotonic() + 10
+        rows = []
+        while time.monotonic() < deadline and not rows:
+            time.sleep(0.05)
+            if (tmp_path / "chat_history.db").exists():
+                try:
+                    rows = stored(tmp_path / "chat_history.db")
+                except sqlite3.OperationalError:
+                    pass  # Tablas aún sin crear
+        assert child.poll() is None, "el proceso debía seguir esperando la respuesta"
+    finally:
+        child.kill()
+        child.wait()
+    assert rows == [(1, 0, "Tú", "no me pierdas")]
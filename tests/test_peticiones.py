@@ -0,0 +1,78 @@
+"""CircuitBreaker: cerrado, abierto y semiabierto con una sola petición de prueba"""
+import pytest
+
+import peticiones
+from peticiones import CircuitBreaker
+
+
+class Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(peticiones.time, "monotonic", clock)
+    return clock
+
+
+def open_breaker(threshold=3):
+    breaker = CircuitBreaker(failure_threshold=threshold, reset_timeout=30.0)
+    for _ in range(threshold):
+        assert breaker.allow()
+        breaker.record_failure()
+    return breaker
+
+
+def test_opens_after_the_threshold(clock):
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30.0)
+    breaker.record_failure()
+    breaker.record_failure()
+    assert not breaker.is_open() and breaker.allow()
+    breaker.record_failure()
+    assert breaker.is_open() and not breaker.allow()
+    clock.now += 10
+    assert breaker.retry_in() == 20
+
+
+def test_success_resets_the_count(clock):
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30.0)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.allow()
+
+
+def test_half_open_lets_one_probe_through(clock):
+    breaker = open_breaker()
+    clock.now += 30
+    assert not breaker.is_open()
+    assert not breaker.is_open()  # Consultar no ocupa la prueba
+    assert breaker.allow()
+    assert breaker.is_open() and not breaker.allow()  # Solo una a la vez
+
+
+def test_probe_success_closes(clock):
+    breaker = open_breaker()
+    clock.now += 30
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.allow() and breaker.allow()
+    assert breaker.retry_in() == 0.0
+
+
+def test_probe_failure_reopens_for_a_full_timeout(clock):
+    breaker = open_breaker()
+    clock.now += 30
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.is_open()
+    clock.now += 29
+    assert not breaker.allow()
+    clock.now += 1
+    assert breaker.allow()
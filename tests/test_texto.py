@@ -0,0 +1,79 @@
+"""TextRenderer: lo que se dibuja mide siempre lo mismo que font.size()"""
+import os
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import pygame
+import pytest
+
+from texto import GlyphAtlas, TextRenderer
+
+
+class MonoFont:
+    """Fuente monoespaciada de mentira: cada carácter mide 7 px y no hay kerning"""
+
+    width = 7
+
+    def __init__(self):
+        self.rendered = []
+
+    def get_height(self):
+        return 14
+
+    def size(self, text):
+        return self.width * len(text), 14
+
+    def render(self, text, antialias, color):
+        self.rendered.append(text)
+        surface = pygame.Surface((max(self.size(text)[0], 1), 14), pygame.SRCALPHA)
+        surface.fill((*color, 255))
+        return surface
+
+
+class KernedFont(MonoFont):
+    """Como MonoFont, pero el par "AV" se junta un píxel"""
+
+    def size(self, text):
+        return self.width * len(text) - text.count("AV"), 14
+
+
+@pytest.fixture(autouse=True)
+def display():
+    pygame.init()
+    yield
+    pygame.quit()
+
+
+def test_monospace_runs_are_composed_from_the_atlas():
+    font = MonoFont()
+    renderer = TextRenderer()
+    surface = renderer.render("def f(x): return x", font, (0, 0, 0), cache=False)
+    assert surface.get_width() == font.size("def f(x): return x")[0]
+    font.rendered.clear()
+    renderer.render("return f(x)", font, (0, 0, 0), cache=False)
+    assert font.rendered == []  # Todo sale del atlas, sin font.render de la cadena
+
+
+def test_kerned_fonts_fall_back_to_whole_strings():
+    font = KernedFont()
+    renderer = TextRenderer()
+    surface = renderer.render("AVATAR", font, (0, 0, 0), cache=False)
+    assert surface.get_width() == font.size("AVATAR")[0]
+    assert "AVATAR" in font.rendered
+    assert renderer.atlases[(font, (0, 0, 0))].additive is False
+
+
+def test_new_characters_are_checked_before_composing():
+    font = MonoFont()
+    atlas = GlyphAtlas(font, (0, 0, 0))
+    assert atlas.render("abc") is not None
+    assert "ñ" not in atlas.verified
+    assert atlas.render("año").get_width() == 21
+    assert "ñ" in atlas.verified
+
+
+def test_real_font_width_matches_size():
+    font = pygame.font.Font(None, 20)
+    renderer = TextRenderer()
+    for text in ("AVATAR Wave To", "x = compute(value, other) + 42  # comentario", "Tú ¿qué?"):
+        assert renderer.render(text, font, (0, 0, 0)).get_width() == font.size(text)[0]
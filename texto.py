@@ -0,0 +1,190 @@
+import json
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+import pygame
+
+
+# Caracteres con los que se comprueba si una fuente se puede componer glifo a glifo
+PROBE = "".join(chr(code) for code in range(32, 127))
+
+
+class GlyphAtlas:
+    """Glifos pre-rasterizados de una fuente y un color, empaquetados en páginas
+
+    Solo compone cadenas de fuentes aditivas: las que miden con font.size() exactamente la suma
+    de sus glifos (sin kerning ni avances fraccionarios, como las monoespaciadas). Se comprueba
+    una vez con PROBE y después con cada carácter nuevo.
+    """
+
+    page_size = 512
+
+    def __init__(self, font: pygame.font.Font, color: Tuple[int, int, int]):
+        self.font = font
+        self.color = color
+        self.height = font.get_height()
+        self.pages: List[pygame.Surface] = []
+        self.glyphs: Dict[str, Tuple[pygame.Surface, pygame.Rect]] = {}
+        self.cursor_x = 0
+        self.cursor_y = 0
+        self.additive: Optional[bool] = None  # Se decide en el primer uso
+        self.verified: Set[str] = set()  # Caracteres que se componen sin cambiar la medida
+        self.new_page()
+
+    def new_page(self):
+        self.pages.append(pygame.Surface((self.page_size, self.page_size), pygame.SRCALPHA))
+        self.cursor_x = 0
+        self.cursor_y = 0
+
+    def glyph(self, char: str) -> Tuple[pygame.Surface, pygame.Rect]:
+        entry = self.glyphs.get(char)
+        if entry is None:
+            entry = self.add_glyph(char)
+        return entry
+
+    def add_glyph(self, char: str) -> Tuple[pygame.Surface, pygame.Rect]:
+        surface = self.font.render(char, True, self.color)
+        width = surface.get_width()
+        # Empaquetado por filas: se pasa a la fila o a la página siguiente si no cabe
+        if self.cursor_x + width > self.page_size:
+            self.cursor_x = 0
+            self.cursor_y += self.height
+        if self.cursor_y + self.height > self.page_size:
+            self.new_page()
+        page = self.pages[-1]
+        area = pygame.Rect(self.cursor_x, self.cursor_y, width, surface.get_height())
+        page.blit(surface, area, special_flags=pygame.BLEND_RGBA_MAX)
+        self.cursor_x += width
+        self.glyphs[char] = (page, area)
+        return page, area
+
+    def width(self, text: str) -> int:
+        return sum(self.glyph(char)[1].width for char in text)
+
+    def check(self, char: str) -> bool:
+        """El glifo mide su avance y, junto a cada carácter de PROBE (a ambos lados), no hay kerning"""
+        size = self.font.size
+        if size(char)[0] != self.glyph(char)[1].width or size(char * 4)[0] != 4 * size(char)[0]:
+            return False
+        # Un par por cada carácter, separados por espacios: una sola medida cubre todos los pares
+        for text in (" ".join(char + other for other in PROBE), " ".join(other + char for other in PROBE)):
+            if size(text)[0] != self.width(text):
+                return False
+        return True
+
+    def composable(self, text: str) -> bool:
+        if self.additive is None:
+            self.additive = all(self.check(char) for char in PROBE)
+            if self.additive:
+                self.verified.update(PROBE)
+        if not self.additive:
+            return False
+        if not self.verified.issuperset(text):
+            for char in set(text) - self.verified:
+                if not self.check(char):
+                    return False  # No se marca: la cadena se renderiza entera y el resto sigue igual
+                self.verified.add(char)
+        return True
+
+    def render(self, text: str) -> Optional[pygame.Surface]:
+        """Compone la cadena a partir de los glifos; None si la fuente no lo admite"""
+        if not text or not self.composable(text):
+            return None
+        run = [self.glyph(char) for char in text]
+        x = 0
+        blits = []
+        for page, area in run:
+            blits.append((page, (x, 0), area, pygame.BLEND_RGBA_MAX))
+            x += area.width
+        surface = pygame.Surface((max(x, 1), self.height), pygame.SRCALPHA)
+        surface.blits(blits, doreturn=False)
+        return surface
+
+
+class TextRenderer:
+    """Dibuja texto con atlas de glifos y una caché LRU de cadenas recientes
+
+    El texto se mide con font.size() (ajuste de líneas, cursor), así que solo se compone desde el
+    atlas con fuentes en las que la suma de los glifos mide lo mismo (en la práctica las
+    monoespaciadas: bloques de código). Las demás cadenas se renderizan enteras con font.render.
+    """
+
+    max_cached_strings = 512
+
+    def __init__(self):
+        self.atlases: Dict[tuple, GlyphAtlas] = {}
+        self.strings: "OrderedDict[tuple, pygame.Surface]" = OrderedDict()
+
+    def render(self, text: str, font: pygame.font.Font, color: Tuple[int, int, int],
+               cache: bool = True) -> pygame.Surface:
+        """Devuelve la superficie de la cadena; cache=False evita ocupar la LRU"""
+        key = (text, font, tuple(color))
+        surface = self.strings.get(key)
+        if surface is not None:
+            self.strings.move_to_end(key)
+            return surface
+
+        atlas_key = (font, tuple(color))
+        atlas = self.atlases.get(atlas_key)
+        if atlas is None:
+            atlas = GlyphAtlas(font, tuple(color))
+            self.atlases[atlas_key] = atlas
+
+        surface = atlas.render(text)
+        if surface is None:
+            surface = font.render(text, True, color)
+        if not cache:
+            return surface
+        self.strings[key] = surface
+        if len(self.strings) > self.max_cached_strings:
+            self.strings.popitem(last=False)
+        return surface
+
+
+class FontLoader:
+    """Fuentes del sistema con la ruta resuelta guardada en disco
+
+    Resolver un nombre recorre la lista de fuentes del sistema (fc-list en Linux); con la ruta
+    guardada, los arranques siguientes abren el archivo directamente. Borrar el archivo la renueva.
+    """
+
+    def __init__(self, cache_path: str = 'font_cache.json'):
+        self.cache_path = Path(cache_path)
+        self.paths: Dict[str, Optional[str]] = {}
+        self.fonts: Dict[tuple, pygame.font.Font] = {}
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                self.paths = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+    def path(self, name: str, bold: bool = False) -> Optional[str]:
+        key = f"{name}|{'bold' if bold else 'regular'}"
+        if key in self.paths:
+            path = self.paths[key]
+            if path is None or Path(path).exists():
+                return path
+        path = pygame.font.match_font(name, bold=bold)
+        self.paths[key] = path
+        try:
+            with open(self.cache_path, 'w', encoding='utf-8') as f:
+                json.dump(self.paths, f, indent=2)
+        except OSError as e:
+            print(f"No se pudo guardar la caché de fuentes: {e}")
+        return path
+
+    def load(self, name: str, size: int, bold: bool = False, italic: bool = False) -> pygame.font.Font:
+        """Equivale a pygame.font.SysFont(name, size, bold, italic)"""
+        key = (name, size, bold, italic)
+        font = self.fonts.get(key)
+        if font is None:
+            path = self.path(name, bold)
+            font = pygame.font.Font(path, size)
+            # Sin variante negrita (o sin la fuente), SysFont simula la negrita
+            if bold and path == self.path(name):
+                font.set_bold(True)
+            if italic:
+                font.set_italic(True)  # Cursiva simulada, como SysFont sin variante cursiva
+            self.fonts[key] = font
+        return font
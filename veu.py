@@ -1,54 +1,200 @@
-import pyttsx3
-import threading
-import time
-
-class VoiceControl:
-    def __init__(self):
-        self.engine = None
-        self.active = True  # Activado por defecto
-        self.initialized = False
-        self.lock = threading.Lock()
-        self.initialize_engine()
-
-    def initialize_engine(self):
-        try:
-            self.engine = pyttsx3.init()
-            voices = self.engine.getProperty('voices')
-            self.engine.setProperty('rate', 160)
-            self.engine.setProperty('volume', 1.0)
-            # Seleccionar voz en español si está disponible
-            for voice in voices:
-                if 'spanish' in voice.languages or 'es' in voice.languages:
-                    self.engine.setProperty('voice', voice.id)
-                    break
-            self.initialized = True
-        except Exception as e:
-            print(f"Error al inicializar TTS: {e}")
-            self.initialized = False
-
-    def speak(self, text):
-        if not self.active or not self.initialized:
-            return
-            
-        def speak_thread():
-            try:
-                with self.lock:
-                    self.engine.say(text)
-                    self.engine.runAndWait()
-            except Exception as e:
-                print(f"Error al reproducir voz: {e}")
-                # Reintentar inicialización
-                time.sleep(1)
-                self.initialize_engine()
-
-        threading.Thread(target=speak_thread, daemon=True).start()
-
-    def toggle(self):
-        with self.lock:
-            self.active = not self.active
-            if self.active and not self.initialized:
-                self.initialize_engine()
-        return self.active
-
-# Instancia global
-voice_control = VoiceControl()
\ No newline at end of file
+import concurrent.futures
+import os
+import queue
+import re
+import threading
+import time
+
+from cache_voz import AudioCache
+from metricas import TTS_FIRST_AUDIO_SECONDS
+from perfil import startup
+from servidor_voz import LocalSpeaker, SpeechProcess
+
+# Fin de frase: puntuación (con comillas o paréntesis de cierre) seguida de espacio, o salto de línea
+SENTENCE_END = re.compile(r'[.!?…:;]+["\')\]»]*\s+|\n+')
+
+
+class SentenceSplitter:
+    """Acumula texto en streaming y devuelve las frases a medida que se completan"""
+
+    def __init__(self):
+        self.buffer = ""
+
+    def feed(self, text: str) -> list:
+        self.buffer += text
+        sentences = []
+        start = 0
+        for match in SENTENCE_END.finditer(self.buffer):
+            sentence = self.buffer[start:match.end()].strip()
+            if sentence:
+                sentences.append(sentence)
+            start = match.end()
+        self.buffer = self.buffer[start:]
+        return sentences
+
+    def flush(self) -> list:
+        rest = self.buffer.strip()
+        self.buffer = ""
+        return [rest] if rest else []
+
+
+class VoiceControl:
+    max_queued = 32  # Frases en espera como máximo
+
+    def __init__(self, out_of_process: bool = False):
+        self.active = True  # Activado por defecto
+        self.lock = threading.Lock()
+        self.queue: "queue.Queue" = queue.Queue(maxsize=self.max_queued)
+        self.splitter = SentenceSplitter()
+        self.generation = 0  # Cambia con cada interrupción; las frases de antes se descartan
+        self.out_of_process = out_of_process
+        self.speaker = None  # Se crea en el hilo de voz para no retrasar el arranque
+        self.ready = threading.Event()
+        self.warm_phrases = []
+        self.first_queued = None  # Instante en que la respuesta actual encoló su primera frase
+        self.calls: "queue.Queue" = queue.Queue()  # Órdenes para el motor, que solo usa el hilo de voz
+        # Un único hilo usa el motor: pyttsx3 no admite llamadas concurrentes
+        self.worker = threading.Thread(target=self.worker_loop, daemon=True)
+        self.worker.start()
+
+    @property
+    def initialized(self) -> bool:
+        return self.speaker is not None and self.speaker.initialized
+
+    def start_speaker(self):
+        with startup.phase("motor de voz"):
+            # Fuera de proceso, un fallo del motor no bloquea ni tumba la interfaz
+            if self.out_of_process:
+                speaker = SpeechProcess()
+                speaker.initialize_engine()
+            else:
+                speaker = LocalSpeaker(AudioCache())
+            with self.lock:
+                speaker.warm(self.warm_phrases)
+                self.speaker = speaker
+        self.ready.set()
+
+    def call(self, function) -> concurrent.futures.Future:
+        """Ejecuta function(speaker) en el hilo de voz, entre frase y frase"""
+        future = concurrent.futures.Future()
+        self.calls.put((function, future))
+        return future
+
+    def run_calls(self):
+        while True:
+            try:
+                function, future = self.calls.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                future.set_result(function(self.speaker))
+            except Exception as e:
+                future.set_exception(e)
+
+    def worker_loop(self):
+        self.start_speaker()
+        while True:
+            self.run_calls()
+            try:
+                generation, sentence = self.queue.get(timeout=0.2)
+            except queue.Empty:
+                # Sin nada que decir, se aprovecha para sintetizar frases conocidas a disco
+                with self.lock:
+                    speaker = self.speaker
+                speaker.render_pending()
+                continue
+            # El lock solo cubre el estado: toggle() y stop() no deben esperar a que acabe la frase
+            with self.lock:
+                if generation != self.generation or not self.active or not self.initialized:
+                    continue
+                speaker = self.speaker
+                first_queued, self.first_queued = self.first_queued, None
+            # Se mide cuando el audio empieza a sonar (tras sintetizar o al reproducir de la caché)
+            on_start = None
+            if first_queued is not None:
+                on_start = lambda start=first_queued: TTS_FIRST_AUDIO_SECONDS.observe(time.perf_counter() - start)
+            speaker.speak(sentence, on_start=on_start)
+
+    def available(self) -> bool:
+        # Mientras el motor arranca se encola igualmente; el hilo de voz descarta si falla
+        return self.active and (self.initialized or not self.ready.is_set())
+
+    def enqueue(self, sentences):
+        if sentences and self.first_queued is None and self.queue.empty():
+            self.first_queued = time.perf_counter()
+        for sentence in sentences:
+            try:
+                self.queue.put_nowait((self.generation, sentence))
+            except queue.Full:
+                print("Cola de voz llena, se descarta una frase")
+
+    def feed(self, text):
+        """Texto en streaming: cada frase completa se empieza a leer sin esperar al resto"""
+        if not self.available():
+            return
+        self.enqueue(self.splitter.feed(text))
+
+    def finish(self):
+        """Fin de la respuesta: se lee el último trozo aunque no acabe en punto"""
+        if not self.available():
+            return
+        self.enqueue(self.splitter.flush())
+
+    def speak(self, text):
+        self.feed(text)
+        self.finish()
+
+    def stop(self):
+        """Interrumpe la lectura en curso y vacía la cola"""
+        with self.lock:
+            self.generation += 1
+            self.splitter = SentenceSplitter()
+            self.first_queued = None
+        while True:
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                break
+        if self.speaker is not None:
+            self.speaker.stop()
+
+    def warm(self, phrases):
+        """Precarga en la caché de audio frases que se repiten (saludo, avisos, errores)"""
+        sentences = []
+        for phrase in phrases:
+            splitter = SentenceSplitter()
+            sentences += splitter.feed(phrase) + splitter.flush()
+        with self.lock:
+            if self.speaker is None:
+                self.warm_phrases += sentences  # Se pasan al motor cuando arranque
+            else:
+                self.speaker.warm(sentences)
+
+    def set_voice(self, voice_id: str) -> bool:
+        return self.call(lambda speaker: speaker.set_property('voice', voice_id)).result()
+
+    def set_rate(self, rate: int) -> bool:
+        return self.call(lambda speaker: speaker.set_property('rate', rate)).result()
+
+    def status(self) -> dict:
+        status = {"active": self.active, "queued": self.queue.qsize(), "starting": not self.ready.is_set()}
+        if self.speaker is not None:
+            status.update(self.speaker.status())
+        return status
+
+    def close(self):
+        self.stop()
+        if self.speaker is not None:
+            self.speaker.close()
+
+    def toggle(self):
+        self.stop()
+        with self.lock:
+            self.active = not self.active
+            if self.active and self.ready.is_set() and not self.initialized:
+                # En el hilo de voz: con SpeechProcess puede tardar segundos en arrancar
+                self.call(lambda speaker: speaker.initialize_engine())
+        return self.active
+
+# Instancia global; VOICE_PROCESS=1 lleva el motor de voz a un proceso aparte (servidor_voz.py)
+voice_control = VoiceControl(out_of_process=os.getenv("VOICE_PROCESS", "0") == "1")